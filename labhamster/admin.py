@@ -5,41 +5,35 @@
 # along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
 
 from labhamster.models import *
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ORDER_VAR
 import django.forms
-from django.http import HttpResponse
 import django.utils.html as html
-
+from django.conf import settings
+from django.conf.urls import url
+from django.core.exceptions import PermissionDenied
+from django.db.models import Case, Q, Value, When
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils import timezone
+from collections import OrderedDict
+import io
+from datetime import date, timedelta
+
+from . import currency
+from . import autocomplete
 from . import customforms
-
-
-def export_csv(request, queryset, fields):
-    """
-    Helper method for Admin make_csv action. Exports selected objects as
-    CSV file.
-    fields - OrderedDict of name / field pairs, see Product.make_csv for example
-    """
-    import csv
-
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename=orders.csv'
-
-    writer = csv.writer(response)
-    writer.writerow(fields.keys())
-
-    for o in queryset:
-        columns = []
-        for name, value in fields.items():
-            try:
-                columns.append(eval('o.%s' % value))
-            except:
-                columns.append("")  # capture 'None' fields
-
-        columns = [c for c in columns]
-
-        writer.writerow(columns)
-
-    return response
+from . import filters
+from . import importer
+from . import jobs
+from . import reports
+from . import routers
+from . import search
+from . import transitions
+from .export import export_csv, export_xlsx
+from .paginator import KeysetPaginator
 
 
 class RequestFormAdmin(admin.ModelAdmin):
@@ -60,6 +54,134 @@ class RequestFormAdmin(admin.ModelAdmin):
         return form
 
 
+class SearchAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin that answers changelist searches from the database's
+    full-text index (see labhamster.search). Best matches are listed first
+    unless the user sorts by a column. Falls back to the default icontains
+    search over search_fields if there is no full-text index.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or search.get_backend() is None:
+            return super(SearchAdmin, self).get_search_results(
+                request, queryset, search_term)
+
+        qs = search.search(queryset, search_term)
+        if ORDER_VAR not in request.GET:
+            qs = qs.order_by('-search_rank', *queryset.query.order_by)
+        return qs, False
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin with keyset pagination and estimated counts (see
+    labhamster.paginator) if settings.ADMIN_KEYSET_PAGINATION is set. The
+    count of all rows without filters is then skipped as well.
+    """
+
+    @property
+    def show_full_result_count(self):
+        return not settings.ADMIN_KEYSET_PAGINATION
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        if settings.ADMIN_KEYSET_PAGINATION:
+            return KeysetPaginator(queryset, per_page, orphans,
+                                   allow_empty_first_page)
+        return super(LargeTableAdmin, self).get_paginator(
+            request, queryset, per_page, orphans, allow_empty_first_page)
+
+
+class ReplicaAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin whose changelist (GET only, not actions) is read from the
+    replica database if there is one, see labhamster.routers.
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method in ('GET', 'HEAD'):
+            routers.use_replica()
+        return super(ReplicaAdmin, self).changelist_view(
+            request, extra_context)
+
+
+class BackgroundAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin whose actions over many rows run as background job (see
+    labhamster.jobs) instead of inside the request.
+    """
+
+    def run_in_background(self, request, queryset, kind, description,
+                          **params):
+        """
+        Queue the action if queryset has more than
+        settings.JOB_QUEUE_THRESHOLD rows.
+        @return: Job or None if the action should run right away
+        """
+        job = jobs.enqueue_large(kind, queryset, request.user, description,
+                                 params)
+        if job is not None:
+            self.message_user(request, html.format_html(
+                '{} ({} rows) will run in the background, see '
+                '<a href="{}">job {}</a>.', description, job.total,
+                reverse('admin:labhamster_job_changelist'), job.pk))
+        return job
+
+    def export_in_background(self, request, queryset, format, filename):
+        return self.run_in_background(
+            request, queryset, 'export',
+            'Export %s as %s' % (queryset.model._meta.verbose_name_plural,
+                                 format.upper()),
+            format=format, filename=filename,
+            fields=list(self.csv_fields.items()))
+
+
+class ImportAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin with a CSV upload view (see labhamster.importer), linked from
+    the changelist.
+    """
+    import_kind = None
+
+    change_list_template = 'admin/labhamster/change_list_import.html'
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        urls = [url(r'^import/$', self.admin_site.admin_view(self.import_view),
+                    name='%s_%s_import' % info)]
+        return urls + super(ImportAdmin, self).get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        report = None
+        upload = request.FILES.get('file')
+        if request.method == 'POST' and upload:
+            f = io.TextIOWrapper(upload.file, encoding='utf-8-sig',
+                                 newline='')
+            try:
+                report = importer.import_csv(f, self.import_kind)
+                self.message_user(request, str(report), messages.SUCCESS
+                                  if not report.errors else messages.WARNING)
+            except (ValueError, UnicodeDecodeError) as error:
+                self.message_user(request, 'Import failed: %s' % error,
+                                  messages.ERROR)
+
+        opts = self.model._meta
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Import %s' % opts.verbose_name_plural,
+            opts=opts,
+            report=report,
+            errors=report.errors[:100] if report else [],
+            columns=importer.IMPORTERS[self.import_kind].required,
+        )
+        return TemplateResponse(request, 'admin/labhamster/import.html',
+                                context)
+
+
 class GrantAdmin(admin.ModelAdmin):
     ordering = ('name',)
 
@@ -74,7 +196,8 @@ class CategoryAdmin(admin.ModelAdmin):
 admin.site.register(Category, CategoryAdmin)
 
 
-class VendorAdmin(admin.ModelAdmin):
+class VendorAdmin(ReplicaAdmin, ImportAdmin):
+    import_kind = 'vendor'
 
     fieldsets = ((None, {'fields': (('name',),
                                     ('link', 'login', 'password'),)}),
@@ -91,18 +214,28 @@ class VendorAdmin(admin.ModelAdmin):
 admin.site.register(Vendor, VendorAdmin)
 
 
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(ReplicaAdmin, LargeTableAdmin, BackgroundAdmin,
+                   ImportAdmin, SearchAdmin):
+    import_kind = 'product'
+
     fieldsets = ((None, {'fields': (('name', 'category'),
                                     ('vendor', 'catalog'),
                                     ('manufacturer', 'manufacturer_catalog'),
                                     'link',
                                     ('status', 'shelflife'),
+                                    ('quantity_on_hand',
+                                     'low_stock_threshold'),
                                     'comment',
                                     'location')}),)
 
     list_display = ('name', 'show_vendor', 'category', 'show_catalog',
-                    'status')
-    list_filter = ('status', 'category', 'vendor')
+                    'status', 'quantity_on_hand', 'show_last_ordered',
+                    'show_times_ordered', 'show_open_orders', 'show_spend',
+                    'show_reorder')
+    list_filter = ('status', filters.ReorderFilter,
+                   filters.ProductCategoryFilter, filters.ProductVendorFilter)
+    list_select_related = ('vendor', 'manufacturer', 'category', 'stats',
+                           'forecast')
 
     ordering = ('name',)
     search_fields = ('name', 'comment', 'catalog', 'location', 'vendor__name',
@@ -114,7 +247,22 @@ class ProductAdmin(admin.ModelAdmin):
                'make_low',
                'make_out',
                'make_deprecated',
-               'make_csv']
+               'make_csv',
+               'make_xlsx']
+
+    csv_fields = OrderedDict([('Name', 'name'),
+                              ('Vendor', 'vendor.name'),
+                              ('Vendor Catalog', 'catalog'),
+                              ('Manufacturer', 'manufacturer.name'),
+                              ('Manufacturer Catalog', 'manufacturer_catalog'),
+                              ('Category', 'category.name'),
+                              ('Shelf_life', 'shelflife'),
+                              ('Status', 'status'),
+                              ('On hand', 'quantity_on_hand'),
+                              ('Low stock at', 'low_stock_threshold'),
+                              ('Location', 'location'),
+                              ('Link', 'link'),
+                              ('Comment', 'comment')])
 
     # reduce size of Description text field.
     formfield_overrides = {
@@ -123,50 +271,108 @@ class ProductAdmin(admin.ModelAdmin):
                    'cols': 80})},
     }
 
-    def make_ok(self, request, queryset):
-        n = queryset.update(status='ok')
+    def get_queryset(self, request):
+        """follow all relations displayed by changelist and change form"""
+        qs = super(ProductAdmin, self).get_queryset(request)
+        return qs.select_related(*self.list_select_related)
+
+    def get_urls(self):
+        urls = [url(r'^autocomplete/$',
+                    self.admin_site.admin_view(self.autocomplete_view),
+                    name='labhamster_product_autocomplete')]
+        return urls + super(ProductAdmin, self).get_urls()
+
+    def autocomplete_view(self, request):
+        """JSON product suggestions for the order form (?q=term)"""
+        try:
+            limit = min(int(request.GET.get('limit', autocomplete.LIMIT)),
+                        100)
+        except ValueError:
+            limit = autocomplete.LIMIT
+        results = autocomplete.suggest(request.GET.get('q', ''), limit)
+        return JsonResponse({'results': results})
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Terms containing digits are also looked up as vendor or
+        manufacturer catalog numbers in the catalog key index; catalog
+        matches are listed before the other search results.
+        """
+        qs, distinct = super(ProductAdmin, self).get_search_results(
+            request, queryset, search_term)
+        if not any(c.isdigit() for c in search_term):
+            return qs, distinct
+
+        catalog = queryset.catalog_lookup(search_term).order_by().values('pk')
+        found = queryset.filter(Q(pk__in=catalog) |
+                                Q(pk__in=qs.order_by().values('pk')))
+        if ORDER_VAR in request.GET:
+            return found, False
+
+        found = found.annotate(catalog_match=Case(
+            When(pk__in=catalog, then=Value(1)), default=Value(0),
+            output_field=models.IntegerField()))
+        ordering = ['-catalog_match']
+        if 'search_rank' in qs.query.annotations:
+            found = search.rank(found, search_term)
+            ordering.append('-search_rank')
+        return found.order_by(*(ordering + list(queryset.query.order_by))), \
+            False
+
+    def set_stock_status(self, request, queryset, status):
+        """
+        Set one of the statuses derived from the stock count; products
+        with a count keep the status following from it.
+        """
+        n = queryset.filter(quantity_on_hand__isnull=True)\
+            .update(status=status)
         self.message_user(request, '%i products were updated' % n)
+        counted = queryset.filter(quantity_on_hand__isnull=False).count()
+        if counted:
+            self.message_user(
+                request, '%i products with a count on hand were skipped, '
+                'their status follows the count' % counted, messages.WARNING)
+
+    def make_ok(self, request, queryset):
+        self.set_stock_status(request, queryset, 'ok')
 
     make_ok.short_description = 'Mark selected entries as in stock'
 
     def make_low(self, request, queryset):
-        n = queryset.update(status='low')
-        self.message_user(request, '%i products were updated' % n)
+        self.set_stock_status(request, queryset, 'low')
 
     make_low.short_description = 'Mark selected entries as running low'
 
     def make_out(self, request, queryset):
-        n = queryset.update(status='out')
-        self.message_user(request, '%i products were updated' % n)
+        self.set_stock_status(request, queryset, 'out')
 
     make_out.short_description = 'Mark selected entries as out of stock'
 
     def make_deprecated(self, request, queryset):
+        # a manual status, kept by stock changes (see inventory.py)
         n = queryset.update(status='deprecated')
         self.message_user(request, '%i products were updated' % n)
 
     make_deprecated.short_description = 'Mark selected entries as deprecated'
 
     def make_csv(self, request, queryset):
-        from collections import OrderedDict
-
-        fields = OrderedDict([('Name', 'name'),
-                              ('Vendor', 'vendor.name'),
-                              ('Vendor Catalog', 'catalog'),
-                              ('Manufacturer', 'manufacturer.name'),
-                              ('Manufacturer Catalog', 'manufacturer_catalog'),
-                              ('Category', 'category.name'),
-                              ('Shelf_life', 'shelflife'),
-                              ('Status', 'status'),
-                              ('Location', 'location'),
-                              ('Link', 'link'),
-                              ('Comment', 'comment')])
-        return export_csv(request, queryset, fields)
+        if self.export_in_background(request, queryset, 'csv',
+                                     'products.csv'):
+            return
+        return export_csv(request, queryset, self.csv_fields,
+                          filename='products.csv')
 
     make_csv.short_description = 'Export products as CSV'
 
-    # note: this currently breaks the selection of products from the
-    # order form "lense" button
+    def make_xlsx(self, request, queryset):
+        if self.export_in_background(request, queryset, 'xlsx',
+                                     'products.xlsx'):
+            return
+        return export_xlsx(request, queryset, self.csv_fields,
+                           filename='products.xlsx')
+
+    make_xlsx.short_description = 'Export products as Excel file'
+
     def show_name(self, o):
         """truncate product name to less than 40 char"""
         from django.utils.safestring import SafeUnicode
@@ -192,14 +398,65 @@ class ProductAdmin(admin.ModelAdmin):
     show_catalog.short_description = 'Catalog'
     show_catalog.admin_order_field = 'catalog'
 
+    def _stats(self, o):
+        """@return: ProductStats or None (not yet computed)"""
+        try:
+            return o.stats
+        except ProductStats.DoesNotExist:
+            return None
+
+    def show_last_ordered(self, o):
+        s = self._stats(o)
+        return s.last_ordered if s and s.last_ordered else ''
+    show_last_ordered.short_description = 'last ordered'
+    show_last_ordered.admin_order_field = 'stats__last_ordered'
+
+    def show_times_ordered(self, o):
+        s = self._stats(o)
+        return s.times_ordered if s else ''
+    show_times_ordered.short_description = 'ordered'
+    show_times_ordered.admin_order_field = 'stats__times_ordered'
+
+    def show_open_orders(self, o):
+        s = self._stats(o)
+        return s.open_orders if s and s.open_orders else ''
+    show_open_orders.short_description = 'open'
+    show_open_orders.admin_order_field = 'stats__open_orders'
+
+    def show_spend(self, o):
+        s = self._stats(o)
+        if not s:
+            return ''
+        if s.total_spend is not None:
+            return '%s %s' % (s.total_spend, s.spend_currency)
+        if s.total_spend_base is not None:
+            return '%s %s' % (s.total_spend_base, currency.base_currency())
+        return ''
+    show_spend.short_description = 'total spend'
+    show_spend.admin_order_field = 'stats__total_spend_base'
+
+    def show_reorder(self, o):
+        """forecast reorder date, see labhamster.forecast"""
+        try:
+            due = o.forecast.date_due
+        except ProductForecast.DoesNotExist:
+            return ''
+        if due is None:
+            return ''
+        if due < date.today():
+            return html.format_html('<b>{}</b>', due)
+        return due
+    show_reorder.short_description = 'reorder by'
+    show_reorder.admin_order_field = 'forecast__date_due'
+
 
 admin.site.register(Product, ProductAdmin)
 
 
-class OrderAdmin(RequestFormAdmin):
+class OrderAdmin(ReplicaAdmin, LargeTableAdmin, BackgroundAdmin,
+                 RequestFormAdmin, ImportAdmin, SearchAdmin):
     form = customforms.OrderForm
-
-    raw_id_fields = ('product',)
+    import_kind = 'order'
 
     fieldsets = ((None,
                   {'fields': (('status', 'is_urgent', 'product',),
@@ -218,9 +475,12 @@ class OrderAdmin(RequestFormAdmin):
                     'requested', 'show_requestedby', 'ordered',
                     'received', 'show_comment',)
 
-    list_filter = ('status',
-                   'product__category__name', 'grant', 'created_by', 'product__vendor__name',)
-    ordering = ('-date_created', 'product', '-date_ordered')  # , 'price')
+    list_filter = ('status', filters.CategoryFilter, filters.GrantFilter,
+                   filters.UserFilter, filters.VendorFilter)
+    list_select_related = ('product__vendor', 'created_by')
+    # product_id, not product: that would sort by product and vendor name,
+    # which no index of the order table can serve
+    ordering = ('-date_created', 'product_id', '-date_ordered')  # , 'price')
 
     search_fields = ('comment', 'grant__name', 'grant__grant_id', 'product__name',
                      'product__vendor__name', 'po_number')
@@ -229,7 +489,40 @@ class OrderAdmin(RequestFormAdmin):
 
     date_hierarchy = 'date_created'
 
-    actions = ['make_ordered', 'make_received', 'make_cancelled', 'make_csv']
+    actions = ['make_ordered', 'make_received', 'make_cancelled', 'make_csv',
+               'make_xlsx']
+
+    csv_fields = OrderedDict([('Product', 'product.name'),
+                              ('Quantity', 'quantity'),
+                              ('Price', 'price'),
+                              ('Vendor', 'product.vendor.name'),
+                              ('Catalog', 'product.catalog'),
+                              ('PO Number', 'po_number'),
+                              ('Requested', 'date_created'),
+                              ('Requested by', 'created_by.username'),
+                              ('Ordered', 'date_ordered'),
+                              ('Ordered by', 'ordered_by.username'),
+                              ('Received', 'date_received'),
+                              ('Status', 'status'),
+                              ('Urgent', 'is_urgent'),
+                              ('Comment', 'comment')])
+
+    def get_queryset(self, request):
+        """follow all relations displayed by changelist and change form"""
+        qs = super(OrderAdmin, self).get_queryset(request)
+        return qs.select_related('product__vendor', 'product__category',
+                                 'created_by')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        """pick products by type-ahead instead of a changelist popup"""
+        if db_field.name == 'product':
+            kwargs['widget'] = customforms.ProductAutocomplete()
+        return super(OrderAdmin, self).formfield_for_foreignkey(
+            db_field, request, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        """record the current user in the order's status history"""
+        obj.save(user=request.user)
 
     def show_title(self, o):
         """truncate product name + supplier to less than 40 char"""
@@ -286,35 +579,34 @@ class OrderAdmin(RequestFormAdmin):
         Mark several orders as 'ordered'
         see: https://docs.djangoproject.com/en/1.4/ref/contrib/admin/actions/
         """
-        import datetime
-        n = queryset.update(status='ordered', ordered_by=request.user,
-                            date_ordered=datetime.datetime.now())
-        self.message_user(request, '%i orders were updated' % n)
+        if self.run_in_background(request, queryset, 'transition',
+                                  'Mark orders as ordered', status='ordered'):
+            return
+        r = transitions.transition(queryset, 'ordered', user=request.user)
+        self.message_user(request, '%i orders were updated' % len(r.changed))
 
     make_ordered.short_description = 'Mark selected entries as ordered'
 
     def make_received(self, request, queryset):
-        import datetime
-        n = queryset.update(date_received=datetime.datetime.now(),
-                            status='received')
-        i = 0
-        for order in queryset:
-            order.product.status = 'ok'
-            order.product.save()
-            i += 1
-
+        if self.run_in_background(request, queryset, 'transition',
+                                  'Mark orders as received',
+                                  status='received'):
+            return
+        r = transitions.transition(queryset, 'received', user=request.user)
         self.message_user(request,
                           '%i orders were updated and %i products set to "in stock"'
-                          % (n, i))
+                          % (len(r.changed), len(r.products)))
 
     make_received.short_description = 'Mark as received (and update product status)'
 
     def make_cancelled(self, request, queryset):
-        import datetime
-
-        n = queryset.update(date_received=None, date_ordered=None,
-                            status='cancelled')
-        self.message_user(request, '%i orders were set to cancelled' % n)
+        if self.run_in_background(request, queryset, 'transition',
+                                  'Mark orders as cancelled',
+                                  status='cancelled'):
+            return
+        r = transitions.transition(queryset, 'cancelled', user=request.user)
+        self.message_user(request,
+                          '%i orders were set to cancelled' % len(r.changed))
 
     make_cancelled.short_description = 'Mark selected entries as cancelled'
 
@@ -322,26 +614,168 @@ class OrderAdmin(RequestFormAdmin):
         """
         Export selected orders as CSV file
         """
-        from collections import OrderedDict
+        if self.export_in_background(request, queryset, 'csv', 'orders.csv'):
+            return
+        return export_csv(request, queryset, self.csv_fields)
 
-        fields = OrderedDict([('Product', 'product.name'),
-                              ('Quantity', 'quantity'),
-                              ('Price', 'price'),
-                              ('Vendor', 'product.vendor.name'),
-                              ('Catalog', 'product.catalog'),
-                              ('PO Number', 'po_number'),
-                              ('Requested', 'date_created'),
-                              ('Requested by', 'created_by.username'),
-                              ('Ordered', 'date_ordered'),
-                              ('Ordered by', 'ordered_by.username'),
-                              ('Received', 'date_received'),
-                              ('Status', 'status'),
-                              ('Urgent', 'is_urgent'),
-                              ('Comment', 'comment')])
+    make_csv.short_description = 'Export orders as CSV'
 
-        return export_csv(request, queryset, fields)
+    def make_xlsx(self, request, queryset):
+        """
+        Export selected orders as Excel file
+        """
+        if self.export_in_background(request, queryset, 'xlsx',
+                                     'orders.xlsx'):
+            return
+        return export_xlsx(request, queryset, self.csv_fields)
 
-    make_csv.short_description = 'Export orders as CSV'
+    make_xlsx.short_description = 'Export orders as Excel file'
 
 
 admin.site.register(Order, OrderAdmin)
+
+
+class OrderEventAdmin(ReplicaAdmin):
+    """Read-only view of the order status history"""
+
+    list_display = ('timestamp', 'order', 'from_status', 'to_status', 'user')
+    list_filter = ('to_status', 'from_status')
+    list_select_related = ('order__product__vendor', 'user')
+    date_hierarchy = 'timestamp'
+    raw_id_fields = ('order',)
+    ordering = ('-timestamp', '-id')
+
+    def get_readonly_fields(self, request, obj=None):
+        return [f.name for f in self.model._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(OrderEvent, OrderEventAdmin)
+
+
+class SpendRollupAdmin(admin.ModelAdmin):
+    """
+    Spend report: monthly totals pivoted by grant, grant category, vendor,
+    product category or requester, read from the precomputed rollups (on
+    the replica database if there is one). Replaces the usual changelist.
+    """
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        routers.use_replica(request.method in ('GET', 'HEAD'))
+        by = request.GET.get('by', 'vendor')
+        if by not in reports.DIMENSIONS:
+            by = 'vendor'
+        try:
+            year = int(request.GET.get('year', date.today().year))
+        except ValueError:
+            year = date.today().year
+        base = request.GET.get('base') == '1'
+
+        years = [d.year for d in SpendRollup.objects.dates('month', 'year')]
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Spend report %i' % year,
+            opts=self.model._meta,
+            by=by, year=year, base=base,
+            base_currency=currency.base_currency(),
+            years=sorted(set(years) | {year}),
+            dimensions=[(k, v[0]) for k, v in reports.DIMENSIONS.items()],
+            months=[date(year, m, 1) for m in range(1, 13)],
+            rows=reports.spend_report(by, year, base=base),
+            lead_times=reports.lead_times(
+                since=timezone.now() - timedelta(days=365)),
+        )
+        context.update(extra_context or {})
+        return TemplateResponse(
+            request, 'admin/labhamster/spendrollup/report.html', context)
+
+
+admin.site.register(SpendRollup, SpendRollupAdmin)
+
+
+class JobAdmin(admin.ModelAdmin):
+    """
+    Background jobs with progress and download of exported files. Staff
+    users see their own jobs, superusers all of them.
+    """
+
+    list_display = ('id', 'description', 'user', 'status', 'show_progress',
+                    'date_created', 'date_finished', 'message',
+                    'show_download')
+    list_filter = ('status', 'kind')
+    list_select_related = ('user',)
+    date_hierarchy = 'date_created'
+
+    def get_queryset(self, request):
+        qs = super(JobAdmin, self).get_queryset(request)\
+            .defer('query')
+        if not request.user.is_superuser:
+            qs = qs.filter(user=request.user)
+        return qs
+
+    def get_readonly_fields(self, request, obj=None):
+        return [f.name for f in self.model._meta.fields
+                if f.name != 'query']
+
+    def get_fields(self, request, obj=None):
+        return self.get_readonly_fields(request, obj)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return request.user.is_active and request.user.is_staff and \
+            (obj is None or request.user.is_superuser or
+             obj.user_id == request.user.pk)
+
+    def has_delete_permission(self, request, obj=None):
+        return self.has_change_permission(request, obj)
+
+    def get_urls(self):
+        return [
+            url(r'^(\d+)/download/$',
+                self.admin_site.admin_view(self.download_view),
+                name='labhamster_job_download'),
+        ] + super(JobAdmin, self).get_urls()
+
+    def download_view(self, request, pk):
+        job = get_object_or_404(self.get_queryset(request), pk=pk,
+                                status='done')
+        if not job.filename:
+            raise Http404('job %s has no file' % pk)
+        response = StreamingHttpResponse(jobs.chunks(job),
+                                         content_type=job.content_type)
+        response['Content-Length'] = job.size
+        response['Content-Disposition'] = \
+            'attachment; filename=%s' % job.filename
+        return response
+
+    def show_progress(self, o):
+        if not o.total:
+            return ''
+        return '%i%%' % (100 * o.progress // o.total)
+    show_progress.short_description = 'progress'
+
+    def show_download(self, o):
+        if not o.filename:
+            return ''
+        return html.format_html(
+            '<a href="{}">{}</a>',
+            reverse('admin:labhamster_job_download', args=(o.pk,)),
+            o.filename)
+    show_download.short_description = 'download'
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,287 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Read-only JSON API (see views.api_list and views.api_detail).
+
+Each resource maps API field names to value lookups, so that one query
+with the necessary joins reads exactly the selected columns. Collections
+are paged with an opaque cursor: the sort key of the last row of a page,
+continued with a range condition on an indexed column instead of OFFSET.
+
+ETags are derived from one query over the rows of the response only (a
+page is limited like the page itself): their ids and the date_modified of
+these rows and of all related rows whose fields are selected (e.g. the
+product of an order). Related models without date_modified (category and
+user names) contribute the selected values themselves. Polling clients sending If-None-Match hence get a
+304 answer without the selected columns being read or serialized, and
+changes to rows on other pages don't invalidate theirs.
+"""
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.apps import apps as django_apps
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+#: default and maximum number of rows per page
+LIMIT = 100
+MAX_LIMIT = 1000
+
+#: sort orders of collections: name -> API fields, ending with the unique id
+ORDERINGS = OrderedDict([('id', ('id',)),
+                         ('modified', ('modified', 'id'))])
+
+
+class Resource(object):
+    """Read-only view of one model"""
+
+    def __init__(self, model_name, fields, filters=None):
+        """
+        model_name - str, name of labhamster model
+        fields     - [(str, str)], API field name and value lookup
+        filters    - {str: str}, query parameter and filter lookup
+        """
+        self.model_name = model_name
+        self.fields = OrderedDict(fields)
+        self.filters = filters or {}
+
+    @property
+    def model(self):
+        return django_apps.get_model('labhamster', self.model_name)
+
+    def select(self, names=None):
+        """
+        names - str, comma-separated field names (default: all fields)
+        @return: [str], API field names
+        @raise ValueError: for unknown field names
+        """
+        if not names:
+            return list(self.fields)
+        r = [n.strip() for n in names.split(',') if n.strip()]
+        unknown = [n for n in r if n not in self.fields]
+        if unknown:
+            raise ValueError('unknown field(s): %s' % ', '.join(unknown))
+        return r
+
+    def queryset(self, params):
+        """
+        params - QueryDict, request parameters
+        @return: QuerySet without ordering, filtered by params
+        @raise ValueError: for invalid filter values
+        """
+        qs = self.model._default_manager.order_by()
+        try:
+            for param, lookup in self.filters.items():
+                if param in params:
+                    qs = qs.filter(**{lookup: params[param]})
+        except ValidationError as error:
+            raise ValueError('; '.join(error.messages))
+
+        if params.get('modified_since'):
+            qs = qs.filter(date_modified__gte=parse_time(
+                params['modified_since']))
+        return qs
+
+    def versions(self, names):
+        """
+        @return: [str], lookups telling whether the related rows read for
+                 the given API fields changed: their date_modified or, for
+                 models without one (Category, User), the value read itself
+        """
+        r = set()
+        for name in names:
+            model = self.model
+            path = []
+            for part in self.fields[name].split('__')[:-1]:
+                model = model._meta.get_field(part).related_model
+                path.append(part)
+                if any(f.name == 'date_modified' for f in
+                       model._meta.concrete_fields):
+                    r.add('__'.join(path) + '__date_modified')
+                else:
+                    r.add(self.fields[name])
+        return sorted(r)
+
+    def etag(self, queryset, names, *key):
+        """
+        queryset - QuerySet, the rows of one response (e.g. a sliced page)
+        @return: str, fingerprint of key and of the ids and modification
+                 times of the rows of queryset (including the related rows
+                 behind the given field names, see versions())
+        """
+        fields = ['pk', 'date_modified'] + self.versions(names)
+        state = [tuple(str(v) for v in row)
+                 for row in queryset.values_list(*fields)]
+
+        h = hashlib.md5()
+        h.update(repr((self.model_name, names, key, state)).encode('utf-8'))
+        return h.hexdigest()
+
+    def rows(self, queryset, names):
+        """@return: [OrderedDict], API fields of all rows of queryset"""
+        lookups = [self.fields[n] for n in names]
+        return [OrderedDict(zip(names, values))
+                for values in queryset.values_list(*lookups)]
+
+
+def parse_time(value):
+    """
+    @return: datetime, aware date and time or start of day
+    @raise ValueError: if value is no ISO date (and time)
+    """
+    r = parse_datetime(value)
+    if r is None and parse_date(value) is not None:
+        r = parse_datetime(value + 'T00:00')
+    if r is None:
+        raise ValueError('invalid date / time: %s' % value)
+    if timezone.is_naive(r):
+        r = timezone.make_aware(r)
+    return r
+
+
+def encode_cursor(ordering, row):
+    """
+    ordering - str, key of ORDERINGS
+    row      - [value], sort key of the last row of a page
+    @return: str, opaque URL-safe cursor
+    """
+    values = [v.isoformat() if hasattr(v, 'isoformat') else v for v in row]
+    data = json.dumps([ordering] + values).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(ordering, cursor):
+    """
+    @return: [value], sort key of the last row of the previous page
+    @raise ValueError: if the cursor is invalid or for another ordering
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data.decode('utf-8'))
+        assert values[0] == ordering
+        assert len(values) == len(ORDERINGS[ordering]) + 1
+    except (TypeError, ValueError, AssertionError, IndexError,
+            UnicodeDecodeError):
+        raise ValueError('invalid cursor')
+
+    values = values[1:]
+    if ordering == 'modified':
+        values[0] = parse_time(values[0])
+    return values
+
+
+def after(resource, queryset, ordering, key):
+    """
+    @return: QuerySet, rows sorted after key in the given ordering
+    """
+    fields = [resource.fields[n] for n in ORDERINGS[ordering]]
+    q = Q()
+    for i, field in enumerate(fields):
+        equal = dict(zip(fields[:i], key[:i]))
+        q |= Q(**dict(equal, **{field + '__gt': key[i]}))
+    return queryset.filter(q)
+
+
+def ordered(resource, queryset, ordering):
+    """@return: QuerySet, sorted by the keys of the given ordering"""
+    return queryset.order_by(*[resource.fields[n]
+                               for n in ORDERINGS[ordering]])
+
+
+def page(resource, queryset, names, ordering, limit):
+    """
+    queryset - QuerySet, rows after the cursor position
+    @return: ([OrderedDict], str), rows of the next page and cursor for the
+             following page (None if this is the last one)
+    """
+    keys = ORDERINGS[ordering]
+    queryset = ordered(resource, queryset, ordering)
+
+    extra = [n for n in keys if n not in names]
+    rows = resource.rows(queryset[:limit + 1], list(names) + extra)
+
+    cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        cursor = encode_cursor(ordering, [rows[-1][n] for n in keys])
+    for row in rows:
+        for n in extra:
+            del row[n]
+    return rows, cursor
+
+
+RESOURCES = {
+    'orders': Resource('Order', [
+        ('id', 'id'),
+        ('status', 'status'),
+        ('urgent', 'is_urgent'),
+        ('product', 'product'),
+        ('product_name', 'product__name'),
+        ('vendor', 'product__vendor__name'),
+        ('catalog', 'product__catalog'),
+        ('unit_size', 'unit_size'),
+        ('quantity', 'quantity'),
+        ('price', 'price'),
+        ('currency', 'price_currency'),
+        ('grant', 'grant'),
+        ('grant_name', 'grant__name'),
+        ('grant_category', 'grant_category'),
+        ('po_number', 'po_number'),
+        ('requested', 'date_created'),
+        ('requested_by', 'created_by__username'),
+        ('ordered', 'date_ordered'),
+        ('ordered_by', 'ordered_by__username'),
+        ('received', 'date_received'),
+        ('comment', 'comment'),
+        ('modified', 'date_modified'),
+    ], filters={'status': 'status', 'product': 'product',
+                'vendor': 'product__vendor', 'grant': 'grant'}),
+
+    'products': Resource('Product', [
+        ('id', 'id'),
+        ('name', 'name'),
+        ('vendor', 'vendor'),
+        ('vendor_name', 'vendor__name'),
+        ('catalog', 'catalog'),
+        ('manufacturer', 'manufacturer'),
+        ('manufacturer_name', 'manufacturer__name'),
+        ('manufacturer_catalog', 'manufacturer_catalog'),
+        ('category', 'category__name'),
+        ('shelflife', 'shelflife'),
+        ('status', 'status'),
+        ('quantity_on_hand', 'quantity_on_hand'),
+        ('low_stock_threshold', 'low_stock_threshold'),
+        ('link', 'link'),
+        ('location', 'location'),
+        ('comment', 'comment'),
+        ('modified', 'date_modified'),
+    ], filters={'status': 'status', 'vendor': 'vendor',
+                'category': 'category'}),
+
+    # no account login / password
+    'vendors': Resource('Vendor', [
+        ('id', 'id'),
+        ('name', 'name'),
+        ('link', 'link'),
+        ('phone', 'phone'),
+        ('email', 'email'),
+        ('contact', 'contact'),
+        ('modified', 'date_modified'),
+    ]),
+
+    'grants': Resource('Grant', [
+        ('id', 'id'),
+        ('name', 'name'),
+        ('grant_id', 'grant_id'),
+        ('active', 'active'),
+        ('comment', 'comment'),
+        ('modified', 'date_modified'),
+    ], filters={'active': 'active'}),
+}
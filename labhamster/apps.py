@@ -10,3 +10,6 @@ from django.apps import AppConfig
 class LabhamsterConfig(AppConfig):
     name = 'labhamster'
     verbose_name = 'LabHamster'
+
+    def ready(self):
+        from . import signals  # noqa: connect signal receivers
@@ -0,0 +1,143 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Product suggestions for the type-ahead product field of the order form.
+
+Terms are matched as name prefixes through the normalized name key index,
+as word prefixes through the full-text search index (product name,
+vendor, catalog numbers ...) and, if they contain digits, as catalog
+number prefixes through the catalog key index.
+Only a bounded number of candidates is read from each index (full-text
+matches best ranked first) and answers are kept in a small in-process LRU
+cache, cleared whenever products or vendors change in this process and
+expiring after TTL seconds otherwise.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.apps import apps as django_apps
+from django.db.models import Q
+
+from . import search
+from . import tools as T
+
+#: number of suggestions returned by default
+LIMIT = 20
+
+#: candidates read from the search index per suggestion
+CANDIDATES = 5
+
+
+class LRUCache(object):
+    """Thread-safe mapping of limited size with expiring entries"""
+
+    def __init__(self, maxsize=1000, ttl=60):
+        """
+        maxsize - int, number of entries kept
+        ttl     - float, seconds after which an entry expires
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """@return: cached value or None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+cache = LRUCache()
+
+
+def normalize(term):
+    """@return: str, lower-case term with collapsed white space"""
+    return T.normalize_name(term)
+
+
+def _candidates(term, limit):
+    """
+    @return: ([Product], [Product]), catalog number matches and name
+             prefix or text matches of term; each at most
+             limit * CANDIDATES per index
+    """
+    Product = django_apps.get_model('labhamster', 'Product')
+    products = Product.objects.select_related('vendor')
+    n = limit * CANDIDATES
+
+    by_catalog = []
+    if any(c.isdigit() for c in term):
+        by_catalog = list(products.catalog_lookup(term)[:n])
+
+    if search.get_backend() is not None and search.tokens(term):
+        ids = search.ranked(Product, term, n)
+        # common words match many products: don't miss the obvious ones
+        by_text = list(products.name_prefix(term)
+                       .order_by('name_key')[:n]) + \
+            list(products.filter(pk__in=ids))
+    else:
+        by_text = list(products.filter(
+            Q(name__icontains=term) | Q(vendor__name__icontains=term) |
+            Q(catalog__icontains=term))[:n])
+
+    return by_catalog, by_text
+
+
+def suggest(term, limit=LIMIT):
+    """
+    @return: [dict], up to limit products matching term with keys 'id',
+             'name', 'vendor', 'catalog' and 'label'; catalog number matches
+             first, then name prefix matches, then by name
+    """
+    term = normalize(term)
+    if not term:
+        return []
+
+    key = (term, limit)
+    r = cache.get(key)
+    if r is not None:
+        return r
+
+    by_catalog, by_text = _candidates(term, limit)
+    catalog_ids = {p.pk for p in by_catalog}
+    products = {p.pk: p for p in by_catalog + by_text}.values()
+
+    products = sorted(products, key=lambda p: (
+        p.pk not in catalog_ids, not p.name_key.startswith(term),
+        p.name.lower()))
+
+    r = [{'id': p.pk, 'name': p.name, 'vendor': p.vendor.name,
+          'catalog': p.catalog, 'label': label(p)}
+         for p in products[:limit]]
+    cache.set(key, r)
+    return r
+
+
+def label(product):
+    """@return: str, product as displayed in the product field"""
+    r = '%s (%s' % (product.name, product.vendor.name)
+    if product.catalog:
+        r += ' %s' % product.catalog
+    return r + ')'
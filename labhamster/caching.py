@@ -0,0 +1,70 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Cached lookup data (filter choices, form choices) in Django's cache
+framework.
+
+Cached values belong to one or more groups (usually the name of the model
+they are built from). Each group has a version number stored in the cache;
+keys include the versions of their groups, so invalidate(group) -- called
+from signal receivers whenever a model instance is saved or deleted --
+retires all values built from that model at once.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+PREFIX = 'labhamster'
+
+#: seconds a value is kept; bounds staleness if the cache backend is not
+#: shared between server processes (e.g. the default local memory cache)
+TIMEOUT = getattr(settings, 'LOOKUP_CACHE_TIMEOUT', 300)
+
+
+def _initial():
+    # versions lost from the cache restart at a number never used before
+    return int(time.time() * 1000)
+
+
+def _version_key(group):
+    return '%s:version:%s' % (PREFIX, group)
+
+
+def key(groups, name):
+    """@return: str, cache key of name under the current group versions"""
+    keys = [_version_key(g) for g in groups]
+    versions = cache.get_many(keys)
+    for k in keys:
+        if k not in versions:
+            cache.add(k, _initial(), None)
+            versions[k] = cache.get(k, 0)
+    return '%s:%s:%s' % (PREFIX, name,
+                         '.'.join(str(versions[k]) for k in keys))
+
+
+def get(groups, name, build, timeout=None):
+    """
+    Fetch a value from the cache or build and store it.
+    groups - (str,), groups the value depends on, e.g. ('vendor',)
+    name   - str, name of the value, unique within the application
+    build  - callable returning the (picklable, not None) value
+    """
+    k = key(groups, name)
+    r = cache.get(k)
+    if r is None:
+        r = build()
+        cache.set(k, r, TIMEOUT if timeout is None else timeout)
+    return r
+
+
+def invalidate(*groups):
+    """Retire all cached values depending on any of the given groups"""
+    for g in groups:
+        try:
+            cache.incr(_version_key(g))
+        except ValueError:  # not yet (or no longer) in the cache
+            cache.set(_version_key(g), _initial(), None)
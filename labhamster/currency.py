@@ -0,0 +1,148 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Conversion of order amounts into the base currency (settings.BASE_CURRENCY).
+
+Exchange rates come from the local ExchangeRate table (see the
+load_exchange_rates command); the rate of an order is the latest rate on or
+before its order date (or request date if it has not been ordered). Conversion
+happens either inside SQL aggregates (base_amount, total) or in Python
+against a RateTable, which converts sums per currency and day.
+"""
+import bisect
+import csv
+import datetime
+from decimal import Decimal
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, F, OuterRef, Subquery, Sum
+from django.db.models import DecimalField, ExpressionWrapper
+from django.db.models.functions import Coalesce
+
+AMOUNT = DecimalField(max_digits=20, decimal_places=8)
+
+
+def base_currency():
+    return getattr(settings, 'BASE_CURRENCY', 'USD')
+
+
+def _latest(date, apps):
+    """@return: subquery, latest rate of an order's currency on or before date"""
+    ExchangeRate = apps.get_model('labhamster', 'ExchangeRate')
+    return Subquery(ExchangeRate.objects.filter(
+        currency=OuterRef('price_currency'), date__lte=OuterRef(date))
+        .order_by('-date').values('rate')[:1], output_field=AMOUNT)
+
+
+def rate(apps=django_apps):
+    """
+    @return: expression for the exchange rate of an Order row at its order
+             date (or request date); NULL if no rate is known
+    apps - app registry to take models from (for use in migrations)
+    """
+    return Case(When(price_currency=base_currency(), then=Value(1)),
+                When(date_ordered__isnull=False,
+                     then=_latest('date_ordered', apps)),
+                default=_latest('date_created', apps), output_field=AMOUNT)
+
+
+def base_amount(apps=django_apps):
+    """
+    @return: expression for quantity x unit price of an Order row in base
+             currency, usable inside aggregates (Sum, Count); NULL if the
+             order has no price or no exchange rate is known
+    """
+    return ExpressionWrapper(F('quantity') * F('price') * rate(apps=apps),
+                             output_field=AMOUNT)
+
+
+def total(queryset):
+    """
+    @return: Decimal, sum of quantity x unit price over an Order queryset,
+             in base currency, computed in one query. Orders without price
+             or without a known exchange rate are skipped.
+    """
+    r = queryset.order_by().aggregate(total=Sum(base_amount()))['total']
+    return (r or Decimal(0)).quantize(Decimal('0.01'))
+
+
+class RateTable(object):
+    """
+    In-memory copy of the exchange rates of some currencies for converting
+    many amounts at once without rate lookups in SQL.
+    """
+
+    def __init__(self, currencies=None):
+        """currencies - [str], currencies to load (default: all)"""
+        ExchangeRate = django_apps.get_model('labhamster', 'ExchangeRate')
+        rates = ExchangeRate.objects.order_by('currency', 'date')
+        if currencies is not None:
+            rates = rates.filter(currency__in=currencies)
+
+        self.dates = {}
+        self.rates = {}
+        for currency, date, rate in rates.values_list('currency', 'date',
+                                                      'rate'):
+            self.dates.setdefault(currency, []).append(date)
+            self.rates.setdefault(currency, []).append(rate)
+
+    def rate(self, currency, date):
+        """@return: Decimal or None, latest rate on or before date"""
+        if currency == base_currency():
+            return Decimal(1)
+        i = bisect.bisect_right(self.dates.get(currency, []), date)
+        return self.rates[currency][i - 1] if i else None
+
+    def convert(self, queryset):
+        """
+        Sum quantity x unit price of an Order queryset per currency and
+        order date (or request date) in one query and convert these sums.
+        @return: Decimal, total in base currency. Orders without price or
+                 without a known exchange rate are skipped.
+        """
+        sums = queryset.order_by()\
+            .annotate(day=Coalesce('date_ordered', 'date_created'))\
+            .values('price_currency', 'day')\
+            .annotate(amount=Sum(ExpressionWrapper(F('quantity') * F('price'),
+                                                   output_field=AMOUNT)))
+        r = Decimal(0)
+        for row in sums:
+            x = self.rate(row['price_currency'], row['day'])
+            if row['amount'] is not None and x is not None:
+                r += row['amount'] * x
+        return r.quantize(Decimal('0.01'))
+
+
+def load_rates(f):
+    """
+    Load exchange rates from a CSV file with the columns
+    date (YYYY-MM-DD), currency, rate. Existing rates of the same currency
+    and date are replaced.
+    f - file object opened in text mode
+    @return: [(str, date)], currency and date of the loaded rates
+    """
+    ExchangeRate = django_apps.get_model('labhamster', 'ExchangeRate')
+
+    rates = {}
+    for row in csv.DictReader(f):
+        date = datetime.datetime.strptime(row['date'].strip(), '%Y-%m-%d')
+        key = (row['currency'].strip().upper(), date.date())
+        rates[key] = Decimal(row['rate'].strip())
+
+    with transaction.atomic():
+        for currency in {k[0] for k in rates}:
+            dates = [k[1] for k in rates if k[0] == currency]
+            for i in range(0, len(dates), 500):
+                ExchangeRate.objects.filter(
+                    currency=currency, date__in=dates[i:i + 500]).delete()
+
+        ExchangeRate.objects.bulk_create(
+            [ExchangeRate(currency=c, date=d, rate=r)
+             for (c, d), r in sorted(rates.items())], batch_size=500)
+
+    return sorted(rates)
@@ -4,9 +4,56 @@
 # LabHamster is released under the MIT open source license, which you can find
 # along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
 import django.forms as forms
-from django.db.models import Case, When
 from django.contrib.auth.models import User
+from django.urls import reverse
 import labhamster.models as M
+from . import autocomplete
+from . import caching
+
+
+def user_choices():
+    """@return: [(id, username)] of all users by username (cached)"""
+    def build():
+        return list(User.objects.order_by('username')
+                    .values_list('id', 'username'))
+    return caching.get(('user',), 'choices:user', build)
+
+
+def grant_choices():
+    """@return: [(id, label, active)] of all grants (cached)"""
+    def build():
+        return [(g.pk, str(g), g.active) for g in M.Grant.objects.all()]
+    return caching.get(('grant',), 'choices:grant', build)
+
+
+def _with_empty(field, choices):
+    if field.empty_label is not None:
+        return [('', field.empty_label)] + choices
+    return choices
+
+
+class ProductAutocomplete(forms.Widget):
+    """
+    Type-ahead product field: a text box querying
+    ProductAdmin.autocomplete_view and a hidden input holding the product id
+    """
+    template_name = 'labhamster/widgets/product_autocomplete.html'
+
+    class Media:
+        js = ('labhamster/product_autocomplete.js',)
+        css = {'all': ('labhamster/product_autocomplete.css',)}
+
+    def get_context(self, name, value, attrs):
+        context = super(ProductAutocomplete, self).get_context(
+            name, value, attrs)
+        product = None
+        if value:
+            product = M.Product.objects.select_related('vendor')\
+                .filter(pk=value).first()
+        context['widget'].update(
+            url=reverse('admin:labhamster_product_autocomplete'),
+            label=autocomplete.label(product) if product else '')
+        return context
 
 
 class OrderForm(forms.ModelForm):
@@ -25,27 +72,34 @@ class OrderForm(forms.ModelForm):
             ## self.initial['created_by'] = str(self.request.user.id)
             self.fields['created_by'].initial = self.request.user.id
 
-        users = User.objects.order_by(
-            Case(When(id=self.request.user.id, then=0), default=1), 'username')
+        # choices are rendered from the cache; querysets only validate input
+        users = user_choices()
+        me = self.request.user.id if self.request else None
+        users = [u for u in users if u[0] == me] + \
+            [u for u in users if u[0] != me]
 
-        self.fields['created_by'].queryset = users
-        self.fields['ordered_by'].queryset = users
+        for name in ('created_by', 'ordered_by'):
+            field = self.fields[name]
+            field.choices = _with_empty(field, users)
 
-        if self.instance.grant:
+        grant = self.instance.grant_id
+        if grant:
             grants = M.Grant.objects.filter(active=True) \
-                | M.Grant.objects.filter(pk=self.instance.grant.pk)
+                | M.Grant.objects.filter(pk=grant)
         else:
             grants = M.Grant.objects.filter(active=True)
 
-        self.fields['grant'].queryset = grants
-        self.fields['grant'].label_from_instance = self.label_from_instance
+        field = self.fields['grant']
+        field.queryset = grants
+        field.choices = _with_empty(field, [
+            (pk, self.label(label, active))
+            for pk, label, active in grant_choices()
+            if active or pk == grant])
 
-    def label_from_instance(self, option):
-        """Sets the string displayed in the form for the given option."""
-        label = option.__str__()
-        if not option.active:
-            label += " (expired)"
-        return label
+    @staticmethod
+    def label(label, active):
+        """@return: str, displayed in the form for a grant"""
+        return label if active else label + " (expired)"
 
     class Meta:
         model = M.Order
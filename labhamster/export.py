@@ -0,0 +1,234 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Streaming, constant-memory export of model querysets.
+
+Export columns are given as an OrderedDict of column title / attribute path
+pairs (e.g. ``('Vendor', 'product.vendor.name')``). The attribute paths are
+compiled once into ORM lookups so that rows can be fetched as plain tuples
+with ``values_list()`` in primary-key chunks rather than as full model
+instances. Exports read from the replica database if there is one (see
+routers.py).
+"""
+import csv
+import tempfile
+
+from django.db.models import DateField, DateTimeField
+from django.http import FileResponse, StreamingHttpResponse
+from djmoney.models.fields import MoneyField
+from djmoney.money import Money
+
+from . import metrics
+from . import routers
+
+#: number of rows fetched from the database per query
+CHUNK_SIZE = 2000
+
+XLSX_TYPE = \
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+#: Excel number format of date columns
+DATE_FORMAT = 'yyyy-mm-dd'
+
+
+class FieldAccessor(object):
+    """
+    One compiled export column. Knows the ORM lookup(s) it needs and how to
+    turn the fetched value(s) back into a python value.
+    """
+
+    def __init__(self, model, path):
+        """
+        model - Model class the export starts from
+        path  - str, dotted attribute path, e.g. 'product.vendor.name'
+        """
+        self.path = path
+        self.lookup = path.replace('.', '__')
+        self.field = self._resolve(model, path)
+        self.money = isinstance(self.field, MoneyField)
+
+        self.lookups = [self.lookup]
+        if self.money:
+            self.lookups.append(self.lookup + '_currency')
+
+    @staticmethod
+    def _resolve(model, path):
+        """@return: Field, model field at the end of a dotted path"""
+        names = path.split('.')
+        for name in names[:-1]:
+            model = model._meta.get_field(name).related_model
+        return model._meta.get_field(names[-1])
+
+    def value(self, row, index):
+        """
+        row   - tuple, values_list row
+        index - int, position of this column's first lookup in row
+        @return: python value of this column (None for empty relations)
+        """
+        v = row[index]
+        if self.money and v is not None:
+            return Money(v, row[index + 1])
+        return v
+
+
+class CompiledFields(object):
+    """
+    Export column definitions compiled against a model. Iterating over
+    a queryset with rows() yields one tuple of python values per object.
+    """
+
+    def __init__(self, model, fields, split_money=False):
+        """
+        model       - Model class
+        fields      - OrderedDict of column title / attribute path pairs
+        split_money - bool, export money fields as two columns, amount
+                      (Decimal) and currency code, instead of Money [False]
+        """
+        self.split_money = split_money
+        self.accessors = [FieldAccessor(model, p) for p in fields.values()]
+
+        self.titles = []
+        self.fields = []  # model field of each column (None for currency)
+        for title, a in zip(fields.keys(), self.accessors):
+            self.titles.append(title)
+            self.fields.append(a.field)
+            if a.money and split_money:
+                self.titles.append('%s currency' % title)
+                self.fields.append(None)
+
+        self.lookups = []
+        self.offsets = []
+        for a in self.accessors:
+            self.offsets.append(len(self.lookups) + 1)  # +1 for leading pk
+            self.lookups.extend(a.lookups)
+
+    def rows(self, queryset, chunk_size=CHUNK_SIZE):
+        """
+        Generator over export rows, fetched in chunks of chunk_size objects
+        paging by primary key. Rows are therefore returned in pk order.
+        """
+        accessors = list(zip(self.accessors, self.offsets))
+        qs = queryset.order_by('pk').values_list('pk', *self.lookups)
+        last = None
+
+        while True:
+            chunk = qs if last is None else qs.filter(pk__gt=last)
+            fetched = list(chunk[:chunk_size])
+
+            for row in fetched:
+                if self.split_money:
+                    yield row[1:]  # lookups are the split columns already
+                else:
+                    yield tuple(a.value(row, i) for a, i in accessors)
+
+            if len(fetched) < chunk_size:
+                return
+            last = fetched[-1][0]
+
+
+class Echo(object):
+    """File-like object that returns what is written, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(queryset, fields, progress=None):
+    """
+    Generator over the lines of a CSV export, header first.
+    fields   - OrderedDict of name / field pairs, see ProductAdmin.csv_fields
+    progress - callable, called with the number of rows so far after every
+               CHUNK_SIZE rows (background jobs)
+    """
+    queryset = routers.on_replica(queryset)
+    compiled = CompiledFields(queryset.model, fields)
+    writer = csv.writer(Echo())
+
+    yield writer.writerow(compiled.titles)
+    n = 0
+    for row in compiled.rows(queryset):
+        n += 1
+        yield writer.writerow(row)
+        if progress and not n % CHUNK_SIZE:
+            progress(n)
+    metrics.EXPORTED_ROWS.inc(n, model=queryset.model._meta.model_name,
+                              format='csv')
+
+
+def export_csv(request, queryset, fields, filename='orders.csv'):
+    """
+    Helper method for Admin make_csv actions. Streams selected objects as
+    CSV file without holding the whole table in memory.
+    fields - OrderedDict of name / field pairs, see ProductAdmin.csv_fields
+    """
+    response = StreamingHttpResponse(csv_lines(queryset, fields),
+                                     content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    return response
+
+
+def write_xlsx(f, queryset, fields, title='Export', progress=None):
+    """
+    Write selected objects as Excel workbook with typed cells (numbers,
+    dates, booleans; money as amount plus currency column) and a frozen
+    header row. Uses openpyxl's write-only mode, which writes rows to a
+    temporary file as they come instead of keeping them in memory.
+    f - file object (binary) to save the workbook to
+    progress - callable, see csv_lines
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    queryset = routers.on_replica(queryset)
+    compiled = CompiledFields(queryset.model, fields, split_money=True)
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.freeze_panes = 'A2'
+
+    bold = Font(bold=True)
+    header = []
+    for t in compiled.titles:
+        cell = WriteOnlyCell(sheet, value=t)
+        cell.font = bold
+        header.append(cell)
+    sheet.append(header)
+
+    dates = [i for i, field in enumerate(compiled.fields)
+             if isinstance(field, DateField) and
+             not isinstance(field, DateTimeField)]
+
+    n = 0
+    for row in compiled.rows(queryset):
+        row = list(row)
+        for i in dates:
+            if row[i] is not None:
+                row[i] = WriteOnlyCell(sheet, value=row[i])
+                row[i].number_format = DATE_FORMAT
+        sheet.append(row)
+        n += 1
+        if progress and not n % CHUNK_SIZE:
+            progress(n)
+    metrics.EXPORTED_ROWS.inc(n, model=queryset.model._meta.model_name,
+                              format='xlsx')
+
+    workbook.save(f)
+
+
+def export_xlsx(request, queryset, fields, filename='orders.xlsx'):
+    """
+    Helper method for Admin make_xlsx actions, see write_xlsx.
+    fields - OrderedDict of name / field pairs, see ProductAdmin.csv_fields
+    """
+    f = tempfile.TemporaryFile()
+    write_xlsx(f, queryset, fields,
+               title=str(queryset.model._meta.verbose_name_plural))
+    f.seek(0)
+
+    response = FileResponse(f, content_type=XLSX_TYPE)
+    response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    return response
@@ -0,0 +1,150 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Admin changelist filters with cached choices.
+
+Choices are read from the (small) table of the filtered dimension, not
+collected as distinct values across all orders, and kept in the cache (see
+caching.py) until an instance of that model changes. Dimensions with more
+than settings.FILTER_CHOICES_LIMIT entries are shown as a search box
+instead of a list of links, so the changelist does not grow with the number
+of users or vendors.
+"""
+import datetime
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib import admin
+
+from . import caching
+
+
+class CachedListFilter(admin.SimpleListFilter):
+    """
+    Filter by the name of a related object. Subclasses define:
+    model       - str, model of the dimension ('app_label.Model')
+    name_field  - str, unique name field of that model
+    field_path  - str, lookup from the filtered model to name_field
+    """
+    model = None
+    name_field = 'name'
+    field_path = None
+
+    template = 'admin/filter.html'
+    search_template = 'admin/labhamster/filter_search.html'
+
+    @classmethod
+    def group(cls):
+        """@return: str, cache group invalidated by changes of self.model"""
+        return cls.model.split('.')[1].lower()
+
+    @classmethod
+    def names(cls):
+        """@return: [str], all names of the dimension (cached)"""
+        Model = django_apps.get_model(cls.model)
+
+        def build():
+            return list(Model._default_manager.order_by(cls.name_field)
+                        .values_list(cls.name_field, flat=True))
+        return caching.get((cls.group(),), 'filter:%s' % cls.model, build)
+
+    @classmethod
+    def count(cls):
+        """@return: int, number of names (cached; doesn't load the names)"""
+        Model = django_apps.get_model(cls.model)
+        return caching.get((cls.group(),), 'count:%s' % cls.model,
+                           Model._default_manager.count)
+
+    def __init__(self, request, params, model, model_admin):
+        limit = getattr(settings, 'FILTER_CHOICES_LIMIT', 50)
+        self.searchable = self.count() > limit
+        if self.searchable:
+            self.template = self.search_template
+        super(CachedListFilter, self).__init__(request, params, model,
+                                               model_admin)
+
+    def lookups(self, request, model_admin):
+        if self.searchable:
+            value = self.value()
+            return [(value, value)] if value else []
+        return [(name, name) for name in self.names()]
+
+    def has_output(self):
+        return self.searchable or super(CachedListFilter, self).has_output()
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        if self.searchable:
+            return queryset.filter(
+                **{self.field_path + '__istartswith': value})
+        return queryset.filter(**{self.field_path: value})
+
+    def choices(self, changelist):
+        # other parameters of the current changelist, kept by the search form
+        self.hidden_params = sorted(
+            (k, v) for k, v in changelist.params.items()
+            if k not in (self.parameter_name, 'p'))
+        return super(CachedListFilter, self).choices(changelist)
+
+
+class CategoryFilter(CachedListFilter):
+    title = 'category'
+    parameter_name = 'category'
+    model = 'labhamster.Category'
+    field_path = 'product__category__name'
+
+
+class GrantFilter(CachedListFilter):
+    title = 'grant'
+    parameter_name = 'grant'
+    model = 'labhamster.Grant'
+    field_path = 'grant__name'
+
+
+class VendorFilter(CachedListFilter):
+    title = 'vendor'
+    parameter_name = 'vendor'
+    model = 'labhamster.Vendor'
+    field_path = 'product__vendor__name'
+
+
+class UserFilter(CachedListFilter):
+    title = 'requested by'
+    parameter_name = 'created_by'
+    model = 'auth.User'
+    name_field = 'username'
+    field_path = 'created_by__username'
+
+
+class ProductCategoryFilter(CategoryFilter):
+    field_path = 'category__name'
+
+
+class ProductVendorFilter(VendorFilter):
+    field_path = 'vendor__name'
+
+
+class ReorderFilter(admin.SimpleListFilter):
+    """Products by forecast reorder date, see labhamster.forecast"""
+    title = 'reorder'
+    parameter_name = 'reorder'
+
+    def lookups(self, request, model_admin):
+        return (('overdue', 'overdue'),
+                ('14', 'due in next 14 days'),
+                ('30', 'due in next 30 days'))
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        today = datetime.date.today()
+        if value == 'overdue':
+            return queryset.filter(forecast__date_due__lt=today)
+        if value in ('14', '30'):
+            return queryset.filter(forecast__date_due__lte=today +
+                                   datetime.timedelta(days=int(value)))
+        return queryset
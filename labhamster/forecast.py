@@ -0,0 +1,180 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Reorder forecast (ProductForecast) from the order history and shelf life,
+see ./manage.py forecast_reorders.
+
+All received orders are loaded once into NumPy arrays, sorted by product
+and date of receipt, and every product is computed at the same time with
+grouped array operations (no query or loop per product):
+
+  * days per unit: the intervals between consecutive deliveries of a
+    product, divided by the quantities delivered at their start
+  * runs out: last delivery + its quantity x days per unit
+  * expires: last delivery + shelf life
+  * reorder by: the earlier of both, minus the mean lead time (days from
+    ordering to receipt) of the product
+
+Products delivered only once have no consumption rate; they are only due
+when they expire.
+"""
+import datetime
+
+import numpy as np
+from django.apps import apps as django_apps
+from django.db import transaction
+
+EPOCH = datetime.date(1970, 1, 1)
+
+#: orders the forecast doesn't have to suggest again
+OPEN = ('draft', 'pending', 'quote', 'ordered')
+
+DRAFT_COMMENT = 'suggested by reorder forecast'
+
+
+def _history():
+    """
+    @return: (product, received, ordered, quantity) arrays of all received
+             orders sorted by product id and date of receipt; dates as days
+             since EPOCH, ordered is NaN if unknown
+    """
+    Order = django_apps.get_model('labhamster', 'Order')
+    rows = list(Order.objects.filter(status='received',
+                                     date_received__isnull=False)
+                .exclude(product__status='deprecated')
+                .order_by('product_id', 'date_received', 'id')
+                .values_list('product', 'date_received', 'date_ordered',
+                             'quantity'))
+    if not rows:
+        empty = np.zeros(0)
+        return empty.astype(np.int64), empty, empty, empty
+
+    product, received, ordered, quantity = zip(*rows)
+    received = np.array(received, dtype='datetime64[D]').astype(float)
+    ordered = np.array(ordered, dtype='datetime64[D]')
+    ordered = np.where(np.isnat(ordered), np.nan, ordered.astype(float))
+    quantity = np.maximum(np.array(quantity, dtype=float), 1)
+    return np.array(product, dtype=np.int64), received, ordered, quantity
+
+
+def compute(product, received, ordered, quantity, shelflife):
+    """
+    Forecast of every product with at least one delivery.
+    product, received, ordered, quantity - arrays, see _history()
+    shelflife - {product_id: days}
+    @return: dict of arrays, one entry per product: product, receipts,
+             last_received, quantity, days_per_unit, lead_time, runout,
+             expiry, due (dates as days since EPOCH, NaN if unknown)
+    """
+    ids, start, counts = np.unique(product, return_index=True,
+                                   return_counts=True)
+    n = len(ids)
+    group = np.repeat(np.arange(n), counts)
+
+    # intervals between consecutive deliveries of the same product
+    same = group[1:] == group[:-1]
+    g = group[1:][same]
+    span = np.bincount(g, weights=np.diff(received)[same], minlength=n)
+    units = np.bincount(g, weights=quantity[:-1][same], minlength=n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_per_unit = np.where(units > 0, span / units, np.nan)
+
+    last = start + counts - 1
+    last_received = received[last]
+    runout = last_received + quantity[last] * days_per_unit
+
+    life = np.full(n, np.nan)
+    if shelflife:
+        keys = np.array(sorted(shelflife), dtype=np.int64)
+        values = np.array([shelflife[k] for k in keys.tolist()], dtype=float)
+        pos = np.minimum(np.searchsorted(keys, ids), len(keys) - 1)
+        hit = keys[pos] == ids
+        life[hit] = values[pos[hit]]
+    expiry = last_received + life
+
+    known = ~np.isnan(ordered)
+    lead_n = np.bincount(group[known], minlength=n)
+    lead_sum = np.bincount(group[known],
+                           weights=(received - ordered)[known], minlength=n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lead_time = np.where(lead_n > 0, lead_sum / lead_n, np.nan)
+
+    due = np.fmin(runout, expiry) - np.nan_to_num(lead_time)
+
+    return dict(product=ids, receipts=counts, last_received=last_received,
+                quantity=quantity[last], days_per_unit=days_per_unit,
+                lead_time=lead_time, runout=runout, expiry=expiry, due=due)
+
+
+def _date(days):
+    """days since EPOCH (float, may be NaN) -> date or None"""
+    if np.isnan(days):
+        return None
+    return EPOCH + datetime.timedelta(days=int(round(days)))
+
+
+def _float(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def refresh():
+    """
+    Recompute the forecast of all products.
+    @return: int, number of products with a forecast
+    """
+    Product = django_apps.get_model('labhamster', 'Product')
+    ProductForecast = django_apps.get_model('labhamster', 'ProductForecast')
+
+    history = _history()
+    shelflife = dict(Product.objects.filter(shelflife__isnull=False)
+                     .values_list('pk', 'shelflife'))
+    f = compute(*history, shelflife=shelflife)
+
+    forecasts = [
+        ProductForecast(product_id=pk, receipts=receipts,
+                        last_received=_date(last), quantity=int(quantity),
+                        days_per_unit=_float(rate), lead_time=_float(lead),
+                        date_runout=_date(runout), date_expiry=_date(expiry),
+                        date_due=_date(due))
+        for pk, receipts, last, quantity, rate, lead, runout, expiry, due
+        in zip(f['product'].tolist(), f['receipts'].tolist(),
+               f['last_received'], f['quantity'], f['days_per_unit'],
+               f['lead_time'], f['runout'], f['expiry'], f['due'])]
+
+    with transaction.atomic():
+        ProductForecast.objects.all().delete()
+        ProductForecast.objects.bulk_create(forecasts, batch_size=500)
+    return len(forecasts)
+
+
+def due(days=14, today=None):
+    """@return: QuerySet of ProductForecasts due within days"""
+    ProductForecast = django_apps.get_model('labhamster', 'ProductForecast')
+    today = today or datetime.date.today()
+    return ProductForecast.objects.filter(
+        date_due__lte=today + datetime.timedelta(days=days))
+
+
+def create_drafts(user, days=14, today=None):
+    """
+    Create a draft order (with the quantity of the last order) for every
+    product due within days that is neither deprecated nor already has an
+    open order.
+    user - User, recorded as requester of the drafts
+    @return: [int], ids of the products drafts were created for
+    """
+    Order = django_apps.get_model('labhamster', 'Order')
+    products = list(due(days, today)
+                    .exclude(product__status='deprecated')
+                    .exclude(product__orders__status__in=OPEN)
+                    .order_by('date_due', 'product')
+                    .values_list('product', 'quantity'))
+    # few orders; save() records their history, statistics and search text
+    with transaction.atomic():
+        for pk, quantity in products:
+            Order(product_id=pk, quantity=quantity, status='draft',
+                  created_by=user, comment=DRAFT_COMMENT).save(user=user)
+    return [pk for pk, quantity in products]
@@ -0,0 +1,481 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Bulk import of vendors, products and orders from CSV files.
+
+Files use the column titles of the admin CSV export (ProductAdmin and
+OrderAdmin.csv_fields), so exported data can be imported again. Rows are
+read as a stream, related objects are resolved by name through in-memory
+lookup maps and new rows are inserted in batches, one transaction per
+batch. Rows that can't be imported are listed in the Report together with
+the reason. Search documents, order history, product statistics and spend
+rollups of the new rows are updated once per batch / once per import
+instead of once per row.
+"""
+import csv
+import datetime
+import functools
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+from djmoney.money import Money
+
+from . import caching
+from . import inventory
+from . import reports
+from . import search
+from . import stats
+from . import tools as T
+
+#: rows inserted per transaction
+BATCH_SIZE = 1000
+
+#: rows per UPDATE restoring dates (SQLite allows 999 query parameters)
+UPDATE_SIZE = 300
+
+#: months of spend rollups above which all rollups are rebuilt at once
+MAX_MONTHS = 60
+
+
+class Report(object):
+    """Outcome of an import: counts and rows that were not imported"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+
+    def error(self, line, message, values):
+        """
+        line    - int, line number in the CSV file
+        message - str, reason why the row was not imported
+        values  - [str], the row as read from the file
+        """
+        self.errors.append((line, message, values))
+
+    def write_errors(self, f):
+        """Write rejected rows as CSV: line, error, original columns"""
+        writer = csv.writer(f)
+        writer.writerow(['Line', 'Error'])
+        for line, message, values in self.errors:
+            writer.writerow([line, message] + list(values))
+
+    def __str__(self):
+        return '%i of %i %s rows imported, %i errors' % (
+            self.created, self.rows, self.kind, len(self.errors))
+
+
+def parse_date(text):
+    """@return: date or None, from YYYY-MM-DD"""
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('invalid date "%s" (expected YYYY-MM-DD)' % text)
+
+
+def parse_bool(text):
+    text = text.strip().lower()
+    if text in ('true', 'yes', '1', 'x'):
+        return True
+    if text in ('false', 'no', '0', ''):
+        return False
+    raise ValueError('invalid yes/no value "%s"' % text)
+
+
+def parse_int(text, default=None):
+    text = text.strip()
+    if not text:
+        return default
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError('invalid number "%s"' % text)
+
+
+@functools.lru_cache()
+def _currency_symbols():
+    """@return: {str: str}, currency code by symbol used in exported prices"""
+    r = {}
+    for code in getattr(settings, 'CURRENCIES', ('USD',)):
+        r[code.lower()] = code
+        symbol = str(Money(1, code)).replace('1.00', '').strip()
+        if symbol:
+            r[symbol.lower()] = code
+    return r
+
+
+def parse_money(text, default_currency='USD'):
+    """
+    Parse prices as written by the CSV export ('US$1,234.50', '1,234.50 €')
+    or with currency codes ('SAR 1234.50').
+    @return: Money or None
+    """
+    text = text.strip()
+    if not text:
+        return None
+    m = re.search(r'-?[\d,]*\.?\d+', text)
+    if not m:
+        raise ValueError('invalid price "%s"' % text)
+
+    symbol = (text[:m.start()] + text[m.end():]).strip().lower()
+    if symbol:
+        code = _currency_symbols().get(symbol)
+        if code is None:
+            raise ValueError('unknown currency "%s"' % symbol)
+    else:
+        code = default_currency
+
+    try:
+        return Money(Decimal(m.group().replace(',', '')), code)
+    except InvalidOperation:
+        raise ValueError('invalid price "%s"' % text)
+
+
+def parse_choice(text, field, default=None):
+    """@return: str, value of a choice field given as value or label"""
+    text = text.strip()
+    if not text:
+        return default or field.default
+    for value, label in field.choices:
+        if text.lower() in (value, label.lower()):
+            return value
+    raise ValueError('invalid %s "%s"' % (field.name, text))
+
+
+class Lookup(object):
+    """In-memory map from the unique name of objects to their id"""
+
+    def __init__(self, model, field='name', create=False):
+        """
+        create - bool, create objects with unknown names on the fly [False]
+        """
+        self.model = model
+        self.field = field
+        self.create = create
+        self.ids = dict(model._default_manager.order_by()
+                        .values_list(field, 'pk'))
+
+    def get(self, name, required=True):
+        """@return: int or None, id of the object with this name"""
+        name = name.strip()
+        if not name:
+            if required:
+                raise ValueError('%s missing' % self.model._meta.verbose_name)
+            return None
+        if name not in self.ids:
+            if not self.create:
+                raise ValueError('unknown %s "%s"'
+                                 % (self.model._meta.verbose_name, name))
+            self.ids[name] = self.model._default_manager.create(
+                **{self.field: name}).pk
+        return self.ids[name]
+
+
+def insert(model, objs):
+    """
+    Insert model instances with bulk_create() (no save(), no signals) and
+    restore the given values of auto_now_add dates, which bulk_create()
+    sets to the current date, with set-based updates. Call inside a
+    transaction.
+    @return: [int], ids of the new rows
+    """
+    manager = model._base_manager
+    auto = [f for f in model._meta.concrete_fields
+            if getattr(f, 'auto_now_add', False)]
+    given = {f: [getattr(o, f.attname) for o in objs] for f in auto}
+
+    manager.bulk_create(objs)
+    if connection.features.can_return_ids_from_bulk_insert:
+        ids = [o.pk for o in objs]
+    else:
+        # SQLite: this transaction holds the only write lock since its
+        # first INSERT, so the new rows are the ones with the highest ids
+        ids = sorted(manager.order_by('-pk')
+                     .values_list('pk', flat=True)[:len(objs)])
+
+    for f, values in given.items():
+        items = [(pk, value) for pk, o, value in zip(ids, objs, values)
+                 if value is not None and value != getattr(o, f.attname)]
+        for i in range(0, len(items), UPDATE_SIZE):
+            chunk = items[i:i + UPDATE_SIZE]
+            by_value = {}
+            for pk, value in chunk:
+                by_value.setdefault(value, []).append(pk)
+            manager.filter(pk__in=[pk for pk, value in chunk]).update(**{
+                f.attname: Case(*[When(pk__in=pks, then=Value(value))
+                                  for value, pks in by_value.items()],
+                                output_field=type(f)())})
+    return ids
+
+
+class Importer(object):
+    """Import rows of one CSV file as instances of self.model"""
+    model = None
+    kind = None
+
+    #: column titles that must be present
+    required = ()
+
+    def __init__(self):
+        self.report = Report(self.kind)
+
+    def build(self, row):
+        """
+        row - {str: str}, values by column title
+        @return: model instance (not saved)
+        @raise ValueError: if the row can't be imported
+        """
+        raise NotImplementedError
+
+    def inserted(self, ids):
+        """Update derived data of a batch of new rows"""
+        search.update(self.kind, ids)
+
+    def finish(self):
+        """Update derived data after all batches"""
+        pass
+
+    def run(self, f, batch_size=BATCH_SIZE):
+        """
+        f - file object opened in text mode
+        @return: Report
+        """
+        reader = csv.reader(f)
+        header = [title.strip() for title in next(reader, [])]
+        missing = [c for c in self.required if c not in header]
+        if missing:
+            raise ValueError('missing columns: %s' % ', '.join(missing))
+
+        batch = []
+        for values in reader:
+            if not any(v.strip() for v in values):
+                continue
+            self.report.rows += 1
+            row = dict(zip(header, values))
+            try:
+                batch.append(self.build(row))
+            except ValueError as error:
+                self.report.error(reader.line_num, str(error), values)
+                continue
+            if len(batch) >= batch_size:
+                self.flush(batch)
+                batch = []
+
+        self.flush(batch)
+        self.finish()
+        caching.invalidate(self.model._meta.model_name)
+        return self.report
+
+    def flush(self, batch):
+        if not batch:
+            return
+        with transaction.atomic():
+            ids = insert(self.model, batch)
+            self.inserted(ids)
+        self.report.created += len(ids)
+
+
+class VendorImporter(Importer):
+    kind = 'vendor'
+    required = ('Name',)
+
+    COLUMNS = (('Link', 'link'), ('Phone', 'phone'), ('Email', 'email'),
+               ('Contact', 'contact'))
+
+    def __init__(self):
+        super(VendorImporter, self).__init__()
+        self.model = django_apps.get_model('labhamster', 'Vendor')
+        self.vendors = Lookup(self.model)
+
+    def build(self, row):
+        name = row['Name'].strip()
+        if not name:
+            raise ValueError('name missing')
+        if name in self.vendors.ids:
+            raise ValueError('vendor "%s" already exists' % name)
+        self.vendors.ids[name] = None
+        return self.model(name=name, **{field: row.get(title, '').strip()
+                                        for title, field in self.COLUMNS})
+
+    def inserted(self, ids):
+        pass  # vendors have no search documents
+
+
+class ProductImporter(Importer):
+    kind = 'product'
+    required = ('Name', 'Vendor', 'Vendor Catalog', 'Category')
+
+    def __init__(self):
+        super(ProductImporter, self).__init__()
+        self.model = django_apps.get_model('labhamster', 'Product')
+        Vendor = django_apps.get_model('labhamster', 'Vendor')
+        Category = django_apps.get_model('labhamster', 'Category')
+        self.products = Lookup(self.model)
+        self.vendors = Lookup(Vendor, create=True)
+        self.categories = Lookup(Category, create=True)
+        self.ids = []
+
+    def build(self, row):
+        name = row['Name'].strip()
+        if not name:
+            raise ValueError('name missing')
+        if name in self.products.ids:
+            raise ValueError('product "%s" already exists' % name)
+
+        catalog = row['Vendor Catalog'].strip()
+        maker_catalog = row.get('Manufacturer Catalog', '').strip()
+        status = self.model._meta.get_field('status')
+        quantity = parse_int(row.get('On hand', ''))
+        if quantity is not None and quantity < 0:
+            raise ValueError('negative quantity on hand')
+        p = self.model(
+            name=name, name_key=T.normalize_name(name), catalog=catalog,
+            vendor_id=self.vendors.get(row['Vendor']),
+            manufacturer_id=self.vendors.get(row.get('Manufacturer', ''),
+                                             required=False),
+            manufacturer_catalog=maker_catalog,
+            catalog_key=T.normalize_catalog(catalog),
+            manufacturer_catalog_key=T.normalize_catalog(maker_catalog),
+            category_id=self.categories.get(row['Category']),
+            shelflife=parse_int(row.get('Shelf_life', '')),
+            status=parse_choice(row.get('Status', ''), status),
+            quantity_on_hand=quantity,
+            low_stock_threshold=parse_int(row.get('Low stock at', ''),
+                                          default=1),
+            location=row.get('Location', '').strip(),
+            link=row.get('Link', '').strip(),
+            comment=row.get('Comment', ''))
+        self.products.ids[name] = None
+        return p
+
+    def inserted(self, ids):
+        super(ProductImporter, self).inserted(ids)
+        self.ids.extend(ids)
+
+    def finish(self):
+        stats.refresh(self.ids)
+        if self.ids:
+            # status of counted products, one UPDATE over the id range
+            # (rows whose status is consistent already are not written)
+            inventory.refresh_status(self.model.objects.filter(
+                pk__gte=min(self.ids), pk__lte=max(self.ids)))
+
+
+class OrderImporter(Importer):
+    kind = 'order'
+    required = ('Product', 'Requested by')
+
+    def __init__(self):
+        super(OrderImporter, self).__init__()
+        self.model = django_apps.get_model('labhamster', 'Order')
+        Product = django_apps.get_model('labhamster', 'Product')
+        Grant = django_apps.get_model('labhamster', 'Grant')
+        self.products = Lookup(Product)
+        self.users = Lookup(User, field='username')
+        self.grants = Lookup(Grant)
+        self.today = datetime.date.today()
+        self.product_ids = set()
+        self.months = set()
+
+    def build(self, row):
+        meta = self.model._meta
+        created = parse_date(row.get('Requested', '')) or self.today
+        ordered = parse_date(row.get('Ordered', ''))
+        price = parse_money(row.get('Price', ''),
+                            meta.get_field('price').default_currency)
+
+        o = self.model(
+            product_id=self.products.get(row['Product']),
+            created_by_id=self.users.get(row['Requested by']),
+            ordered_by_id=self.users.get(row.get('Ordered by', ''),
+                                         required=False),
+            grant_id=self.grants.get(row.get('Grant', ''), required=False),
+            grant_category=parse_choice(row.get('Grant category', ''),
+                                        meta.get_field('grant_category')),
+            status=parse_choice(row.get('Status', ''),
+                                meta.get_field('status')),
+            is_urgent=parse_bool(row.get('Urgent', '')),
+            quantity=parse_int(row.get('Quantity', ''), default=1),
+            unit_size=row.get('Unit size', '').strip() or None,
+            po_number=row.get('PO Number', '').strip() or None,
+            date_created=created, date_ordered=ordered,
+            date_received=parse_date(row.get('Received', '')),
+            comment=row.get('Comment', ''))
+        o.price = price
+        return o
+
+    def inserted(self, ids):
+        super(OrderImporter, self).inserted(ids)
+        rows = list(self.model.objects.filter(pk__in=ids).order_by()
+                    .values_list('pk', 'product', 'date_created',
+                                 'date_ordered', 'date_received',
+                                 'ordered_by'))
+        seed_history(rows)
+        for pk, product, created, ordered, received, user in rows:
+            self.product_ids.add(product)
+            self.months.add(reports.order_month(ordered, created))
+
+    def finish(self):
+        stats.refresh(self.product_ids)
+        if len(self.months) > MAX_MONTHS:
+            reports.refresh_spend()
+        else:
+            reports.refresh_spend(self.months)
+
+
+def seed_history(rows):
+    """
+    Start the status history of imported orders from their date fields.
+    rows - [(pk, product, created, ordered, received, ordered_by)]
+    """
+    OrderEvent = django_apps.get_model('labhamster', 'OrderEvent')
+    stamps = {}
+
+    def stamp(d):
+        if d not in stamps:
+            stamps[d] = timezone.make_aware(
+                datetime.datetime.combine(d, datetime.time()))
+        return stamps[d]
+
+    events = []
+    for pk, product, created, ordered, received, ordered_by in rows:
+        events.append(OrderEvent(order_id=pk, from_status='',
+                                 to_status='pending',
+                                 timestamp=stamp(created)))
+        if ordered:
+            events.append(OrderEvent(order_id=pk, from_status='pending',
+                                     to_status='ordered', user_id=ordered_by,
+                                     timestamp=stamp(ordered)))
+        if received:
+            events.append(OrderEvent(
+                order_id=pk, from_status='ordered' if ordered else 'pending',
+                to_status='received', timestamp=stamp(received)))
+    OrderEvent.objects.bulk_create(events)
+
+
+IMPORTERS = {'vendor': VendorImporter, 'product': ProductImporter,
+             'order': OrderImporter}
+
+
+def import_csv(f, kind, batch_size=BATCH_SIZE):
+    """
+    Import a CSV file.
+    f    - file object opened in text mode
+    kind - str, 'vendor', 'product' or 'order'
+    @return: Report
+    @raise ValueError: if required columns are missing
+    """
+    return IMPORTERS[kind]().run(f, batch_size=batch_size)
@@ -0,0 +1,117 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Stock levels: units on hand per product (Product.quantity_on_hand).
+
+Receiving orders adds their quantity, the consume API endpoint subtracts
+units taken from the shelf. Both are single UPDATE statements with F()
+expressions evaluated by the database, so concurrent changes of the same
+product are neither lost (no read-modify-write in Python) nor block each
+other for longer than that one statement. Consumption is conditional on
+enough units being left; it never takes the count below zero.
+
+The status of counted products follows from their quantity ('out' at
+zero, 'low' at or below Product.low_stock_threshold, else 'ok') and is
+derived for whole querysets with one UPDATE ... CASE statement. Products
+without a count (quantity_on_hand empty) and the manual statuses
+'expired' and 'deprecated' are left alone.
+"""
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.db.models import Case, CharField, F, IntegerField, Q, Value, When
+
+from . import caching
+
+#: statuses derived from the quantity on hand
+DERIVED = ('ok', 'low', 'out')
+
+
+class OutOfStock(Exception):
+    """Fewer units on hand than requested"""
+    pass
+
+
+def derived_status():
+    """@return: expression of the status following from the quantity"""
+    return Case(
+        When(quantity_on_hand__lte=0, then=Value('out')),
+        When(quantity_on_hand__lte=F('low_stock_threshold'),
+             then=Value('low')),
+        default=Value('ok'), output_field=CharField())
+
+
+def refresh_status(queryset=None):
+    """
+    Derive the status of counted products of queryset (all products) from
+    their quantity; only rows whose status changes are written.
+    @return: int, number of products changed
+    """
+    Product = django_apps.get_model('labhamster', 'Product')
+    if queryset is None:
+        queryset = Product.objects.all()
+
+    low = Q(quantity_on_hand__gt=0,
+            quantity_on_hand__lte=F('low_stock_threshold'))
+    stale = (Q(quantity_on_hand__lte=0) & ~Q(status='out')) | \
+        (low & ~Q(status='low')) | \
+        (Q(quantity_on_hand__gt=F('low_stock_threshold')) & ~Q(status='ok'))
+
+    return Product.objects.filter(pk__in=queryset.values('pk'))\
+        .filter(quantity_on_hand__isnull=False, status__in=DERIVED)\
+        .filter(stale).order_by().update(status=derived_status())
+
+
+def receive(quantities):
+    """
+    Add received units to the stock of counted products.
+    quantities - {product_id: units}
+    @return: int, number of products changed
+    """
+    Product = django_apps.get_model('labhamster', 'Product')
+    quantities = {pk: n for pk, n in quantities.items() if n}
+    if not quantities:
+        return 0
+
+    units = Case(*[When(pk=pk, then=Value(n))
+                   for pk, n in quantities.items()],
+                 default=Value(0), output_field=IntegerField())
+    counted = Product.objects.filter(pk__in=list(quantities),
+                                     quantity_on_hand__isnull=False)
+    with transaction.atomic():
+        n = counted.update(quantity_on_hand=F('quantity_on_hand') + units)
+        refresh_status(counted)
+    caching.invalidate('product')
+    return n
+
+
+def consume(product_id, units=1):
+    """
+    Take units of a counted product from the stock.
+    @return: (int, str), remaining quantity and status of the product
+    @raise ValueError: if units is not positive
+    @raise OutOfStock: if fewer units are on hand (nothing is taken)
+    @raise Product.DoesNotExist: if the product doesn't exist
+    """
+    Product = django_apps.get_model('labhamster', 'Product')
+    if units < 1:
+        raise ValueError('units must be positive')
+
+    product = Product.objects.filter(pk=product_id)
+    with transaction.atomic():
+        taken = product.filter(quantity_on_hand__gte=units)\
+            .update(quantity_on_hand=F('quantity_on_hand') - units)
+        if taken:
+            refresh_status(product)
+        r = product.values_list('quantity_on_hand', 'status').get()
+
+    if not taken:
+        if r[0] is None:
+            raise OutOfStock('stock of this product is not counted')
+        raise OutOfStock('only %i units on hand' % r[0])
+
+    # bulk updates bypass the signals invalidating cached counts
+    caching.invalidate('product')
+    return r
@@ -0,0 +1,225 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Background jobs: admin actions over more than settings.JOB_QUEUE_THRESHOLD
+rows are saved as Job (with the pickled query of their queryset) instead
+of running inside the web request, and executed by ./manage.py run_jobs.
+
+Workers claim the oldest queued job with SELECT ... FOR UPDATE SKIP LOCKED
+where the database supports it (Postgres) or else with a conditional
+UPDATE that only one worker can win (SQLite). Jobs report their progress
+every few thousand rows. Exported files are written to a temporary file,
+stored with the job in chunks of CHUNK_SIZE bytes (JobChunk) and streamed
+from there for download in the admin (Jobs), so neither the worker nor the
+web server holds a whole file in memory.
+"""
+import json
+import logging
+import pickle
+import tempfile
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import export
+from . import transitions
+
+logger = logging.getLogger('labhamster.jobs')
+
+#: orders changed per transaction by status change jobs
+BATCH_SIZE = 1000
+
+#: seconds without progress report after which a running job is failed
+STALE_SECONDS = 3600
+
+#: bytes of an exported file per JobChunk row
+CHUNK_SIZE = 1024 * 1024
+
+
+def threshold():
+    """@return: int, rows above which actions are queued (0: never)"""
+    return getattr(settings, 'JOB_QUEUE_THRESHOLD', 5000)
+
+
+def enqueue(kind, queryset, user, description, params, total=None):
+    """
+    Queue an action on queryset.
+    kind   - str, 'export' or 'transition', see HANDLERS
+    params - dict, JSON-serializable arguments of the handler
+    total  - int, number of rows of queryset if already known
+    @return: Job
+    """
+    Job = django_apps.get_model('labhamster', 'Job')
+    return Job.objects.create(
+        kind=kind, description=description, user=user,
+        model=queryset.model._meta.label_lower,
+        query=pickle.dumps(queryset.query), params=json.dumps(params),
+        total=queryset.count() if total is None else total)
+
+
+def enqueue_large(kind, queryset, user, description, params):
+    """
+    Queue an action if queryset has more than threshold() rows.
+    @return: Job or None if the action should run right away
+    """
+    limit = threshold()
+    if not limit:
+        return None
+    n = queryset.count()
+    if n <= limit:
+        return None
+    return enqueue(kind, queryset, user, description, params, total=n)
+
+
+def claim(worker):
+    """
+    Mark the oldest queued job as running by worker.
+    @return: Job or None if there is nothing to do
+    """
+    Job = django_apps.get_model('labhamster', 'Job')
+    queued = Job.objects.filter(status='queued')\
+        .order_by('date_created', 'id')
+    now = timezone.now()
+    running = dict(status='running', worker=worker, date_started=now,
+                   heartbeat=now)
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pk = queued.select_for_update(skip_locked=True)\
+                .values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            Job.objects.filter(pk=pk).update(**running)
+    else:
+        # whoever updates the row first wins, the others update 0 rows
+        for pk in queued.values_list('pk', flat=True)[:10]:
+            if Job.objects.filter(pk=pk, status='queued').update(**running):
+                break
+        else:
+            return None
+    return Job.objects.get(pk=pk)
+
+
+def queryset(job):
+    """@return: QuerySet, the queryset of the action that queued job"""
+    qs = django_apps.get_model(job.model)._default_manager.all()
+    qs.query = pickle.loads(bytes(job.query))
+    return qs
+
+
+def store(job, f):
+    """Save the content of file f (binary) as the file of job."""
+    JobChunk = django_apps.get_model('labhamster', 'JobChunk')
+    JobChunk.objects.filter(job=job).delete()
+    f.seek(0)
+    job.size = 0
+    for number, data in enumerate(iter(lambda: f.read(CHUNK_SIZE), b'')):
+        JobChunk.objects.create(job=job, number=number, data=data)
+        job.size += len(data)
+
+
+def chunks(job):
+    """Generator over the file of job, reading one chunk per query"""
+    JobChunk = django_apps.get_model('labhamster', 'JobChunk')
+    data = JobChunk.objects.values_list('data', flat=True)
+    for pk in JobChunk.objects.filter(job=job).order_by('number')\
+            .values_list('pk', flat=True):
+        yield bytes(data.get(pk=pk))
+
+
+def run_export(job, queryset, params, progress):
+    fields = OrderedDict(params['fields'])
+    with tempfile.TemporaryFile() as f:
+        if params['format'] == 'xlsx':
+            export.write_xlsx(
+                f, queryset, fields, progress=progress,
+                title=str(queryset.model._meta.verbose_name_plural))
+            job.content_type = export.XLSX_TYPE
+        else:
+            for line in export.csv_lines(queryset, fields, progress):
+                f.write(line.encode('utf-8'))
+            job.content_type = 'text/csv'
+        store(job, f)
+    job.filename = params['filename']
+    return 'ready for download'
+
+
+def run_transition(job, queryset, params, progress):
+    Order = django_apps.get_model('labhamster', 'Order')
+    ids = list(queryset.values_list('pk', flat=True))
+    changed, products = 0, set()
+    for i in range(0, len(ids), BATCH_SIZE):
+        batch = ids[i:i + BATCH_SIZE]
+        r = transitions.transition(Order.objects.filter(pk__in=batch),
+                                   params['status'], user=job.user)
+        changed += len(r.changed)
+        products.update(r.products)
+        progress(i + len(batch))
+    return '%i orders were set to %s (%i products)' % (
+        changed, params['status'], len(products))
+
+
+#: kind -> function(job, queryset, params, progress) returning a message
+HANDLERS = {'export': run_export, 'transition': run_transition}
+
+
+def run(job):
+    """Execute a claimed job and record its outcome."""
+    Job = django_apps.get_model('labhamster', 'Job')
+
+    def progress(n):
+        Job.objects.filter(pk=job.pk).update(progress=n,
+                                             heartbeat=timezone.now())
+
+    try:
+        job.message = HANDLERS[job.kind](
+            job, queryset(job), json.loads(job.params), progress)
+        job.status = 'done'
+        job.progress = job.total
+    except Exception as e:
+        logger.exception('%s failed', job)
+        job.status = 'failed'
+        job.message = '%s: %s' % (e.__class__.__name__, e)
+    job.date_finished = job.heartbeat = timezone.now()
+
+    # fail_stale() may have given up on the job in the meantime
+    outcome = ['status', 'message', 'progress', 'date_finished', 'heartbeat',
+               'filename', 'content_type', 'size']
+    if not Job.objects.filter(pk=job.pk, status='running').update(
+            **{f: getattr(job, f) for f in outcome}):
+        logger.warning('%s was failed while running, outcome discarded', job)
+        job.chunks.all().delete()
+        job.refresh_from_db()
+    return job
+
+
+def fail_stale(seconds=STALE_SECONDS):
+    """
+    Fail running jobs without progress report for seconds, e.g. because
+    their worker was killed. @return: int, number of jobs failed
+    """
+    Job = django_apps.get_model('labhamster', 'Job')
+    now = timezone.now()
+    return Job.objects.filter(
+        status='running', heartbeat__lt=now - timedelta(seconds=seconds))\
+        .update(status='failed', date_finished=now,
+                message='worker stopped responding')
+
+
+def purge(days=None):
+    """
+    Delete jobs finished more than days (settings.JOB_KEEP_DAYS) ago,
+    together with their files. @return: int, number of jobs deleted
+    """
+    Job = django_apps.get_model('labhamster', 'Job')
+    days = days or getattr(settings, 'JOB_KEEP_DAYS', 7)
+    return Job.objects.filter(
+        date_finished__lt=timezone.now() - timedelta(days=days))\
+        .delete()[1].get(Job._meta.label, 0)
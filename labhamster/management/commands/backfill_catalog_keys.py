@@ -0,0 +1,19 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from labhamster import tools
+import labhamster.models as M
+
+
+class Command(BaseCommand):
+    help = 'Recompute normalized catalog keys of all products'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            n = tools.update_catalog_keys(M.Product)
+        self.stdout.write('%i products updated' % n)
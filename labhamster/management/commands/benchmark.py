@@ -0,0 +1,217 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Time typical admin and API requests against the current database (see
+./manage.py generate_data) and write the results as JSON, optionally
+compared to an earlier run:
+
+    ./manage.py benchmark --output before.json
+    ./manage.py benchmark --compare before.json --output after.json
+
+Every request runs inside a transaction that is rolled back, so bulk
+actions don't change the data. Times are medians over --repeat runs with
+warm caches; query counts are taken from the last run.
+"""
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from labhamster.admin import OrderAdmin
+import labhamster.models as M
+
+SETTINGS = dict(
+    SECURE_SSL_REDIRECT=False, JOB_QUEUE_THRESHOLD=0,  # time actions inline
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+
+
+class Rollback(Exception):
+    pass
+
+
+def scenarios():
+    """
+    @return: [(str, str, str, dict)], name, method, URL and data of each
+             benchmarked request, with parameters taken from the data
+    """
+    orders = M.Order.objects.order_by()
+    n = orders.count()
+    last = orders.order_by('-date_created').values_list(
+        'date_created', flat=True).first()
+    name = orders.values_list('product__name', flat=True).first()
+    word = (name or 'product').split()[0].lower()
+    catalog = M.Product.objects.values_list('catalog', flat=True)\
+        .order_by('pk').first() or 'A'
+    open_ids = list(orders.filter(status__in=('pending', 'ordered'))
+                    .values_list('pk', flat=True)[:100])
+    product_ids = list(M.Product.objects.order_by()
+                       .values_list('pk', flat=True)[:100])
+    any_id = orders.values_list('pk', flat=True).first()
+    page = max(n // OrderAdmin.list_per_page // 2, 1)
+
+    r = [
+        ('order changelist', 'get', '/labhamster/order/', {}),
+        ('order changelist deep page', 'get', '/labhamster/order/',
+         {'p': page}),
+        ('order status filter', 'get', '/labhamster/order/',
+         {'status__exact': 'ordered'}),
+        ('order search', 'get', '/labhamster/order/', {'q': word}),
+        ('product changelist', 'get', '/labhamster/product/', {}),
+        ('product search', 'get', '/labhamster/product/', {'q': word}),
+        ('product catalog lookup', 'get', '/labhamster/product/',
+         {'q': catalog[:4]}),
+        ('product autocomplete', 'get',
+         '/labhamster/product/autocomplete/', {'q': word[:3]}),
+        ('api orders', 'get', '/api/v1/orders/', {'limit': 500}),
+        ('order csv export', 'post', '/labhamster/order/',
+         {'action': 'make_csv', 'select_across': '1', 'index': '0',
+          '_selected_action': [any_id]}),
+        ('orders received (bulk)', 'post', '/labhamster/order/',
+         {'action': 'make_received', 'index': '0',
+          '_selected_action': open_ids}),
+        ('products low (bulk)', 'post', '/labhamster/product/',
+         {'action': 'make_low', 'index': '0',
+          '_selected_action': product_ids}),
+    ]
+    if last:
+        r[3:3] = [
+            ('order year drilldown', 'get', '/labhamster/order/',
+             {'date_created__year': last.year}),
+            ('order month drilldown', 'get', '/labhamster/order/',
+             {'date_created__year': last.year,
+              'date_created__month': last.month})]
+    return r
+
+
+def measure(client, method, url, data, repeat):
+    """
+    @return: {str: value}, median / min / max seconds and query count
+    """
+    times = []
+    for i in range(repeat + 1):  # first run warms up caches
+        with CaptureQueriesContext(connection) as context:
+            t0 = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    response = getattr(client, method)(url, data, secure=True)
+                    if response.streaming:
+                        for chunk in response.streaming_content:
+                            pass
+                    raise Rollback()
+            except Rollback:
+                pass
+            elapsed = time.perf_counter() - t0
+        if response.status_code >= 400:
+            raise CommandError('%s %s: status %i' %
+                               (method.upper(), url, response.status_code))
+        if i:
+            times.append(elapsed)
+    return {'median': statistics.median(times), 'min': min(times),
+            'max': max(times), 'queries': len(context), 'runs': repeat}
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'django': django.get_version(),
+            'python': platform.python_version(),
+            'database': connection.vendor}
+
+
+def compare(old, new, tolerance=0.1):
+    """
+    old, new  - dict, results of two runs
+    tolerance - float, relative slow down reported as regression
+    @return: [(str, float, float, float, str)], name, old and new median,
+             ratio new / old and 'SLOWER' / 'faster' / ''
+    """
+    r = []
+    for name, result in new.items():
+        if name not in old:
+            continue
+        before, after = old[name]['median'], result['median']
+        ratio = after / before if before else 1.
+        flag = 'SLOWER' if ratio > 1 + tolerance else \
+            'faster' if ratio < 1 - tolerance else ''
+        if result['queries'] > old[name]['queries']:
+            flag = (flag + ' more queries').strip()
+        r.append((name, before, after, ratio, flag))
+    return r
+
+
+class Command(BaseCommand):
+    help = 'Benchmark changelists, search, export and bulk actions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='timed runs per request [5]')
+        parser.add_argument('--only', default='',
+                            help='run only requests containing this text')
+        parser.add_argument('--output', help='write JSON results to file')
+        parser.add_argument('--compare', help='JSON results of earlier run')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='slow down reported as regression [0.1]')
+        parser.add_argument('--strict', action='store_true',
+                            help='fail if any request got slower')
+
+    def handle(self, *args, **options):
+        results = {}
+        try:
+            with override_settings(**SETTINGS), transaction.atomic():
+                results = self.run(options)
+                raise Rollback()
+        except Rollback:
+            pass
+
+        report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'environment': environment(),
+                  'data': {'orders': M.Order.objects.count(),
+                           'products': M.Product.objects.count(),
+                           'vendors': M.Vendor.objects.count()},
+                  'results': results}
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                old = json.load(f)['results']
+            rows = compare(old, results, options['tolerance'])
+            self.stdout.write('\n%-30s %9s %9s %7s' %
+                              ('', 'before', 'after', 'ratio'))
+            for name, before, after, ratio, flag in rows:
+                self.stdout.write('%-30s %8.1fms %8.1fms %7.2f %s' % (
+                    name, before * 1000, after * 1000, ratio, flag))
+            if options['strict'] and any('SLOWER' in r[4] for r in rows):
+                raise CommandError('performance regression')
+
+    def run(self, options):
+        user = User.objects.create_superuser('_benchmark_admin', '', 'x')
+        client = Client()
+        client.force_login(user)
+
+        results = {}
+        for name, method, url, data in scenarios():
+            if options['only'] not in name:
+                continue
+            r = measure(client, method, url, data, options['repeat'])
+            results[name] = r
+            self.stdout.write('%-30s %8.1fms %5i queries' %
+                              (name, r['median'] * 1000, r['queries']))
+        return results
@@ -0,0 +1,91 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Measure CSV or Excel export throughput (rows per second) on synthetic
+orders.
+
+The synthetic data is created inside a transaction that is rolled back at
+the end, so the command can be run against a development database:
+
+    ./manage.py benchmark_export --rows 10000 100000 1000000
+    ./manage.py benchmark_export --format xlsx --rows 100000
+"""
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from labhamster import routers
+from labhamster.admin import OrderAdmin
+from labhamster.export import export_csv, export_xlsx
+import labhamster.models as M
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark streaming CSV / Excel export of synthetic orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+',
+                            default=[10000, 100000, 1000000],
+                            help='number of synthetic orders per run')
+        parser.add_argument('--batch', type=int, default=5000,
+                            help='bulk_create batch size')
+        parser.add_argument('--format', choices=('csv', 'xlsx'),
+                            default='csv', help='export format [csv]')
+
+    def handle(self, *args, **options):
+        for n in options['rows']:
+            try:
+                with transaction.atomic():
+                    self.run(n, options['batch'], options['format'])
+                    raise Rollback()
+            except Rollback:
+                pass
+
+    def populate(self, n, batch):
+        user = User.objects.create(username='_benchmark_user')
+        vendor = M.Vendor.objects.create(name='_benchmark_vendor')
+        category = M.Category.objects.create(name='_benchmark')
+        products = [M.Product.objects.create(name='_benchmark product %i' % i,
+                                             vendor=vendor, catalog='B-%04i' % i,
+                                             category=category)
+                    for i in range(20)]
+
+        for start in range(0, n, batch):
+            M.Order.objects.bulk_create(
+                [M.Order(product=products[i % 20], created_by=user,
+                         ordered_by=user, quantity=1 + i % 5,
+                         price=(i % 1000) / 10., status='received',
+                         comment='synthetic order %i' % i)
+                 for i in range(start, min(n, start + batch))])
+
+    def run(self, n, batch, format='csv'):
+        self.populate(n, batch)
+        request = RequestFactory().get('/')
+        queryset = M.Order.objects.all()
+        rows = queryset.count()
+
+        # the synthetic rows only exist on the primary ('default') database
+        routers.pin_primary()
+        try:
+            t0 = time.time()
+            export = export_xlsx if format == 'xlsx' else export_csv
+            response = export(request, queryset, OrderAdmin.csv_fields)
+            size = 0
+            for chunk in response.streaming_content:
+                size += len(chunk)
+            elapsed = time.time() - t0
+        finally:
+            routers.pin_primary(False)
+
+        self.stdout.write('%9i orders: %7.2f s  %9.0f rows/s  %8.1f MB' %
+                          (rows, elapsed, rows / elapsed, size / 1e6))
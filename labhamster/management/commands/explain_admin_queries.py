@@ -0,0 +1,110 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Render the order and product changelists with typical filters, run EXPLAIN
+on every query they send to the database and report whether it is
+answered from an index or scans a whole table:
+
+    ./manage.py explain_admin_queries
+    ./manage.py explain_admin_queries -v 2     # print the query plans
+
+Run it against a database of realistic size (and ANALYZEd on PostgreSQL),
+the planner may prefer table scans for small tables.
+"""
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+import labhamster.models as M
+from labhamster import stats
+
+STATIC_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+
+#: (title, model, changelist parameters)
+PATTERNS = [
+    ('orders', M.Order, {}),
+    ('orders by status', M.Order, {'status__exact': 'pending'}),
+    ('open orders', M.Order, {'status__in': ','.join(stats.OPEN)}),
+    ('orders by year', M.Order, {'date_created__year': '2017'}),
+    ('orders by month', M.Order, {'date_created__year': '2017',
+                                  'date_created__month': '1'}),
+    ('orders page 10', M.Order, {'p': '9'}),
+    ('products', M.Product, {}),
+    ('products by status', M.Product, {'status__exact': 'low'}),
+    ('products to restock', M.Product, {'status__in': 'low,out,expired'}),
+]
+
+
+def explain(sql):
+    """
+    @return: ([str], bool, [str], bool), query plan, True if any index
+             is used, the plan lines scanning a whole table and True if all
+             rows are sorted (rather than read in index order)
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+            scans = [l for l in plan
+                     if l.startswith('SCAN') and 'INDEX' not in l]
+            indexed = any('INDEX' in l or 'PRIMARY KEY' in l for l in plan)
+            sorting = any('B-TREE FOR ORDER BY' in l for l in plan)
+        else:
+            cursor.execute('EXPLAIN ' + sql)
+            plan = [' '.join(str(v) for v in row) for row in
+                    cursor.fetchall()]
+            scans = [l for l in plan if 'Seq Scan' in l]
+            indexed = any('Index' in l for l in plan)
+            sorting = any(l.lstrip(' ->').startswith('Sort ') for l in plan)
+    return plan, indexed, scans, sorting
+
+
+def changelist_queries(model, params):
+    """
+    @return: [str], SQL of all queries run by rendering a changelist
+    """
+    model_admin = admin.site._registry[model]
+    request = RequestFactory().get('/', params)
+    request.user = User(username='_explain', is_active=True, is_staff=True,
+                        is_superuser=True)
+
+    # the page is rendered only for its queries, static files don't matter
+    with CaptureQueriesContext(connection) as context, override_settings(
+            STATICFILES_STORAGE=STATIC_STORAGE):
+        response = model_admin.changelist_view(request)
+        if hasattr(response, 'render'):
+            response.render()
+
+    r = []
+    for q in context.captured_queries:
+        if 'labhamster_' in q['sql'] and q['sql'] not in r:
+            r.append(q['sql'])
+    return r
+
+
+class Command(BaseCommand):
+    help = 'Report index usage of the queries of order / product changelists'
+
+    def handle(self, *args, **options):
+        verbose = options['verbosity'] > 1
+        n_scans = 0
+        for title, model, params in PATTERNS:
+            self.stdout.write('%s %s' % (title, params or ''))
+            for sql in changelist_queries(model, params):
+                plan, indexed, scans, sorting = explain(sql)
+                n_scans += bool(scans)
+                status = 'TABLE SCAN' if scans else \
+                    'index' if indexed else 'no index'
+                if sorting:
+                    status += '+sort'
+                self.stdout.write('  %-16s %s' % (status, sql[:100]))
+                for line in plan if verbose else scans:
+                    self.stdout.write('                   %s' % line)
+
+        self.stdout.write('%i queries with table scans' % n_scans)
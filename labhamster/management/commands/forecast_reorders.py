@@ -0,0 +1,34 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from labhamster import forecast
+
+
+class Command(BaseCommand):
+    help = 'Forecast when products must be reordered; optionally draft ' \
+           'orders for them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drafts', metavar='USERNAME',
+                            help='create draft orders requested by this user')
+        parser.add_argument('--days', type=int, default=14,
+                            help='draft orders for products due within '
+                            'days [14]')
+
+    def handle(self, *args, **options):
+        n = forecast.refresh()
+        self.stdout.write('%i product forecasts, %i due within %i days' % (
+            n, forecast.due(options['days']).count(), options['days']))
+
+        if options['drafts']:
+            try:
+                user = User.objects.get(username=options['drafts'])
+            except User.DoesNotExist:
+                raise CommandError('no user %s' % options['drafts'])
+            products = forecast.create_drafts(user, days=options['days'])
+            self.stdout.write('%i draft orders created' % len(products))
@@ -0,0 +1,43 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Fill an (empty) database with a reproducible synthetic data set, e.g. for
+./manage.py benchmark:
+
+    ./manage.py generate_data --orders 100000 --seed 1
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from labhamster import synthetic
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic vendors, products, users, grants and orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendors', type=int, default=50)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=30)
+        parser.add_argument('--grants', type=int, default=10)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--years', type=int, default=5,
+                            help='orders are spread over that many years [5]')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='random seed, same seed gives same data [0]')
+
+    def handle(self, *args, **options):
+        t0 = time.time()
+        synthetic.generate(
+            vendors=options['vendors'], products=options['products'],
+            users=options['users'], grants=options['grants'],
+            orders=options['orders'], years=options['years'],
+            seed=options['seed'])
+        self.stdout.write('%(vendors)i vendors, %(products)i products, '
+                          '%(users)i users, %(grants)i grants, '
+                          '%(orders)i orders' % options +
+                          ' generated in %.1f s' % (time.time() - t0))
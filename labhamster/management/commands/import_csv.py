@@ -0,0 +1,43 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from labhamster import importer
+
+
+class Command(BaseCommand):
+    help = 'Import vendors, products or orders from a CSV file ' \
+           '(columns as written by the admin CSV export)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(importer.IMPORTERS))
+        parser.add_argument('file', help='CSV file (UTF-8)')
+        parser.add_argument('--errors', metavar='FILE',
+                            help='write rejected rows to this CSV file')
+        parser.add_argument('--batch-size', type=int,
+                            default=importer.BATCH_SIZE,
+                            help='rows per transaction [%(default)s]')
+
+    def handle(self, *args, **options):
+        with io.open(options['file'], encoding='utf-8-sig', newline='') as f:
+            try:
+                report = importer.import_csv(f, options['kind'],
+                                             options['batch_size'])
+            except ValueError as error:
+                raise CommandError(str(error))
+
+        if options['errors'] and report.errors:
+            with io.open(options['errors'], 'w', encoding='utf-8',
+                         newline='') as f:
+                report.write_errors(f)
+
+        for line, message, values in report.errors[:20]:
+            self.stderr.write('line %i: %s' % (line, message))
+        if len(report.errors) > 20:
+            self.stderr.write('... %i more errors' % (len(report.errors) - 20))
+        self.stdout.write(str(report))
@@ -0,0 +1,38 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from labhamster import currency, reports, stats
+from labhamster.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Load exchange rates from a CSV file (columns: date,currency,rate)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='CSV file with exchange rates')
+
+    def handle(self, *args, **options):
+        with open(options['file']) as f:
+            rates = currency.load_rates(f)
+
+        if not rates:
+            self.stdout.write('no exchange rates found')
+            return
+
+        # converted totals of orders booked since the first new rate change
+        since = min(d for c, d in rates)
+        orders = Order.objects.order_by()\
+            .filter(price_currency__in={c for c, d in rates})\
+            .filter(Q(date_ordered__gte=since) |
+                    Q(date_ordered__isnull=True, date_created__gte=since))
+        products = orders.values_list('product', flat=True).distinct()
+        stats.refresh(list(products))
+        months = orders.values_list('date_ordered', 'date_created').distinct()
+        reports.refresh_spend(reports.order_month(*m) for m in months)
+
+        self.stdout.write('%i exchange rates loaded' % len(rates))
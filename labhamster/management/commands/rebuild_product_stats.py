@@ -0,0 +1,16 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+from django.core.management.base import BaseCommand
+
+from labhamster import stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute order statistics of all products'
+
+    def handle(self, *args, **options):
+        stats.refresh()
+        self.stdout.write('product statistics rebuilt')
@@ -0,0 +1,18 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from labhamster import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild full-text search documents of all products and orders'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            search.rebuild()
+        self.stdout.write('search index rebuilt')
@@ -0,0 +1,16 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+from django.core.management.base import BaseCommand
+
+from labhamster import reports
+
+
+class Command(BaseCommand):
+    help = 'Recompute the monthly spend rollups of all orders'
+
+    def handle(self, *args, **options):
+        reports.refresh_spend()
+        self.stdout.write('spend rollups rebuilt')
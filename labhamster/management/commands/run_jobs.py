@@ -0,0 +1,49 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Worker executing queued background jobs (see labhamster/jobs.py) and
+sending notification digests (labhamster/notifications.py); run one or
+more next to the web server, e.g. as Heroku worker process:
+
+    ./manage.py run_jobs
+"""
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from labhamster import jobs, notifications
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs and send notification digests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='exit when no job is left')
+        parser.add_argument('--sleep', type=float, default=2.,
+                            help='seconds between polls for new jobs [2]')
+
+    def handle(self, *args, **options):
+        worker = '%s:%i' % (socket.gethostname(), os.getpid())
+        while True:
+            close_old_connections()
+            jobs.fail_stale()
+            jobs.purge()
+            notifications.send_due()
+
+            job = jobs.claim(worker)
+            if job is not None:
+                job = jobs.run(job)
+                self.stdout.write('%s: %s %s' % (job, job.status,
+                                                 job.message))
+                continue
+
+            if options['once']:
+                return
+            time.sleep(options['sleep'])
@@ -0,0 +1,19 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+from django.core.management.base import BaseCommand
+
+from labhamster import notifications
+
+
+class Command(BaseCommand):
+    help = 'E-mail requesters about status changes of their orders'
+
+    def handle(self, *args, **options):
+        digest = notifications.send()
+        if digest is None:
+            self.stdout.write('no new status changes')
+        else:
+            self.stdout.write('%s: %i messages' % (digest, digest.messages))
@@ -0,0 +1,216 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Counters and histograms in the Prometheus text exposition format, served
+at /metrics (see views.metrics).
+
+Every server process (e.g. gunicorn worker) keeps its values in memory
+and writes them, at most once per FLUSH_INTERVAL seconds, to its own file
+in settings.METRICS_DIR. The endpoint adds up the files of all processes,
+so totals are correct no matter which worker answers the scrape. Files
+of processes that ended are kept (their counts stay in the totals); the
+directory should be emptied when the server is restarted.
+
+Metrics are only recorded if settings.PERFORMANCE_INSTRUMENTATION is set
+(request and database metrics come from middleware.PerformanceMiddleware).
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+
+#: seconds between writes of the values of one process
+FLUSH_INTERVAL = 1.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#: upper bounds (seconds) of the request latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+def enabled():
+    return getattr(settings, 'PERFORMANCE_INSTRUMENTATION', False)
+
+
+def directory():
+    return getattr(settings, 'METRICS_DIR', None) or \
+        os.path.join(tempfile.gettempdir(), 'labhamster-metrics')
+
+
+class Store(object):
+    """Values of this process, {(name, labels): float}, and their file"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # also after a fork: the child starts with a file and values of its
+        # own instead of counting those of its parent twice
+        self.pid = os.getpid()
+        self.values = defaultdict(float)
+        self.path = None
+        self.timer = None
+
+    def add(self, name, labels, value):
+        """
+        name   - str, sample name, e.g. 'labhamster_exported_rows_total'
+        labels - ((str, str),), label names and values
+        """
+        with self._lock:
+            if self.pid != os.getpid():
+                self._reset()
+            self.values[(name, labels)] += value
+            if self.timer is None:
+                self.timer = threading.Timer(FLUSH_INTERVAL, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Write the values of this process to its file"""
+        with self._lock:
+            if self.pid != os.getpid():
+                self._reset()
+            self.timer = None
+            if not self.values:
+                return
+            os.makedirs(directory(), exist_ok=True)
+            if self.path is None:
+                self.path = os.path.join(directory(), '%i-%s.json' % (
+                    self.pid, uuid.uuid4().hex[:8]))
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump([[name, labels, value]
+                           for (name, labels), value in self.values.items()],
+                          f)
+            os.replace(tmp, self.path)
+
+    def clear(self):
+        """Forget the values of this process (not those in its file)"""
+        with self._lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self._reset()
+
+    def collect(self):
+        """@return: {(str, tuple): float}, sum of the values of all processes"""
+        self.flush()
+        r = defaultdict(float)
+        path = directory()
+        for name in os.listdir(path) if os.path.isdir(path) else []:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(path, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue  # just replaced or truncated
+            for sample, labels, value in data:
+                r[(sample, tuple(tuple(l) for l in labels))] += value
+        return r
+
+
+store = Store()
+atexit.register(store.flush)
+
+#: name -> (type, help) of all metrics
+REGISTRY = {}
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.labels = tuple(labels)
+        REGISTRY[name] = (self.type, help)
+
+    def _labels(self, kwargs):
+        return tuple((l, str(kwargs[l])) for l in self.labels)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if enabled():
+            store.add(self.name, self._labels(labels), amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        if not enabled():
+            return
+        labels = self._labels(labels)
+        for b in self.buckets:
+            # empty buckets are listed, too
+            store.add(self.name + '_bucket', labels + (('le', repr(b)),),
+                      int(value <= b))
+        store.add(self.name + '_bucket', labels + (('le', '+Inf'),), 1)
+        store.add(self.name + '_sum', labels, value)
+        store.add(self.name + '_count', labels, 1)
+
+
+REQUEST_SECONDS = Histogram(
+    'labhamster_http_request_duration_seconds',
+    'Request latency by view and HTTP method', ('view', 'method'))
+DB_QUERIES = Counter(
+    'labhamster_db_queries_total', 'SQL queries by view', ('view',))
+DB_SECONDS = Counter(
+    'labhamster_db_query_seconds_total', 'Time spent in SQL queries by view',
+    ('view',))
+EXPORTED_ROWS = Counter(
+    'labhamster_exported_rows_total', 'Rows of CSV / Excel exports',
+    ('model', 'format'))
+TRANSITIONS = Counter(
+    'labhamster_order_transitions_total',
+    'Orders changed by bulk status actions, by new status', ('status',))
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"')\
+        .replace('\n', r'\n')
+
+
+def _le(labels):
+    """sort buckets by their bound"""
+    for name, value in labels:
+        if name == 'le':
+            return float(value)
+    return 0.
+
+
+def exposition():
+    """@return: str, all metrics in the Prometheus text format"""
+    samples = defaultdict(list)
+    for (sample, labels), value in store.collect().items():
+        for name in REGISTRY:
+            if sample == name or sample.startswith(name + '_'):
+                samples[name].append((sample, labels, value))
+                break
+
+    lines = []
+    for name in sorted(REGISTRY):
+        type, help = REGISTRY[name]
+        lines += ['# HELP %s %s' % (name, help), '# TYPE %s %s' % (name, type)]
+        rows = sorted(samples[name], key=lambda s: (
+            [l for l in s[1] if l[0] != 'le'], s[0], _le(s[1])))
+        for sample, labels, value in rows:
+            text = ','.join('%s="%s"' % (l, _escape(v)) for l, v in labels)
+            lines.append('%s%s %s' % (sample, '{%s}' % text if text else '',
+                                      repr(float(value))))
+    return '\n'.join(lines) + '\n'
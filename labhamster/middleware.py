@@ -0,0 +1,199 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Per-request performance instrumentation; read-your-writes routing for the
+optional replica database (ReplicaMiddleware, see routers.py).
+
+PerformanceMiddleware measures wall time, number and duration of SQL
+queries and template rendering time (of TemplateResponses, e.g. all admin
+pages) of every request. It reports them in a Server-Timing header (shown
+by the network panel of browser developer tools), logs requests slower
+than settings.PERFORMANCE_SLOW_REQUEST_MS with their slowest queries to
+the 'labhamster.performance' logger, sums them up per view in memory
+(see aggregates()) and feeds the latency histogram and SQL counters of
+metrics.py.
+
+The middleware removes itself at start-up unless
+settings.PERFORMANCE_INSTRUMENTATION is set, so it costs nothing when
+disabled.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics
+from . import routers
+
+logger = logging.getLogger('labhamster.performance')
+
+#: requests taking longer (in ms) are logged
+SLOW_REQUEST_MS = getattr(settings, 'PERFORMANCE_SLOW_REQUEST_MS', 1000)
+
+#: number of queries listed for slow requests
+SLOW_QUERIES = getattr(settings, 'PERFORMANCE_SLOW_QUERIES', 5)
+
+Measurement = namedtuple('Measurement', 'total queries render')
+
+
+class RequestTimer(object):
+    """Wall, SQL and render time of one request"""
+
+    def __init__(self):
+        self.render = 0.
+        self.offsets = {}
+        self.debug = {}
+        for c in connections.all():
+            self.debug[c.alias] = c.force_debug_cursor
+            self.offsets[c.alias] = len(c.queries_log)
+            c.force_debug_cursor = True
+        self.start = time.perf_counter()
+
+    def stop(self):
+        """@return: Measurement, with queries as [(seconds, sql)]"""
+        total = time.perf_counter() - self.start
+        queries = []
+        for c in connections.all():
+            if c.alias not in self.offsets:
+                continue
+            c.force_debug_cursor = self.debug[c.alias]
+            queries += [(float(q['time']), q['sql'])
+                        for q in list(c.queries_log)[self.offsets[c.alias]:]]
+        return Measurement(total, queries, self.render)
+
+
+_lock = threading.Lock()
+_views = {}
+
+
+def record(view, m):
+    """Add a Measurement to the aggregates of a view"""
+    db = sum(t for t, sql in m.queries)
+    with _lock:
+        a = _views.setdefault(view, [0, 0., 0., 0, 0., 0.])
+        a[0] += 1
+        a[1] += m.total
+        a[2] = max(a[2], m.total)
+        a[3] += len(m.queries)
+        a[4] += db
+        a[5] += m.render
+
+
+def aggregates():
+    """
+    @return: [dict], requests, total / max / mean seconds, queries, SQL and
+             render seconds per view since start-up, slowest in total first
+    """
+    with _lock:
+        items = [(view, list(a)) for view, a in _views.items()]
+    r = [{'view': view, 'requests': n, 'total': total, 'max': slowest,
+          'mean': total / n, 'queries': queries, 'db': db, 'render': render}
+         for view, (n, total, slowest, queries, db, render) in items]
+    return sorted(r, key=lambda a: -a['total'])
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+def server_timing(m):
+    """@return: str, value of a Server-Timing header"""
+    return 'total;dur=%.1f, db;dur=%.1f;desc="%i queries", render;dur=%.1f' \
+        % (m.total * 1000, sum(t for t, sql in m.queries) * 1000,
+           len(m.queries), m.render * 1000)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match._func_path
+
+
+class PerformanceMiddleware(MiddlewareMixin):
+    """
+    Server-Timing header, slow request log and per-view aggregates; put it
+    first in MIDDLEWARE_CLASSES so that the other middleware is included.
+    """
+
+    def __init__(self, get_response=None):
+        if not getattr(settings, 'PERFORMANCE_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        super(PerformanceMiddleware, self).__init__(get_response)
+
+    def process_request(self, request):
+        request._performance = RequestTimer()
+
+    def process_template_response(self, request, response):
+        timer = getattr(request, '_performance', None)
+        if timer is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                timer.render += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def process_response(self, request, response):
+        timer = getattr(request, '_performance', None)
+        if timer is None:
+            return response
+        del request._performance
+
+        m = timer.stop()
+        response['Server-Timing'] = server_timing(m)
+        view = view_name(request)
+        record(view, m)
+
+        metrics.REQUEST_SECONDS.observe(m.total, view=view,
+                                        method=request.method)
+        metrics.DB_QUERIES.inc(len(m.queries), view=view)
+        metrics.DB_SECONDS.inc(sum(t for t, sql in m.queries), view=view)
+
+        if m.total * 1000 >= SLOW_REQUEST_MS:
+            slowest = sorted(m.queries, key=lambda q: -q[0])[:SLOW_QUERIES]
+            logger.warning(
+                'slow request %s %s (%s): %.0f ms, %i queries in %.0f ms, '
+                'render %.0f ms%s', request.method, request.get_full_path(),
+                view, m.total * 1000, len(m.queries),
+                sum(t for t, sql in m.queries) * 1000, m.render * 1000,
+                ''.join('\n  %7.1f ms  %s' % (t * 1000, sql[:500])
+                        for t, sql in slowest))
+        return response
+
+
+class ReplicaMiddleware(MiddlewareMixin):
+    """
+    Reads of a browser go to the primary database for
+    settings.REPLICA_STICKY_SECONDS after each of its POST (PUT, DELETE)
+    requests, remembered by a cookie. Removes itself if there is no
+    replica database.
+    """
+
+    def __init__(self, get_response=None):
+        if not routers.configured():
+            raise MiddlewareNotUsed
+        super(ReplicaMiddleware, self).__init__(get_response)
+
+    def process_request(self, request):
+        routers.reset()
+        routers.pin_primary(routers.STICKY_COOKIE in request.COOKIES)
+
+    def process_response(self, request, response):
+        routers.reset()
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            response.set_cookie(
+                routers.STICKY_COOKIE, '1',
+                max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 10),
+                secure=settings.SESSION_COOKIE_SECURE, httponly=True)
+        return response
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 02:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models, transaction, OperationalError
+
+#: fields concatenated into the search documents, as of this migration
+FIELDS = {
+    'Product': ('name', 'comment', 'catalog', 'location', 'vendor__name',
+                'manufacturer__name', 'manufacturer_catalog'),
+    'Order': ('comment', 'grant__name', 'grant__grant_id', 'product__name',
+              'product__catalog', 'product__vendor__name', 'po_number'),
+}
+
+BATCH_SIZE = 500
+
+SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE labhamster_searchdocument_fts USING fts5("
+    "body, content='labhamster_searchdocument', content_rowid='id')",
+
+    "CREATE TRIGGER labhamster_searchdocument_ai "
+    "AFTER INSERT ON labhamster_searchdocument BEGIN "
+    "INSERT INTO labhamster_searchdocument_fts(rowid, body) "
+    "VALUES (new.id, new.body); END",
+
+    "CREATE TRIGGER labhamster_searchdocument_ad "
+    "AFTER DELETE ON labhamster_searchdocument BEGIN "
+    "INSERT INTO labhamster_searchdocument_fts"
+    "(labhamster_searchdocument_fts, rowid, body) "
+    "VALUES ('delete', old.id, old.body); END",
+
+    "CREATE TRIGGER labhamster_searchdocument_au "
+    "AFTER UPDATE ON labhamster_searchdocument BEGIN "
+    "INSERT INTO labhamster_searchdocument_fts"
+    "(labhamster_searchdocument_fts, rowid, body) "
+    "VALUES ('delete', old.id, old.body); "
+    "INSERT INTO labhamster_searchdocument_fts(rowid, body) "
+    "VALUES (new.id, new.body); END",
+]
+
+SQLITE_FTS_DROP = [
+    "DROP TRIGGER IF EXISTS labhamster_searchdocument_ai",
+    "DROP TRIGGER IF EXISTS labhamster_searchdocument_ad",
+    "DROP TRIGGER IF EXISTS labhamster_searchdocument_au",
+    "DROP TABLE IF EXISTS labhamster_searchdocument_fts",
+]
+
+POSTGRES_GIN = [
+    "CREATE INDEX labhamster_searchdocument_body_gin "
+    "ON labhamster_searchdocument USING gin (to_tsvector('simple', body))",
+]
+
+POSTGRES_GIN_DROP = [
+    "DROP INDEX IF EXISTS labhamster_searchdocument_body_gin",
+]
+
+
+def execute(schema_editor, statements):
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def create_index(apps, schema_editor):
+    """native full-text index; SQLite builds without FTS5 fall back to LIKE"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        execute(schema_editor, POSTGRES_GIN)
+    elif vendor == 'sqlite':
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                execute(schema_editor, SQLITE_FTS)
+        except OperationalError:
+            pass
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        execute(schema_editor, POSTGRES_GIN_DROP)
+    elif vendor == 'sqlite':
+        execute(schema_editor, SQLITE_FTS_DROP)
+
+
+def build_documents(apps, schema_editor):
+    SearchDocument = apps.get_model('labhamster', 'SearchDocument')
+    for name, fields in FIELDS.items():
+        model = apps.get_model('labhamster', name)
+        rows = model.objects.order_by('pk').values_list('pk', *fields)
+        last = 0
+        while True:
+            batch = list(rows.filter(pk__gt=last)[:BATCH_SIZE])
+            SearchDocument.objects.bulk_create(
+                [SearchDocument(kind=name.lower(), object_id=row[0],
+                                body=' '.join(str(v) for v in row[1:] if v))
+                 for row in batch])
+            if len(batch) < BATCH_SIZE:
+                break
+            last = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labhamster', '0010_grant_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('product', 'product'), ('order', 'order')], max_length=10)),
+                ('object_id', models.IntegerField()),
+                ('body', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchdocument',
+            unique_together=set([('kind', 'object_id')]),
+        ),
+        migrations.RunPython(create_index, drop_index),
+        migrations.RunPython(build_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 02:18
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+
+
+def normalize_catalog(s):
+    return re.sub(r'[\W_]+', '', s or '', flags=re.UNICODE).upper()
+
+
+def backfill(apps, schema_editor):
+    Product = apps.get_model('labhamster', 'Product')
+    rows = Product.objects.values_list('pk', 'catalog', 'manufacturer_catalog')
+    for pk, catalog, manufacturer_catalog in list(rows):
+        Product.objects.filter(pk=pk).update(
+            catalog_key=normalize_catalog(catalog),
+            manufacturer_catalog_key=normalize_catalog(manufacturer_catalog))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labhamster', '0011_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='catalog_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=30),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='manufacturer_catalog_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=30),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
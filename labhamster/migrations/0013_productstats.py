@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 02:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, When, Count, Max, Sum, F
+import django.db.models.deletion
+
+ORDERED = ('ordered', 'received')
+OPEN = ('pending', 'quote', 'ordered')
+
+
+def build_stats(apps, schema_editor):
+    Product = apps.get_model('labhamster', 'Product')
+    Order = apps.get_model('labhamster', 'Order')
+    ProductStats = apps.get_model('labhamster', 'ProductStats')
+
+    counts = {r['product']: r for r in Order.objects.order_by()
+              .values('product')
+              .annotate(times=Count(Case(When(status__in=ORDERED, then=1))),
+                        open=Count(Case(When(status__in=OPEN, then=1))),
+                        last=Max('date_ordered'))}
+
+    spend = {}
+    for r in Order.objects.filter(status__in=ORDERED, price__isnull=False)\
+            .order_by().values('product', 'price_currency')\
+            .annotate(total=Sum(F('quantity') * F('price'),
+                                output_field=models.DecimalField())):
+        # no total if paid in more than one currency
+        spend[r['product']] = (None, '') if r['product'] in spend else \
+            (r['total'], r['price_currency'])
+
+    stats = []
+    for pk in Product.objects.values_list('pk', flat=True):
+        c = counts.get(pk, {'times': 0, 'open': 0, 'last': None})
+        amount, currency = spend.get(pk, (None, ''))
+        stats.append(ProductStats(
+            product_id=pk, times_ordered=c['times'], open_orders=c['open'],
+            last_ordered=c['last'], total_spend=amount,
+            spend_currency=currency))
+    ProductStats.objects.bulk_create(stats, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labhamster', '0012_product_catalog_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='labhamster.Product')),
+                ('times_ordered', models.IntegerField(default=0, help_text='orders placed or received', verbose_name='times ordered')),
+                ('open_orders', models.IntegerField(default=0, help_text='orders pending, requested for quote or not yet received', verbose_name='open orders')),
+                ('last_ordered', models.DateField(blank=True, null=True, verbose_name='last ordered')),
+                ('total_spend', models.DecimalField(blank=True, decimal_places=2, help_text='empty if paid in several currencies', max_digits=12, null=True, verbose_name='total spend')),
+                ('spend_currency', models.CharField(blank=True, max_length=3)),
+            ],
+            options={
+                'verbose_name_plural': 'Product statistics',
+            },
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
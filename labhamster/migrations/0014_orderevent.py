@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 02:22
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+import datetime
+
+
+def seed_history(apps, schema_editor):
+    """
+    Start the status history of existing orders from their date fields
+    (request, order and delivery dates; times are unknown)
+    """
+    Order = apps.get_model('labhamster', 'Order')
+    OrderEvent = apps.get_model('labhamster', 'OrderEvent')
+
+    def stamp(d):
+        return django.utils.timezone.make_aware(
+            datetime.datetime.combine(d, datetime.time()))
+
+    events = []
+    rows = Order.objects.values_list('pk', 'date_created', 'date_ordered',
+                                     'date_received', 'ordered_by')
+    for pk, created, ordered, received, ordered_by in rows.iterator():
+        if created:
+            events.append(OrderEvent(order_id=pk, from_status='',
+                                     to_status='pending',
+                                     timestamp=stamp(created)))
+        if ordered:
+            events.append(OrderEvent(order_id=pk, from_status='pending',
+                                     to_status='ordered', user_id=ordered_by,
+                                     timestamp=stamp(ordered)))
+        if received:
+            events.append(OrderEvent(order_id=pk,
+                                     from_status='ordered' if ordered else 'pending',
+                                     to_status='received',
+                                     timestamp=stamp(received)))
+    OrderEvent.objects.bulk_create(events, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('labhamster', '0013_productstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(blank=True, choices=[('draft', 'draft'), ('pending', 'pending'), ('quote', 'quote requested'), ('ordered', 'ordered'), ('received', 'received'), ('cancelled', 'cancelled')], help_text='empty for new orders', max_length=20, verbose_name='from')),
+                ('to_status', models.CharField(choices=[('draft', 'draft'), ('pending', 'pending'), ('quote', 'quote requested'), ('ordered', 'ordered'), ('received', 'received'), ('cancelled', 'cancelled')], max_length=20, verbose_name='to')),
+                ('timestamp', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='labhamster.Order')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('timestamp', 'id'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='orderevent',
+            index=models.Index(fields=['order', 'timestamp'], name='labhamster__order_i_581aef_idx'),
+        ),
+        migrations.RunPython(seed_history, migrations.RunPython.noop),
+    ]
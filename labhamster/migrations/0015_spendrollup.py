@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 02:22
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum, F
+from django.db.models.functions import Coalesce, TruncMonth
+import django.db.models.deletion
+
+
+def build_rollups(apps, schema_editor):
+    Order = apps.get_model('labhamster', 'Order')
+    SpendRollup = apps.get_model('labhamster', 'SpendRollup')
+
+    booked = Coalesce('date_ordered', 'date_created',
+                      output_field=models.DateField())
+    rows = Order.objects.filter(status__in=('ordered', 'received'))\
+        .order_by()\
+        .annotate(month=TruncMonth(booked, output_field=models.DateField()))\
+        .values('month', 'grant', 'grant_category', 'product__vendor',
+                'product__category', 'created_by', 'price_currency')\
+        .annotate(n=Count('id'),
+                  total=Sum(F('quantity') * F('price'),
+                            output_field=models.DecimalField()))
+
+    SpendRollup.objects.bulk_create(
+        [SpendRollup(month=r['month'], grant_id=r['grant'],
+                     grant_category=r['grant_category'],
+                     vendor_id=r['product__vendor'],
+                     category_id=r['product__category'],
+                     requester_id=r['created_by'],
+                     currency=r['price_currency'] or '',
+                     orders=r['n'], total=r['total'] or 0)
+         for r in rows], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('labhamster', '0014_orderevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(db_index=True, help_text='first day of the month of ordering')),
+                ('grant_category', models.CharField(max_length=20)),
+                ('currency', models.CharField(max_length=3)),
+                ('orders', models.IntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='labhamster.Category')),
+                ('grant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='labhamster.Grant')),
+                ('requester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='labhamster.Vendor')),
+            ],
+            options={
+                'verbose_name': 'Spend report',
+                'verbose_name_plural': 'Spend report',
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 02:26
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, When, Count, Sum, F
+from django.db.models.functions import Coalesce, TruncMonth
+
+
+def convert_totals(apps, schema_editor):
+    """
+    The new exchange rate table is still empty: only amounts already in
+    the base currency can be converted, all others stay empty (NULL).
+    """
+    Order = apps.get_model('labhamster', 'Order')
+    ProductStats = apps.get_model('labhamster', 'ProductStats')
+    SpendRollup = apps.get_model('labhamster', 'SpendRollup')
+    base = getattr(settings, 'BASE_CURRENCY', 'USD')
+
+    # total_spend is only set if all orders were paid in one currency
+    ProductStats.objects.filter(spend_currency=base)\
+        .update(total_spend_base=F('total_spend'))
+
+    amount = Case(When(price_currency=base,
+                       then=F('quantity') * F('price')),
+                  output_field=models.DecimalField())
+    booked = Coalesce('date_ordered', 'date_created',
+                      output_field=models.DateField())
+    rows = Order.objects.filter(status__in=('ordered', 'received'))\
+        .order_by()\
+        .annotate(month=TruncMonth(booked, output_field=models.DateField()))\
+        .values('month', 'grant', 'grant_category', 'product__vendor',
+                'product__category', 'created_by', 'price_currency')\
+        .annotate(total=Sum(amount), priced=Count('price'),
+                  converted=Count(amount))
+
+    for r in rows:
+        SpendRollup.objects.filter(
+            month=r['month'], grant_id=r['grant'],
+            grant_category=r['grant_category'],
+            vendor_id=r['product__vendor'],
+            category_id=r['product__category'],
+            requester_id=r['created_by'],
+            currency=r['price_currency'] or '')\
+            .update(total_base=r['total'] or 0
+                    if r['priced'] == r['converted'] else None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labhamster', '0015_spendrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('date', models.DateField(help_text='first day this rate applies to')),
+                ('rate', models.DecimalField(decimal_places=8, help_text='base currency per unit of currency', max_digits=18)),
+            ],
+            options={
+                'ordering': ('currency', 'date'),
+            },
+        ),
+        migrations.AddField(
+            model_name='productstats',
+            name='total_spend_base',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='converted with exchange rates of order date', max_digits=14, null=True, verbose_name='total spend (base currency)'),
+        ),
+        migrations.AddField(
+            model_name='spendrollup',
+            name='total_base',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='total in base currency; empty if exchange rates are missing', max_digits=14, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='exchangerate',
+            unique_together=set([('currency', 'date')]),
+        ),
+        migrations.RunPython(convert_totals, migrations.RunPython.noop),
+    ]
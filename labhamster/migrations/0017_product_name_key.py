@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 02:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill(apps, schema_editor):
+    Product = apps.get_model('labhamster', 'Product')
+    for pk, name in list(Product.objects.values_list('pk', 'name')):
+        Product.objects.filter(pk=pk).update(
+            name_key=' '.join(name.lower().split()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labhamster', '0016_exchangerate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='name_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=60),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='product',
+            field=models.ForeignKey(help_text='Type a name, vendor or catalog number and select from the list of existing products.\nFor a new product, click "+" next to the field and fill out and save the Product form.', on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='labhamster.Product', verbose_name='Product'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
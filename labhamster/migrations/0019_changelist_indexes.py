@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 02:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# partial indexes (PostgreSQL only): open orders (stats.OPEN) in the order
+# of the order changelist and products to restock
+PARTIAL_INDEXES = [
+    ('labhamster_order_open_idx',
+     'labhamster_order (date_created DESC, product_id, date_ordered DESC, '
+     'id DESC)',
+     "status IN ('pending', 'quote', 'ordered')"),
+    ('labhamster_product_restock_idx',
+     'labhamster_product (status, name)',
+     "status IN ('low', 'out', 'expired')"),
+]
+
+
+def create_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, columns, condition in PARTIAL_INDEXES:
+        schema_editor.execute('CREATE INDEX %s ON %s WHERE %s' %
+                              (name, columns, condition))
+
+
+def drop_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, columns, condition in PARTIAL_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labhamster', '0018_date_modified'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-date_created', 'product', '-date_ordered', '-id'], name='labhamster__date_cr_84596f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', '-date_created', 'product', '-date_ordered', '-id'], name='labhamster__status_cd6046_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'name'], name='labhamster__status_48679e_idx'),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
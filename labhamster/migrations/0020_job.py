@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 03:14
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('labhamster', '0019_changelist_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('export', 'export'), ('transition', 'status change')], max_length=20)),
+                ('description', models.CharField(max_length=200)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='queued', max_length=20)),
+                ('model', models.CharField(help_text='app_label.model_name of queryset', max_length=100)),
+                ('query', models.BinaryField(help_text='pickled Query of the queryset')),
+                ('params', models.TextField(default='{}', help_text='JSON')),
+                ('total', models.IntegerField(default=0, help_text='rows to process')),
+                ('progress', models.IntegerField(default=0, help_text='rows processed')),
+                ('message', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created')),
+                ('date_started', models.DateTimeField(blank=True, null=True, verbose_name='started')),
+                ('date_finished', models.DateTimeField(blank=True, null=True, verbose_name='finished')),
+                ('heartbeat', models.DateTimeField(blank=True, help_text='last progress report', null=True)),
+                ('filename', models.CharField(blank=True, max_length=100)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('size', models.BigIntegerField(default=0, help_text='bytes of the exported file')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-date_created', '-id'),
+            },
+        ),
+        migrations.CreateModel(
+            name='JobChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='labhamster.Job')),
+            ],
+            options={
+                'ordering': ('job', 'number'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='jobchunk',
+            unique_together=set([('job', 'number')]),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'date_created'], name='labhamster__status_515a83_idx'),
+        ),
+    ]
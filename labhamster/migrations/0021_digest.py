@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 03:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labhamster', '0020_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Digest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('after_event', models.IntegerField(help_text='empty for the first batch', null=True, unique=True)),
+                ('last_event', models.IntegerField()),
+                ('date_sent', models.DateTimeField(default=django.utils.timezone.now, verbose_name='sent')),
+                ('messages', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('-last_event',),
+            },
+        ),
+    ]
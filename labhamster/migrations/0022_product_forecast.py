@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 03:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labhamster', '0021_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductForecast',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='forecast', serialize=False, to='labhamster.Product')),
+                ('receipts', models.IntegerField(default=0, help_text='received orders used')),
+                ('last_received', models.DateField(verbose_name='last received')),
+                ('days_per_unit', models.FloatField(blank=True, help_text='mean time until one unit is used up', null=True, verbose_name='days per unit')),
+                ('lead_time', models.FloatField(blank=True, help_text='mean days from order to receipt', null=True, verbose_name='lead time')),
+                ('date_runout', models.DateField(blank=True, null=True, verbose_name='runs out')),
+                ('date_expiry', models.DateField(blank=True, null=True, verbose_name='expires')),
+                ('date_due', models.DateField(blank=True, db_index=True, null=True, verbose_name='reorder by')),
+                ('quantity', models.IntegerField(default=1, help_text='quantity of the last order')),
+            ],
+        ),
+    ]
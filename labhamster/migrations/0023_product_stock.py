@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 03:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labhamster', '0022_product_forecast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='low_stock_threshold',
+            field=models.IntegerField(default=1, help_text='status is "running low" at or below this many units', verbose_name='low stock at'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='quantity_on_hand',
+            field=models.IntegerField(blank=True, help_text='units in stock; leave empty to set the status by hand', null=True, verbose_name='on hand'),
+        ),
+    ]
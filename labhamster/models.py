@@ -5,16 +5,78 @@
 # along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
 
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
+from django.utils import timezone
 from .customfields import DayModelField, DayConversion
 from djmoney.models.fields import MoneyField
-from datetime import date
 from . import tools as T
+from . import inventory
+from . import reports
+from . import stats
+from . import transitions
 
 APP_URL = '/labhamster'
 
 
-class Order(models.Model):
+class ModifiedQuerySet(models.QuerySet):
+    """
+    Bulk updates also set date_modified, which auto_now fields only do on
+    save(). The API derives its ETags from date_modified.
+    """
+
+    def update(self, **kwargs):
+        kwargs.setdefault('date_modified', timezone.now())
+        return super(ModifiedQuerySet, self).update(**kwargs)
+
+
+class TrackedModel(models.Model):
+    """
+    Model remembering the field values last loaded from or saved to the
+    database, so that save() and signal receivers can tell what changed.
+    """
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """remember values loaded from the database to detect changes"""
+        instance = super(TrackedModel, cls).from_db(db, field_names, values)
+        instance._loaded = dict(zip(field_names, values))
+        return instance
+
+    def loaded(self, attname):
+        """
+        @return: value of a field as last loaded from / saved to the
+                 database (None for new objects or deferred fields)
+        """
+        value = getattr(self, '_loaded', {}).get(attname)
+        return None if value is models.DEFERRED else value
+
+    def changed(self, *attnames):
+        """
+        @return: bool, True if any of the given fields differs from its
+                 value last loaded from / saved to the database or wasn't
+                 loaded (new objects, deferred fields)
+        """
+        loaded = getattr(self, '_loaded', {})
+        for attname in attnames:
+            value = loaded.get(attname, models.DEFERRED)
+            if value is models.DEFERRED or value != getattr(self, attname):
+                return True
+        return False
+
+    def remember(self):
+        """take the current field values as the saved state"""
+        self._loaded = {f.attname: getattr(self, f.attname)
+                        for f in self._meta.concrete_fields}
+
+
+class Order(TrackedModel):
+
+    objects = ModifiedQuerySet.as_manager()
+
     STATUS_TYPES = (('draft', 'draft'),
                     ('pending', 'pending'),
                     ('quote', 'quote requested'),
@@ -37,6 +99,9 @@ class Order(models.Model):
     date_received = models.DateField('received', blank=True, null=True,
                                      help_text='Date when product was received')
 
+    date_modified = models.DateTimeField('modified', auto_now=True,
+                                         db_index=True, editable=False)
+
     # recent Django Admin version do not sort users any longer
     # workaround with custom form:
     # https://code.djangoproject.com/ticket/8220
@@ -56,8 +121,8 @@ class Order(models.Model):
 
     product = models.ForeignKey('Product', verbose_name='Product', related_name='orders',
                                 blank=False, null=False,
-                                help_text='Click the magnifying lens to select from the list of existing products.\n' +
-                                'For a new product, first click the lens, then click "Add Product" and fill out and save the Product form.')
+                                help_text='Type a name, vendor or catalog number and select from the list of existing products.\n' +
+                                'For a new product, click "+" next to the field and fill out and save the Product form.')
 
     unit_size = models.CharField(max_length=20, blank=True, null=True,
                                  help_text='e.g. "10 l", "1 kg", "500 tips"')
@@ -97,13 +162,29 @@ class Order(models.Model):
         """
         return 'order/%i/' % self.id
 
+    def history(self):
+        """
+        @return: QuerySet of status changes (OrderEvent) of this order
+        """
+        return self.events.select_related('user')
+
     def save(self, *args, **kwargs):
-        if self.status == "ordered" and self.date_ordered is None:
-            self.date_ordered = date.today()
-        elif self.status == "received" and self.date_received is None:
-            self.date_received = date.today()
+        """
+        user - User, who is saving the order (recorded in status history)
+        """
+        user = kwargs.pop('user', None)
+        changed = transitions.before_save(self)
+        products = {self.product_id, self.loaded('product_id')}
+        months = {reports.order_month(self.loaded('date_ordered'),
+                                      self.loaded('date_created'))}
+
         super(Order, self).save(*args, **kwargs)
 
+        transitions.after_save(self, changed, user=user)
+        stats.refresh(products - {None})
+        months.add(reports.order_month(self.date_ordered, self.date_created))
+        reports.refresh_spend(months)
+
     def Status(self):
         """color status display"""
         color = {'ordered': '088A08',
@@ -153,13 +234,90 @@ class Order(models.Model):
 
     class Meta:
         ordering = ('date_created', 'id')
+        # changelist: default ordering (by product_id and -id, the way
+        # OrderAdmin sorts) and date drill-down, status filter
+        # (partial index of open orders on PostgreSQL: migration 0019)
+        indexes = [models.Index(fields=['-date_created', 'product',
+                                        '-date_ordered', '-id']),
+                   models.Index(fields=['status', '-date_created', 'product',
+                                        '-date_ordered', '-id'])]
+
+
+class OrderEvent(models.Model):
+    """
+    Append-only record of one order status change, written by
+    labhamster.transitions
+    """
+    order = models.ForeignKey(Order, related_name='events',
+                              on_delete=models.CASCADE)
+
+    from_status = models.CharField('from', max_length=20, blank=True,
+                                   choices=Order.STATUS_TYPES,
+                                   help_text='empty for new orders')
+
+    to_status = models.CharField('to', max_length=20,
+                                 choices=Order.STATUS_TYPES)
+
+    user = models.ForeignKey(User, null=True, blank=True,
+                             related_name='order_events',
+                             on_delete=models.SET_NULL)
+
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return '%s: %s -> %s' % (self.order_id, self.from_status,
+                                 self.to_status)
+
+    class Meta:
+        ordering = ('timestamp', 'id')
+        indexes = [models.Index(fields=['order', 'timestamp'])]
+
+
+class ProductQuerySet(ModifiedQuerySet):
+
+    def catalog_lookup(self, term, prefix=True):
+        """
+        Products with a vendor or manufacturer catalog number matching term,
+        ignoring case, spaces and punctuation. Answered from the indexed
+        normalized catalog keys.
+        prefix - bool, match catalog numbers starting with term [True]
+        """
+        key = T.normalize_catalog(term)
+        if not key:
+            return self.none()
+        if not prefix:
+            return self.filter(Q(catalog_key=key) |
+                               Q(manufacturer_catalog_key=key))
+
+        # range instead of LIKE so that plain b-tree indices can be used
+        upper = key[:-1] + chr(ord(key[-1]) + 1)
+        return self.filter(Q(catalog_key__gte=key, catalog_key__lt=upper) |
+                           Q(manufacturer_catalog_key__gte=key,
+                             manufacturer_catalog_key__lt=upper))
+
+    def name_prefix(self, term):
+        """
+        Products with a name starting with term, ignoring case and repeated
+        spaces. Answered from the indexed normalized name keys.
+        """
+        key = T.normalize_name(term)
+        if not key:
+            return self.none()
+        upper = key[:-1] + chr(ord(key[-1]) + 1)
+        return self.filter(name_key__gte=key, name_key__lt=upper)
+
 
+class Product(TrackedModel):
 
-class Product(models.Model):
+    objects = ProductQuerySet.as_manager()
 
     name = models.CharField(max_length=60, unique=True,
                             help_text='short descriptive name of this product')
 
+    # normalized name for indexed prefix lookup, see name_prefix()
+    name_key = models.CharField(max_length=60, blank=True, editable=False,
+                                db_index=True)
+
     vendor = models.ForeignKey('Vendor', verbose_name='Vendor',
                                blank=False,
                                help_text='select normal supplier of this product')
@@ -176,6 +334,13 @@ class Product(models.Model):
                                             blank=True,
                                             help_text='manufacturer catalogue number')
 
+    # normalized catalog numbers for indexed lookup, see catalog_lookup()
+    catalog_key = models.CharField(max_length=30, blank=True, editable=False,
+                                   db_index=True)
+
+    manufacturer_catalog_key = models.CharField(max_length=30, blank=True,
+                                                editable=False, db_index=True)
+
     category = models.ForeignKey('Category', verbose_name='Product Category',
                                  blank=False)
 
@@ -191,6 +356,15 @@ class Product(models.Model):
     status = models.CharField('Status', max_length=20, choices=STATUS_TYPES,
                               default='out')
 
+    # changed with F() expressions only, see inventory.py
+    quantity_on_hand = models.IntegerField(
+        'on hand', blank=True, null=True,
+        help_text='units in stock; leave empty to set the status by hand')
+
+    low_stock_threshold = models.IntegerField(
+        'low stock at', default=1,
+        help_text='status is "running low" at or below this many units')
+
     link = models.URLField('Product Link', blank=True,
                            help_text='Product web site')
 
@@ -200,6 +374,9 @@ class Product(models.Model):
     location = models.CharField(max_length=60, blank=True,
                                 help_text='location in the lab')
 
+    date_modified = models.DateTimeField('modified', auto_now=True,
+                                         db_index=True, editable=False)
+
     def __str__(self):
         return '%s [%s]' % (self.name, self.vendor)
 
@@ -215,14 +392,43 @@ class Product(models.Model):
         """
         return 'product/%i/' % self.id
 
+    def moved(self):
+        """
+        @return: bool, True if vendor or category differ from the values
+                 last loaded from the database
+        """
+        loaded = getattr(self, '_loaded', {})
+        return loaded.get('vendor_id') != self.vendor_id or \
+            loaded.get('category_id') != self.category_id
+
+    def save(self, *args, **kwargs):
+        self.name_key = T.normalize_name(self.name)
+        self.catalog_key = T.normalize_catalog(self.catalog)
+        self.manufacturer_catalog_key = T.normalize_catalog(
+            self.manufacturer_catalog)
+
+        # don't write back a stale count over concurrent stock changes
+        loaded = getattr(self, '_loaded', {})
+        if self.pk is not None and 'quantity_on_hand' in loaded and \
+                loaded['quantity_on_hand'] == self.quantity_on_hand and \
+                not kwargs.get('update_fields') and \
+                not kwargs.get('force_insert') and \
+                not (args and args[0]):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != 'quantity_on_hand']
+
+        super(Product, self).save(*args, **kwargs)
+        self.remember()
+
+        if self.quantity_on_hand is not None:
+            inventory.refresh_status(Product.objects.filter(pk=self.pk))
+
     def related_orders(self):
         """
         @return: QuerySet of orders for this product
         """
-        if self.orders:
-            r = Order.objects.filter(product=self)
-            return r
-        return []
+        return self.orders.select_related('created_by')
 
     def received(self):
         """filter '(None)' display in admin table"""
@@ -241,9 +447,145 @@ class Product(models.Model):
 
     class Meta:
         ordering = ('name', 'vendor')
+        # changelist status filter
+        indexes = [models.Index(fields=['status', 'name'])]
+
+
+class ProductStats(models.Model):
+    """
+    Denormalized order statistics of one product, maintained by
+    labhamster.stats
+    """
+    product = models.OneToOneField(Product, primary_key=True,
+                                   related_name='stats',
+                                   on_delete=models.CASCADE)
+
+    times_ordered = models.IntegerField('times ordered', default=0,
+                                        help_text='orders placed or received')
+
+    open_orders = models.IntegerField('open orders', default=0,
+                                      help_text='orders pending, requested '
+                                      'for quote or not yet received')
+
+    last_ordered = models.DateField('last ordered', blank=True, null=True)
+
+    total_spend = models.DecimalField('total spend', max_digits=12,
+                                      decimal_places=2, blank=True, null=True,
+                                      help_text='empty if paid in several '
+                                      'currencies')
+
+    spend_currency = models.CharField(max_length=3, blank=True)
+
+    total_spend_base = models.DecimalField('total spend (base currency)',
+                                           max_digits=14, decimal_places=2,
+                                           blank=True, null=True,
+                                           help_text='converted with '
+                                           'exchange rates of order date')
+
+    def __str__(self):
+        return 'statistics of %s' % self.product_id
+
+    class Meta:
+        verbose_name_plural = 'Product statistics'
+
+
+class ProductForecast(models.Model):
+    """
+    When a product will have to be reordered, predicted from the intervals
+    between its past deliveries and its shelf life by labhamster.forecast
+    """
+    product = models.OneToOneField(Product, primary_key=True,
+                                   related_name='forecast',
+                                   on_delete=models.CASCADE)
+
+    receipts = models.IntegerField(default=0,
+                                   help_text='received orders used')
+
+    last_received = models.DateField('last received')
+
+    days_per_unit = models.FloatField('days per unit', null=True, blank=True,
+                                      help_text='mean time until one unit '
+                                      'is used up')
+
+    lead_time = models.FloatField('lead time', null=True, blank=True,
+                                  help_text='mean days from order to receipt')
+
+    date_runout = models.DateField('runs out', null=True, blank=True)
+
+    date_expiry = models.DateField('expires', null=True, blank=True)
+
+    date_due = models.DateField('reorder by', null=True, blank=True,
+                                db_index=True)
+
+    quantity = models.IntegerField(default=1,
+                                   help_text='quantity of the last order')
+
+    def __str__(self):
+        return 'forecast of %s' % self.product_id
+
 
+class SpendRollup(models.Model):
+    """
+    Monthly spend (quantity x unit price of placed orders) per grant, grant
+    category, vendor, product category, requester and currency. Maintained
+    incrementally by labhamster.reports.
+    """
+    month = models.DateField(db_index=True,
+                             help_text='first day of the month of ordering')
 
-class Vendor(models.Model):
+    grant = models.ForeignKey('Grant', null=True, blank=True,
+                              on_delete=models.CASCADE)
+
+    grant_category = models.CharField(max_length=20)
+
+    vendor = models.ForeignKey('Vendor', on_delete=models.CASCADE)
+
+    category = models.ForeignKey('Category', on_delete=models.CASCADE)
+
+    requester = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    currency = models.CharField(max_length=3)
+
+    orders = models.IntegerField(default=0)
+
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    total_base = models.DecimalField(max_digits=14, decimal_places=2,
+                                     blank=True, null=True,
+                                     help_text='total in base currency; '
+                                     'empty if exchange rates are missing')
+
+    def __str__(self):
+        return '%s %s %s' % (self.month, self.total, self.currency)
+
+    class Meta:
+        verbose_name = 'Spend report'
+        verbose_name_plural = 'Spend report'
+
+
+class ExchangeRate(models.Model):
+    """
+    Value of one unit of a currency in the base currency
+    (settings.BASE_CURRENCY), valid from the given date on.
+    """
+    currency = models.CharField(max_length=3)
+
+    date = models.DateField(help_text='first day this rate applies to')
+
+    rate = models.DecimalField(max_digits=18, decimal_places=8,
+                               help_text='base currency per unit of currency')
+
+    def __str__(self):
+        return '%s %s: %s' % (self.date, self.currency, self.rate)
+
+    class Meta:
+        ordering = ('currency', 'date')
+        unique_together = (('currency', 'date'),)
+
+
+class Vendor(TrackedModel):
+
+    objects = ModifiedQuerySet.as_manager()
 
     name = models.CharField(max_length=30, unique=True,
                             verbose_name='Vendor name',
@@ -267,12 +609,19 @@ class Vendor(models.Model):
     password = models.CharField(max_length=30, blank=True,
                                 verbose_name='Password')
 
+    date_modified = models.DateTimeField('modified', auto_now=True,
+                                         db_index=True, editable=False)
+
     class Meta:
         ordering = ('name',)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super(Vendor, self).save(*args, **kwargs)
+        self.remember()
+
     def get_absolute_url(self):
         """
         Define standard URL for object.get_absolute_url access in templates
@@ -300,7 +649,9 @@ class Category(models.Model):
         ordering = ('name',)
 
 
-class Grant(models.Model):
+class Grant(TrackedModel):
+
+    objects = ModifiedQuerySet.as_manager()
 
     name = models.CharField(max_length=40, unique=True,
                             help_text='descriptive name of grant')
@@ -311,9 +662,142 @@ class Grant(models.Model):
 
     comment = models.TextField(blank=True)
 
+    date_modified = models.DateTimeField('modified', auto_now=True,
+                                         db_index=True, editable=False)
+
     def __str__(self):
         return self.name + ' ' + self.grant_id
 
+    def save(self, *args, **kwargs):
+        super(Grant, self).save(*args, **kwargs)
+        self.remember()
+
     class Meta:
         ordering = ('name', 'grant_id')
         verbose_name = 'Grant'
+
+
+class SearchDocument(models.Model):
+    """
+    Denormalized full-text search document for one Product or Order.
+    Maintained by labhamster.search and indexed natively by the database
+    (tsvector GIN index on Postgres, FTS5 table on SQLite).
+    """
+    KINDS = (('product', 'product'),
+             ('order', 'order'))
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+
+    object_id = models.IntegerField()
+
+    body = models.TextField(blank=True)
+
+    def __str__(self):
+        return '%s %i' % (self.kind, self.object_id)
+
+    class Meta:
+        unique_together = (('kind', 'object_id'),)
+
+
+class Job(models.Model):
+    """
+    Admin action running in the background (see labhamster.jobs and
+    ./manage.py run_jobs), e.g. a large export whose file is kept here for
+    download.
+    """
+    STATUS_TYPES = (('queued', 'queued'),
+                    ('running', 'running'),
+                    ('done', 'done'),
+                    ('failed', 'failed'))
+
+    KINDS = (('export', 'export'),
+             ('transition', 'status change'))
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+
+    description = models.CharField(max_length=200)
+
+    status = models.CharField(max_length=20, choices=STATUS_TYPES,
+                              default='queued')
+
+    user = models.ForeignKey(User, null=True, blank=True,
+                             related_name='jobs', on_delete=models.SET_NULL)
+
+    model = models.CharField(max_length=100,
+                             help_text='app_label.model_name of queryset')
+
+    query = models.BinaryField(help_text='pickled Query of the queryset')
+
+    params = models.TextField(default='{}', help_text='JSON')
+
+    total = models.IntegerField(default=0, help_text='rows to process')
+
+    progress = models.IntegerField(default=0, help_text='rows processed')
+
+    message = models.TextField(blank=True)
+
+    worker = models.CharField(max_length=100, blank=True)
+
+    date_created = models.DateTimeField('created', default=timezone.now)
+
+    date_started = models.DateTimeField('started', null=True, blank=True)
+
+    date_finished = models.DateTimeField('finished', null=True, blank=True)
+
+    heartbeat = models.DateTimeField(null=True, blank=True,
+                                     help_text='last progress report')
+
+    filename = models.CharField(max_length=100, blank=True)
+
+    content_type = models.CharField(max_length=100, blank=True)
+
+    size = models.BigIntegerField(default=0,
+                                  help_text='bytes of the exported file')
+
+    def __str__(self):
+        return 'job %i: %s' % (self.pk, self.description)
+
+    class Meta:
+        ordering = ('-date_created', '-id')
+        indexes = [models.Index(fields=['status', 'date_created'])]
+
+
+class JobChunk(models.Model):
+    """
+    Part of the exported file of a Job; files are stored and served a chunk
+    at a time (see labhamster.jobs) instead of as one value in memory.
+    """
+    job = models.ForeignKey(Job, related_name='chunks',
+                            on_delete=models.CASCADE)
+
+    number = models.IntegerField()
+
+    data = models.BinaryField()
+
+    class Meta:
+        ordering = ('job', 'number')
+        unique_together = (('job', 'number'),)
+
+
+class Digest(models.Model):
+    """
+    One batch of notification e-mails about order status changes (see
+    labhamster.notifications), covering the OrderEvents with after_event <
+    id <= last_event. A unique after_event lets only one worker send each
+    batch.
+    """
+    after_event = models.IntegerField(unique=True, null=True,
+                                      help_text='empty for the first batch')
+
+    last_event = models.IntegerField()
+
+    date_sent = models.DateTimeField('sent', default=timezone.now)
+
+    messages = models.IntegerField(default=0)
+
+    def __str__(self):
+        return 'digest of events %s to %i' % (self.after_event,
+                                               self.last_event)
+
+    class Meta:
+        ordering = ('-last_event',)
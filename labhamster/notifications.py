@@ -0,0 +1,150 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+E-mail digests telling requesters (Order.created_by) that their orders
+were ordered, received or cancelled.
+
+Status changes are read from the OrderEvent history after the last event
+of the previous Digest, collected into one message per requester (with
+the latest status of each order) and sent in one batch over a single
+connection of settings.EMAIL_BACKEND. The job worker (./manage.py
+run_jobs) sends a batch every settings.DIGEST_INTERVAL_MINUTES, or run
+./manage.py send_digests from a scheduler.
+
+A batch only covers events older than settings.DIGEST_SETTLE_SECONDS.
+Ids are taken when a row is inserted, not when its transaction commits,
+so an event of a long transaction (e.g. a run_transition job) can show
+up after events with higher ids; the margin leaves transactions that
+long to commit before the id watermark moves past their events. Events
+stamped before the previous batch (the history seeded for imported
+orders) are no news and skipped.
+"""
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+logger = logging.getLogger('labhamster.notifications')
+
+#: new order status requesters are told about
+STATUSES = ('ordered', 'received', 'cancelled')
+
+
+def changes(after, last, since=None):
+    """
+    Status changes of OrderEvents after < id <= last that requesters did
+    not make themselves.
+    since - datetime, skip events stamped earlier (e.g. imported history)
+    @return: OrderedDict, {User: [OrderEvent]}, latest event per order
+    """
+    OrderEvent = django_apps.get_model('labhamster', 'OrderEvent')
+    events = OrderEvent.objects.filter(
+        id__gt=after, id__lte=last, to_status__in=STATUSES)\
+        .exclude(order__created_by__email='')\
+        .exclude(user=F('order__created_by'))\
+        .select_related('order__product', 'order__created_by')\
+        .order_by('id')
+    if since is not None:
+        events = events.filter(timestamp__gte=since)
+
+    latest = OrderedDict()
+    for e in events:
+        latest[e.order_id] = e  # later events replace earlier ones
+
+    r = OrderedDict()
+    for e in sorted(latest.values(), key=lambda e: e.id):
+        r.setdefault(e.order.created_by, []).append(e)
+    return r
+
+
+def message(user, events):
+    """@return: EmailMessage, digest for one requester"""
+    subject = 'LabHamster: %i of your orders changed' % len(events) \
+        if len(events) > 1 else \
+        'LabHamster: %s %s' % (events[0].order.product.name,
+                               events[0].get_to_status_display())
+    body = render_to_string('labhamster/digest.txt', {
+        'user': user, 'events': events,
+        'site_url': getattr(settings, 'SITE_URL', '').rstrip('/')})
+    return EmailMessage(subject, body, to=[user.email])
+
+
+def send(connection=None, settle=None):
+    """
+    Send the digests of all status changes since the last batch. The very
+    first call only records where to start.
+    connection - e-mail backend instance [settings.EMAIL_BACKEND]
+    settle - int, seconds, leave newer events to the next batch
+             [settings.DIGEST_SETTLE_SECONDS]
+    @return: Digest or None if there was nothing to do
+    """
+    Digest = django_apps.get_model('labhamster', 'Digest')
+    OrderEvent = django_apps.get_model('labhamster', 'OrderEvent')
+
+    previous = Digest.objects.first()
+    after = previous.last_event if previous else None
+    if settle is None:
+        settle = getattr(settings, 'DIGEST_SETTLE_SECONDS', 60)
+
+    now = timezone.now()
+    margin = timedelta(seconds=settle)
+    settled = OrderEvent.objects.filter(timestamp__lt=now - margin)
+    if after is not None:
+        settled = settled.filter(id__gt=after)
+    last = settled.aggregate(Max('id'))['id__max']
+    if after is not None and last is None:
+        return None
+    last = last or 0
+
+    try:
+        with transaction.atomic():
+            digest = Digest.objects.create(after_event=after, last_event=last,
+                                           date_sent=now)
+    except IntegrityError:
+        return None  # another worker is sending this batch
+    if after is None:
+        return digest
+
+    # events left out of the previous batch are stamped after its cutoff
+    since = previous.date_sent - margin
+    messages = [message(user, events)
+                for user, events in changes(after, last, since).items()]
+    try:
+        connection = connection or get_connection()
+        connection.send_messages(messages)
+    except Exception:
+        digest.delete()  # try again with the next batch
+        raise
+
+    digest.messages = len(messages)
+    digest.save()
+    return digest
+
+
+def send_due(minutes=None):
+    """
+    Send digests if the last batch is older than minutes
+    (settings.DIGEST_INTERVAL_MINUTES); errors are logged, not raised.
+    @return: Digest or None
+    """
+    Digest = django_apps.get_model('labhamster', 'Digest')
+    minutes = minutes or getattr(settings, 'DIGEST_INTERVAL_MINUTES', 60)
+    if Digest.objects.filter(
+            date_sent__gt=timezone.now() - timedelta(minutes=minutes))\
+            .exists():
+        return None
+    try:
+        return send()
+    except Exception:
+        logger.exception('sending notification digests failed')
+        return None
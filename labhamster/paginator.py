@@ -0,0 +1,259 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Paginator for changelists of large tables (see admin.LargeTableAdmin).
+
+Pages are read by their position in the ordering of the changelist rather
+than by OFFSET: the sort key of the last row of each page is remembered
+in the cache as the anchor of the following page, which then starts with
+a range condition on the (indexed) ordering columns. Pages without an
+anchor are read with an offset from the closest anchor before them.
+Anchors are cached under the versions of the sorted models (see
+caching.py), so saving or deleting rows discards them.
+
+Counts are estimated: on PostgreSQL from the row estimate of the query
+planner, otherwise by caching exact counts of large results (see
+caching.py). Results with an estimate below COUNT_THRESHOLD are counted
+exactly.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from . import caching
+
+#: results with fewer (estimated) rows are counted exactly
+COUNT_THRESHOLD = getattr(settings, 'ADMIN_COUNT_ESTIMATE_THRESHOLD', 10000)
+
+
+def _expand(model, name, descending, nullable=False, depth=0):
+    """
+    @return: [(str, bool, bool)], lookup path, descending and nullable for
+             each column that ordering by name sorts on (relations are
+             sorted by the ordering of the related model, foreign key
+             columns like product_id by value); None if name is not a
+             field path (e.g. an annotation)
+    """
+    opts = model._meta
+    parts = name.split('__')
+    for i, part in enumerate(parts):
+        try:
+            field = opts.get_field(opts.pk.name if part == 'pk' else part)
+        except FieldDoesNotExist:
+            return None
+        nullable = nullable or field.null
+        if field.is_relation and part != field.attname:
+            if not field.many_to_one and not field.one_to_one:
+                return None
+            if i == len(parts) - 1:
+                ordering = field.related_model._meta.ordering
+                if not ordering or depth > 5:
+                    return [(name, descending, nullable)]
+                r = []
+                for o in ordering:
+                    sub = _expand(field.related_model, o.lstrip('-'),
+                                  descending != o.startswith('-'),
+                                  nullable, depth + 1)
+                    if sub is None:
+                        return None
+                    r += [(name + '__' + p, d, n) for p, d, n in sub]
+                return r
+            opts = field.related_model._meta
+        elif i < len(parts) - 1:
+            return None
+    return [(name, descending, nullable)]
+
+
+def ordering_keys(queryset):
+    """
+    @return: [(str, bool, bool)], columns (lookup path, descending,
+             nullable) of the ordering of queryset, ending with the primary
+             key; None if the ordering can't be used as keyset
+    """
+    model = queryset.model
+    ordering = list(queryset.query.order_by or
+                    (queryset.query.default_ordering and
+                     model._meta.ordering or []))
+    r = []
+    for name in ordering:
+        if not isinstance(name, str) or name == '?':
+            return None
+        keys = _expand(model, name.lstrip('-'), name.startswith('-'))
+        if keys is None:
+            return None
+        r += keys
+    if not any(p in ('pk', model._meta.pk.name) for p, d, n in r):
+        r.append(('pk', False, False))
+    return r
+
+
+def key_of(obj, keys):
+    """@return: tuple, sort key of a model instance"""
+    r = []
+    for path, descending, nullable in keys:
+        value = obj
+        parts = path.split('__')
+        for i, part in enumerate(parts):
+            if value is None:
+                break
+            if part == 'pk':
+                value = value.pk
+                continue
+            field = value._meta.get_field(part)
+            last = i == len(parts) - 1
+            value = getattr(value, field.attname if last else field.name)
+        r.append(value)
+    return tuple(r)
+
+
+def after(keys, key, using='default'):
+    """
+    @return: Q, rows following the given sort key in the ordering by keys
+    """
+    nulls_largest = connections[using].features.nulls_order_largest
+    q = None
+    equal = Q()
+    for (path, descending, nullable), value in zip(keys, key):
+        nulls_last = nulls_largest != descending
+        if value is None:
+            later = None if nulls_last else Q(**{path + '__isnull': False})
+        else:
+            later = Q(**{path + ('__lt' if descending else '__gt'): value})
+            if nullable and nulls_last:
+                later |= Q(**{path + '__isnull': True})
+        if later is not None:
+            q = equal & later if q is None else q | (equal & later)
+        equal &= Q(**{path + '__isnull': True}) if value is None \
+            else Q(**{path: value})
+
+    if q is None:
+        return Q(pk__in=[])
+
+    # redundant range on the first column for an index range scan
+    path, descending, nullable = keys[0]
+    if key[0] is not None and not nullable:
+        q &= Q(**{path + ('__lte' if descending else '__gte'): key[0]})
+    return q
+
+
+def _fingerprint(queryset, *extra):
+    sql, params = queryset.query.sql_with_params()
+    data = repr((sql, [str(p) for p in params]) + extra).encode('utf-8')
+    return hashlib.md5(data).hexdigest()
+
+
+def estimated_count(queryset):
+    """
+    @return: (int, bool), number of rows of queryset and whether it is
+             exact; large results are estimated or counted from the cache
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate >= COUNT_THRESHOLD:
+            return estimate, False
+        return queryset.count(), True
+
+    k = caching.key((queryset.model._meta.model_name,),
+                    'count:' + _fingerprint(queryset))
+    n = cache.get(k)
+    if n is not None:
+        return n, False
+    n = queryset.count()
+    if n >= COUNT_THRESHOLD:
+        cache.set(k, n, caching.TIMEOUT)
+    return n, True
+
+
+class KeysetPaginator(Paginator):
+    """
+    Paginator reading pages by sort key (see module documentation) and
+    with estimated counts. Falls back to OFFSET paging for orderings by
+    anything but model fields.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0,
+                 allow_empty_first_page=True):
+        super(KeysetPaginator, self).__init__(
+            object_list, per_page, 0, allow_empty_first_page)
+        self.keys = ordering_keys(object_list)
+        if self.keys is not None:
+            self.object_list = object_list.order_by(
+                *[('-' if d else '') + p for p, d, n in self.keys])
+
+    @cached_property
+    def _count(self):
+        return estimated_count(self.object_list)
+
+    @property
+    def count(self):
+        return self._count[0]
+
+    @property
+    def exact(self):
+        """True if count is exact, not estimated"""
+        return self._count[1]
+
+    def validate_number(self, number):
+        """estimated counts may be too low, so allow pages beyond them"""
+        if self.exact:
+            return super(KeysetPaginator, self).validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    @cached_property
+    def _anchor_key(self):
+        # saved or deleted rows (of the model or of models it is sorted by)
+        # shift the pages, so changes retire the anchors with the counts
+        model = self.object_list.model
+        groups = {model._meta.model_name}
+        for path, descending, nullable in self.keys:
+            opts = model._meta
+            for part in path.split('__')[:-1]:
+                opts = opts.get_field(part).related_model._meta
+                groups.add(opts.model_name)
+        return caching.key(sorted(groups), 'anchors:' + _fingerprint(
+            self.object_list, self.per_page))
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.keys is None:
+            return super(KeysetPaginator, self).page(number)
+
+        anchors = cache.get(self._anchor_key) or {}
+        start = max([p for p in anchors if p <= number] or [1])
+        qs = self.object_list
+        if start > 1:
+            qs = qs.filter(after(self.keys, anchors[start], qs.db))
+        offset = (number - start) * self.per_page
+        objects = list(qs[offset:offset + self.per_page])
+
+        if not objects:
+            if number > 1 or not self.allow_empty_first_page:
+                raise EmptyPage('That page contains no results')
+        elif number + 1 not in anchors:
+            anchors[number + 1] = key_of(objects[-1], self.keys)
+            cache.set(self._anchor_key, anchors, caching.TIMEOUT)
+
+        return self._get_page(objects, number, self)
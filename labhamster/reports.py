@@ -0,0 +1,189 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Aggregate reports over orders.
+
+Spend is reported from SpendRollup, a table of monthly totals per grant,
+grant category, vendor, product category, requester and currency. Whenever
+orders change, only the rollup rows of the affected months are recomputed,
+so reports never have to re-aggregate the whole Order table.
+"""
+from collections import OrderedDict
+from datetime import date
+
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.db.models import Case, When, Max, Min, Count, Sum, F, Q, Value
+from django.db.models import DecimalField, DateField, IntegerField
+from django.db.models.functions import Coalesce, TruncMonth
+
+from . import currency
+
+#: orders counted as spend
+ORDERED = ('ordered', 'received')
+
+#: report dimensions: name -> (title, SpendRollup lookup of the row label)
+DIMENSIONS = OrderedDict([
+    ('grant', ('Grant', 'grant__name')),
+    ('grant_category', ('Grant category', 'grant_category')),
+    ('vendor', ('Vendor', 'vendor__name')),
+    ('category', ('Product category', 'category__name')),
+    ('requester', ('Requested by', 'requester__username')),
+])
+
+
+def month_of(d):
+    """@return: date, first day of the month of d (or None)"""
+    return d.replace(day=1) if d else None
+
+
+def order_month(date_ordered, date_created):
+    """@return: date, month under which an order's spend is booked"""
+    return month_of(date_ordered or date_created)
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def refresh_spend(months=None, apps=django_apps):
+    """
+    Recompute SpendRollup rows of given months (default: all months).
+    months - [date], any day within the month is fine; None is ignored
+    apps   - app registry to take models from (for use in migrations)
+    """
+    Order = apps.get_model('labhamster', 'Order')
+    SpendRollup = apps.get_model('labhamster', 'SpendRollup')
+
+    booked = Coalesce('date_ordered', 'date_created', output_field=DateField())
+    orders = Order.objects.filter(status__in=ORDERED).order_by()\
+        .annotate(month=TruncMonth(booked, output_field=DateField()))
+
+    if months is None:
+        rollups = SpendRollup.objects.all()
+    else:
+        months = sorted({month_of(m) for m in months if m})
+        if not months:
+            return
+        rollups = SpendRollup.objects.filter(month__in=months)
+        period = Q()
+        for m in months:
+            period |= Q(date_ordered__gte=m, date_ordered__lt=_next_month(m))
+            period |= Q(date_ordered__isnull=True, date_created__gte=m,
+                        date_created__lt=_next_month(m))
+        orders = orders.filter(period)
+
+    amount = currency.base_amount(apps=apps)
+    rows = orders.values('month', 'grant', 'grant_category',
+                         'product__vendor', 'product__category',
+                         'created_by', 'price_currency')\
+        .annotate(n=Count('id'),
+                  total=Sum(F('quantity') * F('price'),
+                            output_field=DecimalField()),
+                  total_base=Sum(amount),
+                  priced=Count('price'), converted=Count(amount))
+
+    with transaction.atomic():
+        rollups.delete()
+        SpendRollup.objects.bulk_create(
+            [SpendRollup(month=r['month'], grant_id=r['grant'],
+                         grant_category=r['grant_category'],
+                         vendor_id=r['product__vendor'],
+                         category_id=r['product__category'],
+                         requester_id=r['created_by'],
+                         currency=r['price_currency'] or '',
+                         orders=r['n'], total=r['total'] or 0,
+                         total_base=r['total_base'] or 0
+                         if r['priced'] == r['converted'] else None)
+             for r in rows], batch_size=500)
+
+
+def spend_report(by='vendor', year=None, base=False):
+    """
+    Monthly spend of one year, pivoted by one dimension.
+    by   - str, key of DIMENSIONS
+    year - int, calendar year (default: current year)
+    base - bool, convert all totals into the base currency [False]
+    @return: [dict], one dict per (dimension value, currency) with keys
+             'label', 'currency', 'months' (12 totals) and 'total'; in
+             base currency, totals are None where exchange rates are missing
+    """
+    SpendRollup = django_apps.get_model('labhamster', 'SpendRollup')
+    label = DIMENSIONS[by][1]
+    year = year or date.today().year
+
+    rows = SpendRollup.objects.filter(month__year=year).order_by()
+    if base:
+        rows = rows.values(label, 'month').annotate(
+            total=Sum('total_base'),
+            missing=Count(Case(When(total_base__isnull=True, then=1))))
+    else:
+        rows = rows.values(label, 'currency', 'month')\
+            .annotate(total=Sum('total'), missing=Value(0, IntegerField()))
+
+    def add(a, b):
+        return None if a is None or b is None else a + b
+
+    table = {}
+    for r in rows:
+        key = (r[label] or '', currency.base_currency() if base
+               else r['currency'])
+        entry = table.setdefault(key, {'label': key[0], 'currency': key[1],
+                                       'months': [0] * 12, 'total': 0})
+        total = None if r['missing'] else r['total']
+        i = r['month'].month - 1
+        entry['months'][i] = add(entry['months'][i], total)
+        entry['total'] = add(entry['total'], total)
+
+    return [table[k] for k in sorted(table)]
+
+
+def days(delta):
+    """@return: float, length of a timedelta in days"""
+    return delta.total_seconds() / 86400.
+
+
+def lead_times(since=None):
+    """
+    Average lead times per vendor, taken from the order status history
+    (OrderEvent) rather than from the overwritable order date fields.
+    since - datetime, only consider orders received after this time
+    @return: [dict], one dict per vendor with keys 'vendor', 'orders',
+             'to_order' (days from request to order) and 'to_receive'
+             (days from order to delivery); sorted by vendor name
+    """
+    OrderEvent = django_apps.get_model('labhamster', 'OrderEvent')
+
+    events = OrderEvent.objects.order_by()
+    if since is not None:
+        received = OrderEvent.objects.filter(to_status='received',
+                                             timestamp__gte=since)
+        events = events.filter(order__in=received.values('order'))
+
+    rows = events.values('order', 'order__product__vendor__name').annotate(
+        created=Min(Case(When(from_status='', then='timestamp'))),
+        ordered=Max(Case(When(to_status='ordered', then='timestamp'))),
+        received=Max(Case(When(to_status='received', then='timestamp'))))
+
+    vendors = OrderedDict()
+    for r in sorted(rows, key=lambda r: r['order__product__vendor__name']):
+        if not r['received']:
+            continue
+        v = vendors.setdefault(r['order__product__vendor__name'],
+                               {'orders': 0, 'to_order': [], 'to_receive': []})
+        v['orders'] += 1
+        if r['created'] and r['ordered'] and r['created'] <= r['ordered']:
+            v['to_order'].append(days(r['ordered'] - r['created']))
+        if r['ordered'] and r['ordered'] <= r['received']:
+            v['to_receive'].append(days(r['received'] - r['ordered']))
+
+    def mean(values):
+        return float(sum(values)) / len(values) if values else None
+
+    return [{'vendor': name, 'orders': v['orders'],
+             'to_order': mean(v['to_order']),
+             'to_receive': mean(v['to_receive'])}
+            for name, v in vendors.items()]
@@ -0,0 +1,81 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Optional read-only replica database (settings.DATABASES['replica'], see
+$REPLICA_DATABASE_URL).
+
+Nothing is read from the replica unless asked for: changelist and report
+views call use_replica() for GET requests, exports read their queryset
+on_replica(). Writes always go to the primary ('default') database, and
+so does every read
+
+  * inside a transaction on the primary (e.g. admin change forms, bulk
+    status changes), so that nothing is decided on stale data;
+  * of models of other apps (sessions, users, admin log);
+  * during REPLICA_STICKY_SECONDS after a POST of the same browser
+    (middleware.ReplicaMiddleware), so that e.g. the changelist shown after
+    saving an order already lists it although the replica may lag behind.
+"""
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = 'replica'
+
+#: cookie pinning a browser to the primary database after a POST
+STICKY_COOKIE = 'labhamster_primary'
+
+_state = threading.local()
+
+
+def configured():
+    return REPLICA in connections
+
+
+def use_replica(enabled=True):
+    """Route reads of labhamster models to the replica for this request"""
+    _state.replica = enabled
+
+
+def pin_primary(pinned=True):
+    """Read everything from the primary for this request"""
+    _state.pinned = pinned
+
+
+def reset():
+    _state.replica = _state.pinned = False
+
+
+def read_alias():
+    """@return: str, database to read from if the replica may be used"""
+    if not configured() or getattr(_state, 'pinned', False) or \
+            connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    return REPLICA
+
+
+def on_replica(queryset):
+    """@return: QuerySet, queryset read from the replica if possible"""
+    return queryset.using(read_alias())
+
+
+class ReplicaRouter(object):
+    """Database router, see settings.DATABASE_ROUTERS"""
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'replica', False) and \
+                model._meta.app_label == 'labhamster':
+            return read_alias()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # same data on both databases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
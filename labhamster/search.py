@@ -0,0 +1,262 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Database-native full-text search for products and orders.
+
+Every Product and Order has one SearchDocument holding the concatenated
+text of its searchable fields. Documents are indexed by a tsvector GIN
+index on Postgres and by an external-content FTS5 table on SQLite (both
+created by migration 0011). Search terms are matched as word prefixes.
+The RANKED best matches are scored by relevance in a single query with
+LIMIT (ts_rank / bm25 of each match computed once) and listed first.
+"""
+import re
+
+from django.apps import apps as django_apps
+from django.db import connection
+from django.db.models import IntegerField, Value
+from django.db.models.expressions import RawSQL
+
+#: fields concatenated into the search document of each kind
+FIELDS = {
+    'product': ('name', 'comment', 'catalog', 'location', 'vendor__name',
+                'manufacturer__name', 'manufacturer_catalog'),
+    'order': ('comment', 'grant__name', 'grant__grant_id', 'product__name',
+              'product__catalog', 'product__vendor__name', 'po_number'),
+}
+
+MODELS = {'product': 'Product', 'order': 'Order'}
+
+FTS_TABLE = 'labhamster_searchdocument_fts'
+
+#: keep IN (...) lists below SQLite's limit of 999 query parameters
+BATCH_SIZE = 500
+
+#: number of best matches ordered by relevance, the others follow them
+RANKED = 100
+
+
+def kind_of(model):
+    """@return: str, document kind of a model class"""
+    return model._meta.model_name
+
+
+def indexed(model, kind):
+    """
+    @return: [str], attnames of the fields of model whose values go into
+             the search documents of kind, e.g. ['name', 'vendor_id'] for
+             Product and 'order'
+    """
+    r = []
+    for lookup in FIELDS[kind]:
+        current = django_apps.get_model('labhamster', MODELS[kind])
+        for part in lookup.split('__'):
+            field = current._meta.get_field(part)
+            if current is model and field.attname not in r:
+                r.append(field.attname)
+            current = field.related_model
+    return r
+
+
+def tokens(term):
+    """@return: [str], lower-case words of a search term"""
+    return re.findall(r'\w+', term.lower(), re.UNICODE)
+
+
+class PostgresBackend(object):
+    """tsvector matching against GIN index on to_tsvector('simple', body)"""
+
+    VECTOR = "to_tsvector('simple', body)"
+
+    def tsquery(self, words):
+        return ' & '.join('%s:*' % w for w in words)
+
+    def match(self, docs, words):
+        return docs.extra(
+            where=["%s @@ to_tsquery('simple', %%s)" % self.VECTOR],
+            params=[self.tsquery(words)])
+
+    def ranked(self, kind, words, limit):
+        q = self.tsquery(words)
+        return ("SELECT object_id FROM labhamster_searchdocument "
+                "WHERE kind = %%s AND %s @@ to_tsquery('simple', %%s) "
+                "ORDER BY ts_rank(%s, to_tsquery('simple', %%s)) DESC "
+                "LIMIT %%s" % (self.VECTOR, self.VECTOR),
+                [kind, q, q, limit])
+
+
+class SqliteBackend(object):
+    """FTS5 MATCH against external content table over SearchDocument"""
+
+    def ftsquery(self, words):
+        return ' AND '.join('"%s"*' % w for w in words)
+
+    def match(self, docs, words):
+        return docs.extra(
+            where=['id IN (SELECT rowid FROM %s WHERE %s MATCH %%s)'
+                   % (FTS_TABLE, FTS_TABLE)],
+            params=[self.ftsquery(words)])
+
+    def ranked(self, kind, words, limit):
+        # bm25() is lower for better matches
+        return ('SELECT d.object_id FROM %s JOIN labhamster_searchdocument d '
+                'ON d.id = %s.rowid WHERE %s MATCH %%s AND d.kind = %%s '
+                'ORDER BY bm25(%s) LIMIT %%s'
+                % (FTS_TABLE, FTS_TABLE, FTS_TABLE, FTS_TABLE),
+                [self.ftsquery(words), kind, limit])
+
+
+_backends = {}
+
+
+def get_backend():
+    """
+    @return: search backend for the default database or None if the
+             database has no native full-text index (plain icontains search
+             should be used instead)
+    """
+    vendor = connection.vendor
+    if vendor not in _backends:
+        backend = None
+        if vendor == 'postgresql':
+            backend = PostgresBackend()
+        elif vendor == 'sqlite' and \
+                FTS_TABLE in connection.introspection.table_names():
+            backend = SqliteBackend()
+        _backends[vendor] = backend
+    return _backends[vendor]
+
+
+def search(queryset, term):
+    """
+    Filter a Product or Order queryset by full-text search.
+    @return: QuerySet, annotated with 'search_rank' (see rank())
+    """
+    words = tokens(term)
+    backend = get_backend()
+    if not words or backend is None:
+        return queryset
+
+    docs = _matches(queryset.model, backend, words)
+    return _rank(queryset.filter(pk__in=docs.values('object_id')), backend,
+                 words)
+
+
+def rank(queryset, term):
+    """
+    Annotate a Product or Order queryset with the full-text 'search_rank'
+    of term without filtering it. Only the RANKED best matches get a
+    rank (higher is better), all other objects get 0.
+    """
+    words = tokens(term)
+    backend = get_backend()
+    if not words or backend is None:
+        return queryset
+    return _rank(queryset, backend, words)
+
+
+def ranked(model, term, limit=RANKED):
+    """
+    @return: [int], ids of the (at most limit) Products or Orders best
+             matching term, best first; empty if there is no full-text index
+    """
+    words = tokens(term)
+    backend = get_backend()
+    if not words or backend is None:
+        return []
+    return _ranked(model, backend, words, limit)
+
+
+def _matches(model, backend, words):
+    SearchDocument = django_apps.get_model('labhamster', 'SearchDocument')
+    docs = SearchDocument.objects.filter(kind=kind_of(model))
+    return backend.match(docs, words)
+
+
+def _ranked(model, backend, words, limit):
+    # one query scoring every match once, not one subquery per match
+    sql, params = backend.ranked(kind_of(model), words, limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [int(row[0]) for row in cursor.fetchall()]
+
+
+def _rank(queryset, backend, words):
+    ids = _ranked(queryset.model, backend, words, RANKED)
+    if not ids:
+        return queryset.annotate(search_rank=Value(0, IntegerField()))
+
+    # ids are integers read from the database, safe to inline
+    qn = connection.ops.quote_name
+    column = '%s.%s' % (qn(queryset.model._meta.db_table),
+                        qn(queryset.model._meta.pk.column))
+    cases = ' '.join('WHEN %i THEN %i' % (pk, len(ids) - i)
+                     for i, pk in enumerate(ids))
+    return queryset.annotate(search_rank=RawSQL(
+        'CASE %s %s ELSE 0 END' % (column, cases), [],
+        output_field=IntegerField()))
+
+
+def documents(kind, ids=None, apps=django_apps):
+    """
+    Generator over (object_id, body) pairs of search documents.
+    kind - str, 'product' or 'order'
+    ids  - [int], restrict to these objects (default: all)
+    apps - app registry to take models from (for use in migrations)
+    """
+    model = apps.get_model('labhamster', MODELS[kind])
+    qs = model.objects.order_by('pk').values_list('pk', *FIELDS[kind])
+
+    if ids is None:
+        last = 0
+        while True:
+            rows = list(qs.filter(pk__gt=last)[:BATCH_SIZE])
+            for row in rows:
+                yield row[0], ' '.join(str(v) for v in row[1:] if v)
+            if len(rows) < BATCH_SIZE:
+                return
+            last = rows[-1][0]
+    else:
+        ids = list(ids)
+        for i in range(0, len(ids), BATCH_SIZE):
+            for row in qs.filter(pk__in=ids[i:i + BATCH_SIZE]):
+                yield row[0], ' '.join(str(v) for v in row[1:] if v)
+
+
+def update(kind, ids=None, apps=django_apps):
+    """
+    (Re-)build search documents of given objects (default: all of kind).
+    Documents of objects that no longer exist are removed.
+    """
+    SearchDocument = apps.get_model('labhamster', 'SearchDocument')
+    docs = SearchDocument.objects.filter(kind=kind)
+
+    if ids is None:
+        docs.delete()
+    else:
+        ids = list(ids)
+        for i in range(0, len(ids), BATCH_SIZE):
+            docs.filter(object_id__in=ids[i:i + BATCH_SIZE]).delete()
+
+    batch = []
+    for object_id, body in documents(kind, ids, apps=apps):
+        batch.append(SearchDocument(kind=kind, object_id=object_id, body=body))
+        if len(batch) >= BATCH_SIZE:
+            SearchDocument.objects.bulk_create(batch)
+            batch = []
+    SearchDocument.objects.bulk_create(batch)
+
+
+def remove(kind, ids):
+    """delete search documents of given objects"""
+    SearchDocument = django_apps.get_model('labhamster', 'SearchDocument')
+    SearchDocument.objects.filter(kind=kind, object_id__in=ids).delete()
+
+
+def rebuild(apps=django_apps):
+    """rebuild all search documents"""
+    for kind in FIELDS:
+        update(kind, apps=apps)
@@ -0,0 +1,98 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Signal receivers keeping denormalized data in sync with the models.
+Connected in LabhamsterConfig.ready().
+"""
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+import labhamster.models as M
+from . import autocomplete
+from . import caching
+from . import reports
+from . import search
+from . import stats
+
+
+@receiver(post_save, sender=M.Order)
+def order_saved(sender, instance, raw=False, created=False, **kwargs):
+    if not raw and (created or
+                    instance.changed(*search.indexed(M.Order, 'order'))):
+        search.update('order', [instance.pk])
+
+
+@receiver(post_delete, sender=M.Order)
+def order_deleted(sender, instance, **kwargs):
+    search.remove('order', [instance.pk])
+    stats.refresh([instance.product_id], create=False)
+    reports.refresh_spend([reports.order_month(instance.date_ordered,
+                                               instance.date_created)])
+
+
+@receiver(post_save, sender=M.Product)
+def product_saved(sender, instance, raw=False, created=False, **kwargs):
+    autocomplete.cache.clear()
+    if raw:
+        return
+    # only re-index documents if indexed fields changed (not e.g. status)
+    if created or instance.changed(*search.indexed(M.Product, 'product')):
+        search.update('product', [instance.pk])
+    if created:
+        stats.refresh([instance.pk])
+        return
+    if instance.changed(*search.indexed(M.Product, 'order')):
+        search.update('order', instance.orders.values_list('pk', flat=True))
+    if instance.moved():
+        months = instance.orders.values_list('date_ordered', 'date_created')
+        reports.refresh_spend(reports.order_month(*m) for m in months)
+
+
+@receiver(post_delete, sender=M.Product)
+def product_deleted(sender, instance, **kwargs):
+    autocomplete.cache.clear()
+    search.remove('product', [instance.pk])
+
+
+@receiver(post_save, sender=M.Vendor)
+def vendor_saved(sender, instance, raw=False, created=False, **kwargs):
+    autocomplete.cache.clear()
+    if raw or created:
+        return
+    if instance.changed(*search.indexed(M.Vendor, 'product')):
+        products = M.Product.objects.filter(
+            Q(vendor=instance) | Q(manufacturer=instance))
+        search.update('product', products.values_list('pk', flat=True))
+    if instance.changed(*search.indexed(M.Vendor, 'order')):
+        orders = M.Order.objects.filter(product__vendor=instance)
+        search.update('order', orders.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=M.Grant)
+def grant_saved(sender, instance, raw=False, created=False, **kwargs):
+    if not raw and not created and \
+            instance.changed(*search.indexed(M.Grant, 'order')):
+        search.update('order', instance.orders.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=M.Vendor)
+@receiver(post_delete, sender=M.Vendor)
+@receiver(post_save, sender=M.Category)
+@receiver(post_delete, sender=M.Category)
+@receiver(post_save, sender=M.Grant)
+@receiver(post_delete, sender=M.Grant)
+@receiver(post_save, sender=M.Order)
+@receiver(post_delete, sender=M.Order)
+@receiver(post_save, sender=M.Product)
+@receiver(post_delete, sender=M.Product)
+def lookup_changed(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return  # user logged in
+    caching.invalidate(sender._meta.model_name)
@@ -0,0 +1,102 @@
+/*
+ * Type-ahead product field of the order form; see
+ * customforms.ProductAutocomplete and ProductAdmin.autocomplete_view.
+ */
+(function() {
+    'use strict';
+
+    var DELAY = 150;  // ms of typing pause before asking the server
+
+    function setup(box) {
+        var hidden = box.querySelector('input[type=hidden]');
+        var input = box.querySelector('input[type=text]');
+        var list = box.querySelector('ul');
+        var timer = null;
+        var request = null;
+        var active = -1;
+
+        function close() {
+            list.style.display = 'none';
+            active = -1;
+        }
+
+        function choose(item) {
+            hidden.value = item.id;
+            input.value = item.label;
+            close();
+        }
+
+        function show(results) {
+            list.innerHTML = '';
+            results.forEach(function(item) {
+                var li = document.createElement('li');
+                li.textContent = item.label;
+                li.addEventListener('mousedown', function(e) {
+                    e.preventDefault();
+                    choose(item);
+                });
+                li.item = item;
+                list.appendChild(li);
+            });
+            active = -1;
+            list.style.display = results.length ? 'block' : 'none';
+        }
+
+        function highlight(i) {
+            var items = list.children;
+            if (!items.length) {
+                return;
+            }
+            active = (i + items.length) % items.length;
+            for (var j = 0; j < items.length; j++) {
+                items[j].className = j === active ? 'active' : '';
+            }
+        }
+
+        function query() {
+            if (request) {
+                request.abort();
+            }
+            var term = input.value.trim();
+            if (!term) {
+                show([]);
+                return;
+            }
+            request = new XMLHttpRequest();
+            request.open('GET', box.dataset.url + '?q=' + encodeURIComponent(term));
+            request.onload = function() {
+                if (request.status === 200) {
+                    show(JSON.parse(request.responseText).results);
+                }
+            };
+            request.send();
+        }
+
+        input.addEventListener('input', function() {
+            hidden.value = '';
+            clearTimeout(timer);
+            timer = setTimeout(query, DELAY);
+        });
+
+        input.addEventListener('keydown', function(e) {
+            if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+                highlight(active + (e.key === 'ArrowDown' ? 1 : -1));
+                e.preventDefault();
+            } else if (e.key === 'Enter' && active >= 0) {
+                choose(list.children[active].item);
+                e.preventDefault();
+            } else if (e.key === 'Escape') {
+                close();
+            }
+        });
+
+        input.addEventListener('blur', close);
+    }
+
+    document.addEventListener('DOMContentLoaded', function() {
+        var boxes = document.querySelectorAll('.product-autocomplete');
+        for (var i = 0; i < boxes.length; i++) {
+            setup(boxes[i]);
+        }
+    });
+})();
@@ -0,0 +1,119 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Denormalized per-product order statistics (ProductStats).
+
+Statistics are recomputed for the affected products only, with a fixed
+number of grouped aggregate queries per batch of products, whenever orders
+are saved, deleted or changed by the bulk admin actions.
+"""
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.db.models import Case, When, Count, Max, Sum, F, DecimalField
+
+from . import currency
+
+#: orders that have been placed with the vendor
+ORDERED = ('ordered', 'received')
+
+#: orders still waiting for delivery or for being placed
+OPEN = ('pending', 'quote', 'ordered')
+
+#: keep IN (...) lists below SQLite's limit of 999 query parameters
+BATCH_SIZE = 500
+
+
+def _counts(Order, ids):
+    """@return: {product_id: (times_ordered, open_orders, last_ordered)}"""
+    # order_by() clears Meta.ordering, which would otherwise join GROUP BY
+    rows = Order.objects.filter(product__in=ids).order_by()\
+        .values('product')\
+        .annotate(times=Count(Case(When(status__in=ORDERED, then=1))),
+                  open=Count(Case(When(status__in=OPEN, then=1))),
+                  last=Max('date_ordered'))
+    return {r['product']: (r['times'], r['open'], r['last']) for r in rows}
+
+
+def _spend(Order, ids):
+    """
+    @return: {product_id: (amount, currency)} -- amount is None if the
+             product has been paid for in more than one currency
+    """
+    rows = Order.objects.filter(product__in=ids, status__in=ORDERED,
+                                price__isnull=False).order_by()\
+        .values('product', 'price_currency')\
+        .annotate(total=Sum(F('quantity') * F('price'),
+                            output_field=DecimalField()))
+    r = {}
+    for row in rows:
+        key = row['product']
+        r[key] = (None, '') if key in r else (row['total'],
+                                              row['price_currency'])
+    return r
+
+
+def _spend_base(Order, ids, apps):
+    """
+    @return: {product_id: amount} -- total spend in base currency; None if
+             exchange rates are missing for any of the orders
+    """
+    amount = currency.base_amount(apps=apps)
+    rows = Order.objects.filter(product__in=ids, status__in=ORDERED,
+                                price__isnull=False).order_by()\
+        .values('product')\
+        .annotate(total=Sum(amount), n=Count('id'), converted=Count(amount))
+    return {r['product']: r['total'] if r['n'] == r['converted'] else None
+            for r in rows}
+
+
+def refresh(product_ids=None, apps=django_apps, create=True):
+    """
+    Recompute statistics of given products (default: all products).
+    apps   - app registry to take models from (for use in migrations)
+    create - bool, replace statistics records; False only updates existing
+             records, which is safe while products are being deleted [True]
+    """
+    Product = apps.get_model('labhamster', 'Product')
+
+    if product_ids is None:
+        product_ids = Product.objects.values_list('pk', flat=True)
+    ids = sorted(set(product_ids))
+
+    with transaction.atomic():
+        for i in range(0, len(ids), BATCH_SIZE):
+            _refresh(ids[i:i + BATCH_SIZE], apps, create)
+
+
+def _refresh(ids, apps, create):
+    Product = apps.get_model('labhamster', 'Product')
+    Order = apps.get_model('labhamster', 'Order')
+    ProductStats = apps.get_model('labhamster', 'ProductStats')
+
+    counts = _counts(Order, ids)
+    spend = _spend(Order, ids)
+    spend_base = _spend_base(Order, ids, apps)
+    existing = Product.objects.filter(pk__in=ids).values_list('pk', flat=True)
+
+    stats = []
+    for pk in existing:
+        times, open_orders, last = counts.get(pk, (0, 0, None))
+        amount, code = spend.get(pk, (None, ''))
+        s = ProductStats(product_id=pk, times_ordered=times,
+                         open_orders=open_orders, last_ordered=last,
+                         total_spend=amount, spend_currency=code,
+                         total_spend_base=spend_base.get(pk))
+        stats.append(s)
+
+    if create:
+        ProductStats.objects.filter(product__in=ids).delete()
+        ProductStats.objects.bulk_create(stats)
+    else:
+        for s in stats:
+            ProductStats.objects.filter(pk=s.pk).update(
+                times_ordered=s.times_ordered, open_orders=s.open_orders,
+                last_ordered=s.last_ordered, total_spend=s.total_spend,
+                spend_currency=s.spend_currency,
+                total_spend_base=s.total_spend_base)
@@ -0,0 +1,242 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Reproducible synthetic data for benchmarks (see ./manage.py generate_data).
+
+The data set is skewed like a real lab's: a few vendors supply most
+products, a few products and users account for most orders, order volume
+grows over the years, and the status of an order depends on its age.
+Each vendor quotes its prices in one currency; monthly exchange rates
+for all currencies are generated as well.
+
+Rows are written with the bulk insert of the CSV importer (so that
+historical dates are kept), which also fills in status history, search
+index, product statistics and spend report.
+"""
+import datetime
+import math
+import random
+from decimal import Decimal
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from djmoney.money import Money
+
+from . import caching
+from . import currency
+from . import importer
+from . import tools as T
+
+CATEGORIES = ('chemicals', 'antibodies', 'enzymes', 'kits', 'plastics',
+              'glassware', 'media', 'equipment')
+
+WORDS = ('agarose', 'buffer', 'taq', 'polymerase', 'ligase', 'pipette',
+         'tips', 'plate', 'tube', 'column', 'resin', 'serum', 'medium',
+         'antibody', 'primer', 'dye', 'filter', 'flask', 'glove', 'kit',
+         'membrane', 'marker', 'substrate', 'inhibitor', 'salt', 'acid')
+
+#: currency of vendors (weights) and approximate value in USD
+CURRENCY_WEIGHTS = {'USD': 55, 'EUR': 20, 'GBP': 10, 'SAR': 15}
+USD_VALUE = {'USD': 1.0, 'EUR': 1.15, 'GBP': 1.3, 'SAR': 0.2667}
+
+PRODUCT_STATUS = (('ok', 60), ('low', 15), ('out', 15), ('deprecated', 10))
+
+
+def zipf_weights(n, s=1.0):
+    """@return: [float], weights of ranks 1..n falling with rank ** -s"""
+    return [1. / (i + 1) ** s for i in range(n)]
+
+
+def cumulative(weights):
+    r, total = [], 0.
+    for w in weights:
+        total += w
+        r.append(total)
+    return r
+
+
+class Generator(object):
+    """Build and insert a synthetic data set"""
+
+    def __init__(self, seed=0, years=5, today=None):
+        self.rng = random.Random(seed)
+        self.years = years
+        self.today = today or datetime.date.today()
+        self.currencies = [c for c in settings.CURRENCIES
+                           if c in CURRENCY_WEIGHTS] or ['USD']
+
+    def choose(self, population, cum_weights):
+        return self.rng.choices(population, cum_weights=cum_weights)[0]
+
+    def vendors(self, n):
+        Vendor = django_apps.get_model('labhamster', 'Vendor')
+        weights = [CURRENCY_WEIGHTS[c] for c in self.currencies]
+        self.vendor_currency = {}
+        objs = []
+        for i in range(n):
+            objs.append(Vendor(name='Vendor %04i' % i,
+                               link='https://vendor%04i.example.com' % i,
+                               email='sales@vendor%04i.example.com' % i))
+            self.vendor_currency[objs[-1].name] = self.rng.choices(
+                self.currencies, weights)[0]
+        importer.VendorImporter().flush(objs)
+
+        names = dict(Vendor.objects.values_list('name', 'pk'))
+        self.vendor_ids = [names[o.name] for o in objs]
+        self.currency_of = {names[name]: c
+                            for name, c in self.vendor_currency.items()}
+
+    def products(self, n):
+        Product = django_apps.get_model('labhamster', 'Product')
+        Category = django_apps.get_model('labhamster', 'Category')
+        categories = [Category.objects.get_or_create(name=name)[0].pk
+                      for name in CATEGORIES]
+        vendors = cumulative(zipf_weights(len(self.vendor_ids)))
+        status, status_weights = zip(*PRODUCT_STATUS)
+
+        objs = []
+        for i in range(n):
+            catalog = '%s-%05i' % (chr(65 + i % 26), i)
+            words = self.rng.sample(WORDS, 2)
+            name = '%s %s %05i' % (words[0].title(), words[1], i)
+            objs.append(Product(
+                name=name, name_key=T.normalize_name(name),
+                vendor_id=self.choose(self.vendor_ids, vendors),
+                catalog=catalog, catalog_key=T.normalize_catalog(catalog),
+                category_id=self.rng.choice(categories),
+                status=self.rng.choices(status, status_weights)[0],
+                location='shelf %i' % self.rng.randint(1, 40)))
+
+        p = importer.ProductImporter()
+        p.flush(objs)
+        p.finish()
+
+        names = dict(Product.objects.values_list('name', 'pk'))
+        self.product_ids = [names[o.name] for o in objs]
+        # typical unit price of each product in its vendor's currency
+        self.unit_price = {}
+        for o in objs:
+            price = math.exp(self.rng.gauss(4, 1.2))
+            self.unit_price[names[o.name]] = (
+                min(price / USD_VALUE[self.currency_of[o.vendor_id]], 50000),
+                self.currency_of[o.vendor_id])
+
+    def users(self, n):
+        objs = [User(username='user%04i' % i, first_name='User',
+                     last_name='%04i' % i, password='!') for i in range(n)]
+        User.objects.bulk_create(objs)
+        names = dict(User.objects.values_list('username', 'pk'))
+        self.user_ids = [names[o.username] for o in objs]
+
+    def grants(self, n):
+        Grant = django_apps.get_model('labhamster', 'Grant')
+        # the most recent grants are the active ones
+        objs = [Grant(name='Grant %03i' % i, grant_id='G-%05i' % i,
+                      active=i >= n * 2 // 3) for i in range(n)]
+        Grant.objects.bulk_create(objs)
+        names = dict(Grant.objects.values_list('name', 'pk'))
+        self.grant_ids = [names[o.name] for o in objs]
+
+    def status(self, age):
+        """@return: str, random status of an order of age days"""
+        if age > 60:
+            choices = (('received', 85), ('cancelled', 10), ('ordered', 5))
+        elif age > 14:
+            choices = (('received', 50), ('ordered', 35), ('pending', 10),
+                       ('cancelled', 5))
+        else:
+            choices = (('pending', 40), ('ordered', 40), ('quote', 10),
+                       ('received', 10))
+        status, weights = zip(*choices)
+        return self.rng.choices(status, weights)[0]
+
+    def order(self, products, users):
+        Order = django_apps.get_model('labhamster', 'Order')
+        rng = self.rng
+        span = 365 * self.years
+        # volume grows over time: recent dates are more likely
+        age = int(span * (1 - rng.random() ** 0.7))
+        created = self.today - datetime.timedelta(days=age)
+        status = self.status(age)
+
+        ordered = received = ordered_by = None
+        if status in ('ordered', 'received'):
+            ordered = min(created + datetime.timedelta(rng.randint(0, 7)),
+                          self.today)
+            ordered_by = self.choose(self.user_ids, users)
+        if status == 'received':
+            received = min(ordered + datetime.timedelta(rng.randint(2, 30)),
+                           self.today)
+
+        product = self.choose(self.product_ids, products)
+        o = Order(product_id=product, status=status,
+                  created_by_id=self.choose(self.user_ids, users),
+                  ordered_by_id=ordered_by,
+                  date_created=created, date_ordered=ordered,
+                  date_received=received,
+                  quantity=1 + min(int(rng.expovariate(0.7)), 49),
+                  is_urgent=rng.random() < 0.05,
+                  grant_id=rng.choice(self.grant_ids)
+                  if self.grant_ids and rng.random() < 0.8 else None,
+                  comment='please hurry' if rng.random() < 0.1 else '')
+        if rng.random() < 0.9:
+            price, price_currency = self.unit_price[product]
+            price *= rng.uniform(0.9, 1.1)
+            o.price = Money(Decimal('%.2f' % price), price_currency)
+        return o
+
+    def orders(self, n, batch_size=importer.BATCH_SIZE):
+        products = cumulative(zipf_weights(len(self.product_ids), 0.9))
+        users = cumulative(zipf_weights(len(self.user_ids), 0.8))
+        o = importer.OrderImporter()
+        batch = []
+        for i in range(n):
+            batch.append(self.order(products, users))
+            if len(batch) >= batch_size:
+                o.flush(batch)
+                batch = []
+        o.flush(batch)
+        o.finish()
+
+    def exchange_rates(self):
+        """monthly rates of all currencies, random walks around USD_VALUE"""
+        ExchangeRate = django_apps.get_model('labhamster', 'ExchangeRate')
+        base = currency.base_currency()
+        start = self.today.replace(day=1) - \
+            datetime.timedelta(days=365 * self.years + 31)
+        rates = []
+        for c in self.currencies:
+            if c == base:
+                continue
+            value = USD_VALUE[c] / USD_VALUE.get(base, 1.0)
+            month = start.replace(day=1)
+            while month <= self.today:
+                value *= math.exp(self.rng.gauss(0, 0.02))
+                rates.append(ExchangeRate(currency=c, date=month,
+                                          rate=Decimal('%.6f' % value)))
+                month = (month + datetime.timedelta(days=32)).replace(day=1)
+        ExchangeRate.objects.bulk_create(rates)
+
+
+def generate(vendors=50, products=2000, users=30, grants=10, orders=100000,
+             years=5, seed=0, today=None):
+    """
+    Insert a synthetic data set; the same seed gives the same data.
+    @return: Generator
+    """
+    g = Generator(seed=seed, years=years, today=today)
+    with transaction.atomic():
+        g.exchange_rates()
+        g.vendors(vendors)
+        g.products(products)
+        g.users(users)
+        g.grants(grants)
+    g.orders(orders)
+    caching.invalidate('vendor', 'category', 'user', 'grant', 'product',
+                       'order')
+    return g
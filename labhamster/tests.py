@@ -3,3 +3,1838 @@
 # This file is part of the LabHamster project (https://github.com/graik/labhamster).
 # LabHamster is released under the MIT open source license, which you can find
 # along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+import base64
+import csv
+import io
+import itertools
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.test import Client, TestCase, TransactionTestCase, RequestFactory
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from labhamster.admin import OrderAdmin, ProductAdmin
+from labhamster.export import export_csv, export_xlsx, CompiledFields
+from labhamster.paginator import KeysetPaginator
+from labhamster import autocomplete, caching, currency, filters, forecast
+from labhamster import importer, inventory
+from labhamster import jobs, notifications
+from labhamster import metrics, middleware
+from labhamster import paginator, reports, routers, search, stats
+from labhamster import synthetic, tools
+from labhamster import transitions
+import labhamster.models as M
+
+
+def make_orders(n, user=None, product=None, **kwargs):
+    """create n orders for a single product and user"""
+    user = user or User.objects.get_or_create(username='tester')[0]
+    if product is None:
+        vendor = M.Vendor.objects.get_or_create(name='Sigma')[0]
+        category = M.Category.objects.get_or_create(name='chemicals')[0]
+        product = M.Product.objects.get_or_create(
+            name='Agarose', vendor=vendor, catalog='A-1234-05',
+            category=category)[0]
+    return [M.Order.objects.create(product=product, created_by=user, **kwargs)
+            for i in range(n)]
+
+
+_serial = itertools.count()
+
+
+def make_catalog(n):
+    """create n orders, each with its own user, vendor and product"""
+    category = M.Category.objects.get_or_create(name='chemicals')[0]
+    orders = []
+    for i in itertools.islice(_serial, n):
+        user = User.objects.create(username='user%i' % i)
+        vendor = M.Vendor.objects.create(name='vendor%i' % i)
+        maker = M.Vendor.objects.create(name='maker%i' % i)
+        product = M.Product.objects.create(
+            name='product%i' % i, vendor=vendor, manufacturer=maker,
+            catalog='C-%i' % i, category=category)
+        orders.extend(make_orders(1, user=user, product=product))
+    return orders
+
+
+# admin rendering: no SSL redirect and no static file manifest in tests
+ADMIN_TEST_SETTINGS = dict(
+    SECURE_SSL_REDIRECT=False,
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+
+
+class ExportTest(TestCase):
+
+    def read_csv(self, response):
+        content = b''.join(response.streaming_content).decode()
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_order_csv(self):
+        o = make_orders(1, quantity=3, price=12.5, is_urgent=True)[0]
+        response = export_csv(RequestFactory().get('/'), M.Order.objects.all(),
+                              OrderAdmin.csv_fields)
+        rows = self.read_csv(response)
+
+        self.assertEqual(rows[0], list(OrderAdmin.csv_fields.keys()))
+        row = dict(zip(rows[0], rows[1]))
+        self.assertEqual(row['Product'], 'Agarose')
+        self.assertEqual(row['Vendor'], 'Sigma')
+        self.assertEqual(row['Quantity'], '3')
+        self.assertEqual(row['Price'], str(o.price))
+        self.assertEqual(row['Requested by'], 'tester')
+        self.assertEqual(row['Ordered by'], '')
+        self.assertEqual(row['Urgent'], 'True')
+
+    def test_product_csv(self):
+        make_orders(1)
+        response = export_csv(RequestFactory().get('/'),
+                              M.Product.objects.all(), ProductAdmin.csv_fields,
+                              filename='products.csv')
+        self.assertIn('products.csv', response['Content-Disposition'])
+        rows = self.read_csv(response)
+        self.assertEqual(rows[1][:3], ['Agarose', 'Sigma', 'A-1234-05'])
+        self.assertEqual(rows[1][3], '')  # no manufacturer
+
+    def test_chunks(self):
+        make_orders(5)
+        compiled = CompiledFields(M.Order, OrderAdmin.csv_fields)
+        with self.assertNumQueries(3):
+            rows = list(compiled.rows(M.Order.objects.all(), chunk_size=2))
+        self.assertEqual(len(rows), 5)
+
+    def test_order_xlsx(self):
+        import openpyxl
+        from decimal import Decimal
+        from djmoney.money import Money
+        o = make_orders(1, quantity=3, price=Money('12.50', 'EUR'),
+                        is_urgent=True)[0]
+        response = export_xlsx(RequestFactory().get('/'),
+                               M.Order.objects.all(), OrderAdmin.csv_fields)
+        self.assertIn('orders.xlsx', response['Content-Disposition'])
+
+        content = b''.join(response.streaming_content)
+        sheet = openpyxl.load_workbook(io.BytesIO(content)).active
+        self.assertEqual(sheet.freeze_panes, 'A2')
+
+        rows = list(sheet.values)
+        row = dict(zip(rows[0], rows[1]))
+        self.assertEqual(row['Quantity'], 3)
+        self.assertEqual(Decimal(str(row['Price'])), Decimal('12.50'))
+        self.assertEqual(row['Price currency'], 'EUR')
+        self.assertEqual(row['Requested'].date(), o.date_created)
+        self.assertEqual(row['Ordered'], None)
+        self.assertEqual(row['Urgent'], True)
+
+
+@override_settings(**ADMIN_TEST_SETTINGS)
+class AdminQueryCountTest(TestCase):
+    """
+    Admin pages must run a fixed number of queries no matter how many rows
+    are displayed or exported.
+    """
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', '', 'secret')
+        self.client.force_login(self.admin)
+
+    def count_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data)
+            self.assertEqual(response.status_code, 200)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return len(context)
+
+    def assertConstantQueries(self, method, url, data=None, grow=None):
+        """
+        compare query counts before and after calling grow(), each with
+        warm caches (new rows invalidate cached filter choices)
+        """
+        self.count_queries(method, url, data() if data else None)  # warm up
+        before = self.count_queries(method, url, data() if data else None)
+        grow()
+        self.count_queries(method, url, data() if data else None)
+        after = self.count_queries(method, url, data() if data else None)
+        self.assertEqual(before, after)
+
+    def test_order_changelist(self):
+        make_catalog(2)
+        self.assertConstantQueries('get', '/labhamster/order/',
+                                   grow=lambda: make_catalog(10))
+
+    def test_product_changelist(self):
+        make_catalog(2)
+        self.assertConstantQueries('get', '/labhamster/product/',
+                                   grow=lambda: make_catalog(10))
+
+    def test_order_change_form(self):
+        order = make_catalog(1)[0]
+        url = '/labhamster/order/%i/change/' % order.id
+
+        def grow():
+            for i in range(5):
+                user = User.objects.create(username='other%i' % i)
+                make_orders(1, user=user, product=order.product)
+
+        self.assertConstantQueries('get', url, grow=grow)
+
+    def test_product_change_form(self):
+        product = make_catalog(1)[0].product
+        url = '/labhamster/product/%i/change/' % product.id
+
+        def grow():
+            for i in range(5):
+                user = User.objects.create(username='other%i' % i)
+                make_orders(1, user=user, product=product)
+
+        self.assertConstantQueries('get', url, grow=grow)
+
+    def test_order_export(self):
+        make_catalog(2)
+
+        def data():
+            return {'action': 'make_csv', 'index': 0,
+                    '_selected_action': [o.pk for o in M.Order.objects.all()]}
+
+        self.assertConstantQueries('post', '/labhamster/order/', data,
+                                   grow=lambda: make_catalog(10))
+
+    def test_product_export(self):
+        make_catalog(2)
+
+        def data():
+            return {'action': 'make_csv', 'index': 0,
+                    '_selected_action': [p.pk for p in M.Product.objects.all()]}
+
+        self.assertConstantQueries('post', '/labhamster/product/', data,
+                                   grow=lambda: make_catalog(10))
+
+    def test_xlsx_export(self):
+        make_catalog(2)
+
+        def data():
+            return {'action': 'make_xlsx', 'index': 0,
+                    '_selected_action': [o.pk for o in M.Order.objects.all()]}
+
+        self.assertConstantQueries('post', '/labhamster/order/', data,
+                                   grow=lambda: make_catalog(10))
+
+
+@override_settings(**ADMIN_TEST_SETTINGS)
+class SearchTest(TestCase):
+
+    def setUp(self):
+        self.orders = make_catalog(3)
+        self.agarose = make_orders(2, comment='for the gel room')
+
+    def ids(self, queryset):
+        return set(queryset.values_list('pk', flat=True))
+
+    def test_backend(self):
+        self.assertIsNotNone(search.get_backend())
+
+    def test_prefix_search(self):
+        found = search.search(M.Product.objects.all(), 'agar')
+        self.assertEqual([p.name for p in found], ['Agarose'])
+
+        found = search.search(M.Order.objects.all(), 'sigm gel')
+        self.assertEqual(self.ids(found), {o.pk for o in self.agarose})
+
+        found = search.search(M.Product.objects.all(), '1234')
+        self.assertEqual([p.name for p in found], ['Agarose'])
+
+    def test_ranking(self):
+        agarose = M.Product.objects.get(name='Agarose')
+        agarose.comment = 'gel'
+        agarose.save()
+        product = self.orders[0].product
+        product.comment = 'gel gel gel'
+        product.save()
+        found = search.search(M.Product.objects.all(), 'gel')
+        found = found.order_by('-search_rank')
+        self.assertEqual(found[0], product)
+
+        # only the best matches are scored, from a single query
+        self.assertEqual(search.ranked(M.Product, 'gel', 1), [product.pk])
+        with patch.object(search, 'RANKED', 1), self.assertNumQueries(2):
+            found = list(search.search(M.Product.objects.all(), 'gel')
+                         .order_by('-search_rank', 'name'))
+        self.assertEqual([p.search_rank for p in found], [1, 0])
+
+    def test_update_on_rename(self):
+        vendor = M.Vendor.objects.get(name='Sigma')
+        vendor.name = 'Merck'
+        vendor.save()
+        self.assertFalse(search.search(M.Order.objects.all(), 'sigma').exists())
+        found = search.search(M.Order.objects.all(), 'merck')
+        self.assertEqual(self.ids(found), {o.pk for o in self.agarose})
+
+    def test_update_indexed_fields_only(self):
+        product = M.Product.objects.get(name='Agarose')
+        vendor = M.Vendor.objects.get(name='Sigma')
+        with patch.object(search, 'update') as update:
+            product.status = 'low'
+            product.save()
+            vendor.phone = '123'
+            vendor.save()
+            self.assertFalse(update.called)
+
+            product.name = 'Agarose LE'
+            product.save()
+            product.name = 'Agarose'  # compared with the saved state
+            product.save()
+        self.assertEqual([c[0][0] for c in update.call_args_list],
+                         ['product', 'order'] * 2)
+
+    def test_delete(self):
+        self.agarose[0].delete()
+        found = search.search(M.Order.objects.all(), 'agarose')
+        self.assertEqual(self.ids(found), {self.agarose[1].pk})
+
+    def test_admin_search(self):
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        response = self.client.get('/labhamster/order/', {'q': 'agarose'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        vendor = self.orders[0].product.vendor.name
+        response = self.client.get('/labhamster/product/', {'q': vendor})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+@override_settings(**ADMIN_TEST_SETTINGS)
+class CatalogLookupTest(TestCase):
+
+    def setUp(self):
+        make_catalog(2)
+        self.product = make_orders(1)[0].product  # catalog 'A-1234-05'
+        self.product.manufacturer_catalog = 'xy 99/1'
+        self.product.save()
+
+    def test_normalize(self):
+        for s in ('A-1234-05', 'a123405', ' A1234 05', 'a.1234_05'):
+            self.assertEqual(tools.normalize_catalog(s), 'A123405')
+
+    def test_lookup(self):
+        lookup = M.Product.objects.catalog_lookup
+        for term in ('A-1234-05', 'a123405', ' A1234 05', 'a12', 'XY-991'):
+            self.assertEqual(list(lookup(term)), [self.product])
+        self.assertEqual(list(lookup('a12', prefix=False)), [])
+        self.assertEqual(list(lookup('a123405', prefix=False)), [self.product])
+        self.assertEqual(list(lookup(' -- ')), [])
+
+    def test_backfill(self):
+        M.Product.objects.update(catalog_key='', manufacturer_catalog_key='')
+        self.assertEqual(tools.update_catalog_keys(M.Product), 3)
+        self.assertEqual(M.Product.objects.get(pk=self.product.pk).catalog_key,
+                         'A123405')
+
+    def test_admin_search(self):
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        response = self.client.get('/labhamster/product/', {'q': 'a1234 05'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.product])
+
+        # catalog matches come first, but don't hide matches by name
+        vendor, category = self.product.vendor, self.product.category
+        polymerase = M.Product.objects.create(
+            name='T7 polymerase', vendor=vendor, catalog='P-1',
+            category=category)
+        promoter = M.Product.objects.create(
+            name='promoter primer', vendor=vendor, catalog='T7-100',
+            category=category)
+        response = self.client.get('/labhamster/product/', {'q': 'T7'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [promoter, polymerase])
+
+
+@override_settings(**ADMIN_TEST_SETTINGS)
+class ProductStatsTest(TestCase):
+
+    def setUp(self):
+        self.orders = make_orders(3, price=10)
+        self.product = self.orders[0].product
+
+    def stats(self, product=None):
+        return M.ProductStats.objects.get(product=product or self.product)
+
+    def test_order_save(self):
+        self.assertEqual(self.stats().open_orders, 3)
+        self.assertEqual(self.stats().times_ordered, 0)
+
+        o = self.orders[0]
+        o.status = 'received'
+        o.quantity = 2
+        o.save()
+        s = self.stats()
+        self.assertEqual((s.times_ordered, s.open_orders), (1, 2))
+        self.assertEqual(s.last_ordered, o.date_ordered)
+        self.assertEqual((s.total_spend, s.spend_currency), (20, 'USD'))
+
+    def test_mixed_currency(self):
+        from djmoney.money import Money
+        for o, code in zip(self.orders, ('USD', 'EUR', 'EUR')):
+            o.status = 'ordered'
+            o.price = Money(10, code)
+            o.save()
+        self.assertIsNone(self.stats().total_spend)
+
+    def test_move_and_delete(self):
+        other = make_catalog(1)[0].product
+        o = M.Order.objects.get(pk=self.orders[0].pk)
+        o.product = other
+        o.save()
+        self.assertEqual(self.stats().open_orders, 2)
+        self.assertEqual(self.stats(other).open_orders, 2)
+
+        M.Order.objects.get(pk=o.pk).delete()
+        self.assertEqual(self.stats(other).open_orders, 1)
+
+        other.delete()
+        self.assertFalse(M.ProductStats.objects.filter(product=other).exists())
+
+    def test_bulk_actions(self):
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        data = {'action': 'make_received', 'index': 0,
+                '_selected_action': [o.pk for o in self.orders[:2]]}
+        self.client.post('/labhamster/order/', data)
+        s = self.stats()
+        self.assertEqual((s.times_ordered, s.open_orders), (2, 1))
+
+        data['action'] = 'make_cancelled'
+        self.client.post('/labhamster/order/', data)
+        self.assertEqual(self.stats().times_ordered, 0)
+
+    def test_rebuild(self):
+        M.ProductStats.objects.all().delete()
+        stats.refresh()
+        self.assertEqual(self.stats().open_orders, 3)
+
+
+class TransitionTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='manager')
+
+    def test_fixed_statements(self):
+        make_catalog(3)
+        qs = M.Order.objects.all()
+        with CaptureQueriesContext(connection) as small:
+            transitions.transition(qs, 'received', user=self.user)
+        make_catalog(30)
+        with CaptureQueriesContext(connection) as large:
+            r = transitions.transition(qs, 'received', user=self.user)
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(len(r.changed), 30)
+        self.assertEqual(len(r.products), 30)
+
+    def test_rules(self):
+        orders = make_orders(3)
+        orders[0].status = 'ordered'
+        orders[0].save()
+        before = M.Order.objects.get(pk=orders[0].pk)
+
+        qs = M.Order.objects.filter(pk__in=[o.pk for o in orders])
+        r = transitions.transition(qs, 'ordered', user=self.user)
+        self.assertEqual(set(r.changed), {orders[1].pk, orders[2].pk})
+
+        o = M.Order.objects.get(pk=orders[0].pk)
+        self.assertEqual(o.date_ordered, before.date_ordered)
+        self.assertIsNone(o.ordered_by)  # unchanged row is left alone
+        o = M.Order.objects.get(pk=orders[1].pk)
+        self.assertEqual(o.ordered_by, self.user)
+        self.assertIsNotNone(o.date_ordered)
+
+        r = transitions.transition(qs, 'received')
+        self.assertEqual(len(r.changed), 3)
+        self.assertEqual(M.Product.objects.get(pk=r.products[0]).status, 'ok')
+        self.assertFalse(qs.filter(date_received__isnull=True).exists())
+
+        r = transitions.transition(qs, 'cancelled')
+        self.assertFalse(qs.exclude(date_received__isnull=True).exists())
+        self.assertFalse(qs.exclude(date_ordered__isnull=True).exists())
+
+    def test_save(self):
+        o = make_orders(1, status='received')[0]
+        self.assertIsNotNone(o.date_received)
+        self.assertEqual(M.Product.objects.get(pk=o.product_id).status, 'ok')
+
+        o = M.Order.objects.get(pk=o.pk)
+        o.status = 'cancelled'
+        o.save()
+        self.assertIsNone(M.Order.objects.get(pk=o.pk).date_received)
+
+
+@override_settings(**ADMIN_TEST_SETTINGS)
+class OrderEventTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='manager')
+
+    def test_save(self):
+        o = make_orders(1)[0]
+        o.status = 'ordered'
+        o.save(user=self.user)
+        o.save()  # no status change, no event
+        events = list(o.history().values_list('from_status', 'to_status',
+                                               'user'))
+        self.assertEqual(events, [('', 'pending', None),
+                                  ('pending', 'ordered', self.user.pk)])
+
+    def test_bulk(self):
+        orders = make_catalog(20)
+        qs = M.Order.objects.all()
+        with CaptureQueriesContext(connection) as context:
+            transitions.transition(qs, 'ordered', user=self.user)
+        inserts = [q for q in context.captured_queries
+                   if 'INSERT INTO "labhamster_orderevent"' in q['sql']]
+        self.assertEqual(len(inserts), 1)
+
+        transitions.transition(qs, 'cancelled', user=self.user)
+        events = M.OrderEvent.objects.filter(order=orders[0])
+        self.assertEqual([e.to_status for e in events],
+                         ['pending', 'ordered', 'cancelled'])
+
+    def test_lead_times(self):
+        from datetime import timedelta
+        from labhamster import reports
+
+        o = make_orders(1)[0]
+        transitions.transition(M.Order.objects.all(), 'ordered')
+        transitions.transition(M.Order.objects.all(), 'received')
+        events = M.OrderEvent.objects.filter(order=o)
+        start = events.get(to_status='pending').timestamp
+        events.filter(to_status='ordered').update(
+            timestamp=start + timedelta(days=2))
+        events.filter(to_status='received').update(
+            timestamp=start + timedelta(days=5))
+
+        r = reports.lead_times()
+        self.assertEqual(r, [{'vendor': 'Sigma', 'orders': 1,
+                              'to_order': 2., 'to_receive': 3.}])
+
+    def test_change_form(self):
+        o = make_orders(1)[0]
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        data = {'status': 'ordered', 'product': o.product_id,
+                'created_by': o.created_by_id, 'quantity': 1,
+                'price_0': '', 'price_1': 'USD',
+                'grant_category': 'consumables', 'comment': ''}
+        self.client.post('/labhamster/order/%i/change/' % o.pk, data)
+        self.assertEqual(o.history().last().user.username, 'admin')
+        response = self.client.get('/labhamster/order/%i/change/' % o.pk)
+        self.assertContains(response, 'Status history')
+
+
+@override_settings(**ADMIN_TEST_SETTINGS)
+class SpendReportTest(TestCase):
+
+    def setUp(self):
+        from djmoney.money import Money
+        self.orders = make_orders(3, price=Money(10, 'EUR'), quantity=2)
+        self.month = reports.order_month(None, self.orders[0].date_created)
+
+    def rollups(self):
+        return list(M.SpendRollup.objects.values_list('month', 'orders',
+                                                      'total', 'currency'))
+
+    def test_incremental(self):
+        self.assertEqual(self.rollups(), [])  # nothing ordered yet
+
+        qs = M.Order.objects.filter(pk__in=[o.pk for o in self.orders[:2]])
+        transitions.transition(qs, 'ordered')
+        self.assertEqual(self.rollups(), [(self.month, 2, 40, 'EUR')])
+
+        o = M.Order.objects.get(pk=self.orders[0].pk)
+        o.quantity = 1
+        o.save()
+        self.assertEqual(self.rollups(), [(self.month, 2, 30, 'EUR')])
+
+        o.delete()
+        self.assertEqual(self.rollups(), [(self.month, 1, 20, 'EUR')])
+
+        M.SpendRollup.objects.all().delete()
+        reports.refresh_spend()
+        self.assertEqual(self.rollups(), [(self.month, 1, 20, 'EUR')])
+
+    def test_move_product(self):
+        transitions.transition(M.Order.objects.all(), 'ordered')
+        product = M.Product.objects.get(pk=self.orders[0].product_id)
+        product.vendor = M.Vendor.objects.create(name='Merck')
+        product.save()
+        self.assertEqual(M.SpendRollup.objects.get().vendor.name, 'Merck')
+
+    def test_report(self):
+        transitions.transition(M.Order.objects.all(), 'received')
+        rows = reports.spend_report('vendor', self.month.year)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['label'], 'Sigma')
+        self.assertEqual(rows[0]['total'], 60)
+        self.assertEqual(rows[0]['months'][self.month.month - 1], 60)
+
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        for by in reports.DIMENSIONS:
+            response = self.client.get('/labhamster/spendrollup/',
+                                       {'by': by, 'year': self.month.year})
+            self.assertContains(response, '60.00')
+
+
+@override_settings(BASE_CURRENCY='USD', **ADMIN_TEST_SETTINGS)
+class ExchangeRateTest(TestCase):
+
+    RATES = 'date,currency,rate\n' \
+        '2000-01-01,EUR,1.5\n' \
+        '2000-01-01,GBP,2\n' \
+        '2100-01-01,EUR,3\n'
+
+    def setUp(self):
+        from djmoney.money import Money
+        self.eur = make_orders(2, price=Money(10, 'EUR'), quantity=2)
+        self.usd = make_orders(1, price=Money(7, 'USD'), quantity=1)
+        transitions.transition(M.Order.objects.all(), 'ordered')
+
+    def test_load(self):
+        rates = currency.load_rates(io.StringIO(self.RATES))
+        self.assertEqual(len(rates), 3)
+        currency.load_rates(io.StringIO('date,currency,rate\n'
+                                        '2000-01-01,eur,1.25\n'))
+        self.assertEqual(M.ExchangeRate.objects.count(), 3)
+        self.assertEqual(str(M.ExchangeRate.objects.first().rate),
+                         '1.25000000')
+
+    def test_total(self):
+        # without rates, only base currency orders are counted
+        self.assertEqual(currency.total(M.Order.objects.all()), 7)
+
+        currency.load_rates(io.StringIO(self.RATES))
+        with self.assertNumQueries(1):
+            total = currency.total(M.Order.objects.all())
+        self.assertEqual(total, 2 * 2 * 10 * 1.5 + 7)
+
+    def test_rate_table(self):
+        from datetime import date
+        from decimal import Decimal
+        from djmoney.money import Money
+        make_orders(1, price=Money(10, 'SAR'))  # no rate, skipped
+        currency.load_rates(io.StringIO(self.RATES))
+        table = currency.RateTable()
+        self.assertEqual(table.rate('EUR', date(1999, 1, 1)), None)
+        self.assertEqual(table.rate('EUR', date(2000, 6, 1)), Decimal('1.5'))
+        self.assertEqual(table.rate('USD', date(1999, 1, 1)), 1)
+
+        with self.assertNumQueries(1):
+            total = table.convert(M.Order.objects.all())
+        self.assertEqual(total, 2 * 2 * 10 * 1.5 + 7)
+        self.assertEqual(total, currency.total(M.Order.objects.all()))
+
+    def test_derived_totals(self):
+        product = M.ProductStats.objects.get()
+        self.assertEqual(product.total_spend, None)  # mixed currencies
+        self.assertEqual(product.total_spend_base, None)  # no EUR rate
+
+        currency.load_rates(io.StringIO(self.RATES))
+        stats.refresh()
+        reports.refresh_spend()
+        self.assertEqual(M.ProductStats.objects.get().total_spend_base, 67)
+
+        rows = reports.spend_report('vendor', self.usd[0].date_created.year,
+                                    base=True)
+        self.assertEqual([(r['currency'], r['total']) for r in rows],
+                         [('USD', 67)])
+
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        response = self.client.get('/labhamster/spendrollup/', {
+            'year': self.usd[0].date_created.year, 'base': '1'})
+        self.assertContains(response, '67.00')
+
+
+@override_settings(**ADMIN_TEST_SETTINGS)
+class FilterTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        make_catalog(3)
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+
+    def test_cached_choices(self):
+        names = filters.VendorFilter.names()
+        self.assertEqual(len(names), 6)  # vendors and manufacturers
+        with self.assertNumQueries(0):
+            self.assertEqual(filters.VendorFilter.names(), names)
+
+        M.Vendor.objects.create(name='Merck')
+        self.assertIn('Merck', filters.VendorFilter.names())
+
+        M.Vendor.objects.get(name='Merck').delete()
+        self.assertNotIn('Merck', filters.VendorFilter.names())
+
+    def test_invalidate(self):
+        builds = []
+        caching.get(('grant',), 'test', lambda: builds.append(1) or 1)
+        caching.get(('grant',), 'test', lambda: builds.append(1) or 1)
+        self.assertEqual(len(builds), 1)
+        caching.invalidate('grant')
+        caching.get(('grant',), 'test', lambda: builds.append(1) or 1)
+        self.assertEqual(len(builds), 2)
+
+    def test_list_filter(self):
+        vendor = M.Order.objects.first().product.vendor.name
+        response = self.client.get('/labhamster/order/')
+        self.assertContains(response, '?vendor=%s' % vendor)
+
+        response = self.client.get('/labhamster/order/', {'vendor': vendor})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    @override_settings(FILTER_CHOICES_LIMIT=2)
+    def test_search_filter(self):
+        vendor = M.Order.objects.first().product.vendor.name
+        response = self.client.get('/labhamster/order/', {'status': 'pending'})
+        self.assertNotContains(response, '?vendor=%s' % vendor)
+        self.assertContains(response, 'name="vendor"')
+        self.assertContains(response, 'name="status" value="pending"')
+
+        response = self.client.get('/labhamster/order/', {'vendor': 'VEND'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+
+class OrderFormTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create(username=name)
+                      for name in ('anna', 'bob', 'zoe')]
+        M.Grant.objects.create(name='old', grant_id='1', active=False)
+        M.Grant.objects.create(name='new', grant_id='2')
+        self.request = RequestFactory().get('/')
+        self.request.user = self.users[2]
+
+    def form(self, instance=None):
+        from django.contrib import admin
+        Form = OrderAdmin(M.Order, admin.site).get_form(self.request, instance)
+        form = Form(instance=instance)
+        return form, [str(form[f]) for f in ('created_by', 'grant')]
+
+    def test_choices(self):
+        form, html = self.form()
+        users = [label for pk, label in form.fields['created_by'].choices]
+        self.assertEqual(users[1:4], ['zoe', 'anna', 'bob'])
+        self.assertIn('new 2', html[1])
+        self.assertNotIn('old 1', html[1])
+
+        with self.assertNumQueries(0):
+            self.form()
+
+        User.objects.create(username='carl')
+        form, html = self.form()
+        self.assertIn('carl', html[0])
+
+    def test_expired_grant(self):
+        order = make_orders(1, grant=M.Grant.objects.get(name='old'))[0]
+        form, html = self.form(order)
+        self.assertIn('old 1 (expired)', html[1])
+
+
+@override_settings(**ADMIN_TEST_SETTINGS)
+class AutocompleteTest(TestCase):
+
+    def setUp(self):
+        autocomplete.cache.clear()
+        self.order = make_orders(1)[0]  # Agarose, Sigma, A-1234-05
+        vendor = M.Vendor.objects.create(name='Merck')
+        M.Product.objects.create(name='Low melt agarose', vendor=vendor,
+                                 catalog='X-99',
+                                 category=M.Category.objects.get())
+
+    def names(self, term):
+        return [r['name'] for r in autocomplete.suggest(term)]
+
+    def test_suggest(self):
+        self.assertEqual(self.names('agar'), ['Agarose', 'Low melt agarose'])
+        self.assertEqual(self.names('merck'), ['Low melt agarose'])
+        self.assertEqual(self.names('a1234'), ['Agarose'])
+        self.assertEqual(self.names('  '), [])
+
+        with self.assertNumQueries(0):
+            self.names('AGAR')
+
+        M.Product.objects.create(name='Agar', vendor=M.Vendor.objects.first(),
+                                 category=M.Category.objects.get())
+        self.assertEqual(self.names('agar')[0], 'Agar')
+
+    def test_common_word(self):
+        vendor, category = M.Vendor.objects.first(), M.Category.objects.get()
+        for i in range(2 * autocomplete.CANDIDATES):
+            M.Product.objects.create(name='Buffer %i' % i, vendor=vendor,
+                                     comment='tris buffer', category=category)
+        M.Product.objects.create(name='Tris', vendor=vendor,
+                                 category=category)
+        self.assertEqual([r['name'] for r in autocomplete.suggest('tris', 1)],
+                         ['Tris'])
+
+    def test_name_prefix(self):
+        self.assertEqual(self.names('LOW  melt'), ['Low melt agarose'])
+        self.assertEqual(M.Product.objects.get(name='Agarose').name_key,
+                         'agarose')
+        # a range over the name key index, no LIKE on the name column
+        with CaptureQueriesContext(connection) as context:
+            self.names('low m')
+        self.assertFalse(any('LIKE' in q['sql']
+                             for q in context.captured_queries))
+
+    def test_view(self):
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        response = self.client.get('/labhamster/product/autocomplete/',
+                                   {'q': 'sigma'})
+        self.assertEqual(response.json()['results'][0]['label'],
+                         'Agarose (Sigma A-1234-05)')
+
+        response = self.client.get(
+            '/labhamster/order/%i/change/' % self.order.pk)
+        self.assertContains(response, 'value="Agarose (Sigma A-1234-05)"')
+        self.assertContains(response, 'product_autocomplete.js')
+
+
+@override_settings(**ADMIN_TEST_SETTINGS)
+class ImportTest(TestCase):
+
+    def export(self, admin_class, queryset):
+        response = export_csv(RequestFactory().get('/'), queryset,
+                              admin_class.csv_fields)
+        return b''.join(response.streaming_content).decode()
+
+    def test_parse_money(self):
+        from djmoney.money import Money
+        for code in ('USD', 'SAR', 'GBP', 'EUR'):
+            value = Money('1234.50', code)
+            self.assertEqual(importer.parse_money(str(value)), value)
+        self.assertEqual(importer.parse_money('SAR 12'), Money(12, 'SAR'))
+        self.assertEqual(importer.parse_money('3.5'), Money('3.5', 'USD'))
+        self.assertEqual(importer.parse_money(''), None)
+        self.assertRaises(ValueError, importer.parse_money, '3 XYZ')
+
+    def test_order_round_trip(self):
+        from datetime import date
+        from djmoney.money import Money
+        make_orders(2, price=Money('10.50', 'EUR'), quantity=3)
+        o = make_orders(1, price=Money(7, 'USD'), comment='a, "b"')[0]
+        transitions.transition(M.Order.objects.filter(pk=o.pk), 'received')
+        M.Order.objects.filter(pk=o.pk).update(date_created=date(2015, 1, 2))
+
+        fields = ('product', 'quantity', 'price', 'price_currency',
+                  'date_created', 'date_ordered', 'date_received', 'status',
+                  'created_by', 'comment')
+        before = list(M.Order.objects.order_by('pk').values_list(*fields))
+        content = self.export(OrderAdmin, M.Order.objects.all())
+        M.Order.objects.all().delete()
+
+        report = importer.import_csv(io.StringIO(content), 'order')
+        self.assertEqual((report.rows, report.created, report.errors),
+                         (3, 3, []))
+        after = list(M.Order.objects.order_by('pk').values_list(*fields))
+        self.assertEqual(after, before)
+
+        o = M.Order.objects.get(status='received')
+        self.assertEqual([e.to_status for e in o.history()],
+                         ['pending', 'received'])
+        self.assertEqual(M.ProductStats.objects.get().times_ordered, 1)
+        self.assertEqual(M.SpendRollup.objects.get().total, 7)
+        self.assertEqual(M.SearchDocument.objects.filter(kind='order')
+                         .count(), 3)
+
+    def test_product_round_trip(self):
+        make_catalog(3)
+        content = self.export(ProductAdmin, M.Product.objects.all())
+        names = sorted(M.Product.objects.values_list('name', flat=True))
+        M.Product.objects.all().delete()
+
+        report = importer.import_csv(io.StringIO(content), 'product')
+        self.assertEqual(report.created, 3)
+        self.assertEqual(
+            sorted(M.Product.objects.values_list('name', flat=True)), names)
+        self.assertEqual(M.ProductStats.objects.count(), 3)
+        p = M.Product.objects.catalog_lookup('c').first()
+        self.assertTrue(p.manufacturer.name.startswith('maker'))
+
+        report = importer.import_csv(io.StringIO(content), 'product')
+        self.assertEqual(report.created, 0)
+        self.assertIn('already exists', report.errors[0][1])
+
+    def test_errors(self):
+        make_orders(1)
+        content = 'Product,Requested by,Requested,Quantity\n' \
+            'Agarose,tester,2017-01-01,2\n' \
+            'Agarose,nobody,2017-01-01,2\n' \
+            'Unknown,tester,2017-01-01,2\n' \
+            'Agarose,tester,01/01/2017,2\n'
+        report = importer.import_csv(io.StringIO(content), 'order')
+        self.assertEqual((report.rows, report.created), (4, 1))
+        self.assertEqual([e[0] for e in report.errors], [3, 4, 5])
+        self.assertIn('unknown user "nobody"', report.errors[0][1])
+
+        out = io.StringIO()
+        report.write_errors(out)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+
+        self.assertRaises(ValueError, importer.import_csv,
+                          io.StringIO('Name\n'), 'order')
+
+    def test_upload(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        self.assertContains(self.client.get('/labhamster/vendor/'),
+                            '/labhamster/vendor/import/')
+
+        upload = SimpleUploadedFile('vendors.csv', b'Name,Link\nMerck,\n,\n')
+        response = self.client.post('/labhamster/vendor/import/',
+                                    {'file': upload})
+        self.assertContains(response, '1 of 1 vendor rows imported, 0 errors')
+        self.assertTrue(M.Vendor.objects.filter(name='Merck').exists())
+
+        # line breaks inside quoted fields are kept as they are
+        upload = SimpleUploadedFile(
+            'vendors.csv', b'Name,Contact\r\nSigma,"Ann\rBob\r\nEve"\r\n')
+        response = self.client.post('/labhamster/vendor/import/',
+                                    {'file': upload})
+        self.assertContains(response, '1 of 1 vendor rows imported, 0 errors')
+        self.assertEqual(M.Vendor.objects.get(name='Sigma').contact,
+                         'Ann\rBob\r\nEve')
+
+
+@override_settings(**ADMIN_TEST_SETTINGS)
+class ApiTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+
+    def get(self, url, **kwargs):
+        response = self.client.get(url, **kwargs)
+        if response.status_code != 200:
+            return response, None
+        return response, response.json()
+
+    def test_keyset_pages(self):
+        orders = make_catalog(5)
+        url = '/api/v1/orders/?limit=2&fields=id,vendor'
+        ids = []
+        queries = []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response, data = self.get(url)
+            queries.append(len(context))
+            self.assertNotIn('OFFSET', context[-1]['sql'])
+            ids += [r['id'] for r in data['results']]
+            self.assertEqual(list(data['results'][0]), ['id', 'vendor'])
+            url = data['next']
+        self.assertEqual(ids, sorted(o.pk for o in orders))
+        self.assertEqual(len(set(queries)), 1)
+
+    def test_modified_ordering(self):
+        orders = make_catalog(3)
+        orders[0].comment = 'changed'
+        orders[0].save()
+        response, data = self.get(
+            '/api/v1/orders/?ordering=modified&limit=2&fields=comment')
+        self.assertEqual(len(data['results']), 2)
+        response, data = self.get(data['next'])
+        self.assertEqual(data['results'], [{'comment': 'changed'}])
+        self.assertIsNone(data['next'])
+
+    def test_conditional_get(self):
+        order = make_catalog(2)[0]
+        url = '/api/v1/orders/?fields=id,product_name,status'
+        response, data = self.get(url)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(context), 3)  # session, user, fingerprint
+        self.assertIn('LIMIT', context[-1]['sql'])
+
+        # bulk status changes, renamed products and deletions change it
+        transitions.transition(M.Order.objects.filter(pk=order.pk),
+                               'ordered')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        M.Product.objects.filter(pk=order.product_id).update(name='renamed')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        M.Order.objects.filter(pk=order.pk).delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_renamed_user_and_category(self):
+        # neither model has a date_modified, their names are hashed instead
+        order = make_catalog(1)[0]
+        for url, obj, field in (
+                ('/api/v1/orders/?fields=id,requested_by', order.created_by,
+                 'username'),
+                ('/api/v1/products/?fields=id,category',
+                 order.product.category, 'name')):
+            etag = self.get(url)[0]['ETag']
+            setattr(obj, field, 'renamed')
+            obj.save()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_page_etag(self):
+        orders = make_catalog(4)
+        url = '/api/v1/orders/?limit=2'
+        etag = self.get(url)[0]['ETag']
+
+        # rows after the next page's first one don't change the first page
+        transitions.transition(M.Order.objects.filter(pk=orders[3].pk),
+                               'ordered')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        transitions.transition(M.Order.objects.filter(pk=orders[1].pk),
+                               'ordered')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail(self):
+        vendor = M.Vendor.objects.create(name='Merck', password='secret')
+        response, data = self.get('/api/v1/vendors/%i/' % vendor.pk)
+        self.assertEqual(data['name'], 'Merck')
+        self.assertNotIn('password', data)
+        response, data = self.get('/api/v1/vendors/%i/' % (vendor.pk + 1))
+        self.assertEqual(response.status_code, 404)
+
+    def test_errors(self):
+        for query in ('fields=id,password', 'cursor=xyz', 'ordering=name',
+                      'limit=a', 'product=a', 'modified_since=yesterday'):
+            response, data = self.get('/api/v1/orders/?' + query)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_authentication(self):
+        self.client.logout()
+        response, data = self.get('/api/v1/grants/')
+        self.assertEqual(response.status_code, 401)
+
+        auth = 'Basic ' + base64.b64encode(b'admin:secret').decode()
+        for i in range(2):
+            response, data = self.get('/api/v1/grants/',
+                                      HTTP_AUTHORIZATION=auth)
+            self.assertEqual(response.status_code, 200)
+
+        User.objects.create_user('guest', '', 'secret')
+        auth = 'Basic ' + base64.b64encode(b'guest:secret').decode()
+        response, data = self.get('/api/v1/grants/', HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 401)
+
+
+class KeysetPaginatorTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        orders = make_catalog(4) + make_orders(5)
+        for i, o in enumerate(orders):
+            o.date_ordered = date(2017, 1, 1 + i % 3) if i % 2 else None
+            o.save()
+        ordering = list(OrderAdmin.ordering) + ['-pk']
+        self.queryset = M.Order.objects.order_by(*ordering)
+        self.expected = list(self.queryset.values_list('pk', flat=True))
+
+    def pages(self, numbers):
+        paginator = KeysetPaginator(self.queryset, 2)
+        return {n: [o.pk for o in paginator.page(n).object_list]
+                for n in numbers}
+
+    def test_pages(self):
+        self.assertEqual(len(self.expected), 9)
+        for numbers in ([4, 2, 1, 3, 5], [1, 2, 3, 4, 5]):
+            pages = self.pages(numbers)
+            self.assertEqual(sum([pages[n] for n in sorted(pages)], []),
+                             self.expected)
+
+        with CaptureQueriesContext(connection) as context:
+            self.pages([5])
+        self.assertNotIn('OFFSET', context[-1]['sql'])
+
+    def test_insert_between_reads(self):
+        self.pages([1, 2, 3])
+        new = make_orders(1, product=M.Product.objects.order_by('pk')[0],
+                          date_ordered=date(2018, 1, 1))[0]
+        expected = list(self.queryset.values_list('pk', flat=True))
+        self.assertEqual(expected[0], new.pk)
+
+        pages = self.pages([1, 2, 3, 4, 5])
+        self.assertEqual(sum([pages[n] for n in sorted(pages)], []),
+                         expected)
+
+    def test_estimated_count(self):
+        with patch.object(paginator, 'COUNT_THRESHOLD', 5):
+            self.assertEqual(paginator.estimated_count(self.queryset),
+                             (9, True))
+            with self.assertNumQueries(0):
+                self.assertEqual(paginator.estimated_count(self.queryset),
+                                 (9, False))
+            make_orders(1)
+            self.assertEqual(paginator.estimated_count(self.queryset),
+                             (10, True))
+
+    @override_settings(ADMIN_KEYSET_PAGINATION=True, **ADMIN_TEST_SETTINGS)
+    def test_changelist(self):
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        with patch.object(OrderAdmin, 'list_per_page', 4):
+            response = self.client.get('/labhamster/order/', {'p': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([o.pk for o in response.context['cl'].result_list],
+                         self.expected[8:])
+
+
+@override_settings(**ADMIN_TEST_SETTINGS)
+class ExplainTest(TestCase):
+
+    def test_explain_admin_queries(self):
+        from django.core.management import call_command
+        make_catalog(3)
+        out = io.StringIO()
+        call_command('explain_admin_queries', verbosity=2, stdout=out)
+        out = out.getvalue()
+        self.assertIn('orders by month', out)
+        if connection.vendor == 'sqlite':
+            self.assertIn('labhamster__status_cd6046_idx', out)
+            # all orders and orders by status are read in index order
+            head = out.split('open orders')[0]
+            self.assertNotIn('+sort', head)
+            self.assertNotIn('RIGHT PART OF ORDER BY', head)
+        self.assertIn('queries with table scans', out)
+
+
+class BenchmarkTest(TestCase):
+
+    def generate(self, seed):
+        from django.db import transaction
+        try:
+            with transaction.atomic():
+                synthetic.generate(vendors=3, products=20, users=4, grants=2,
+                                   orders=300, seed=seed)
+                r = list(M.Order.objects.order_by('pk').values_list(
+                    'status', 'date_created', 'date_received', 'price',
+                    'price_currency', 'product__name', 'created_by__username'))
+                self.assertEqual(M.ProductStats.objects.count(), 20)
+                self.assertEqual(M.OrderEvent.objects.values('order')
+                                 .distinct().count(), 300)
+                raise ValueError('rollback')
+        except ValueError:
+            pass
+        return r
+
+    def test_reproducible(self):
+        data = self.generate(1)
+        self.assertEqual(len(data), 300)
+        self.assertEqual(data, self.generate(1))
+        self.assertNotEqual(data, self.generate(2))
+
+    @override_settings(**ADMIN_TEST_SETTINGS)
+    def test_benchmark(self):
+        from django.core.management import call_command
+        synthetic.generate(vendors=3, products=20, users=4, grants=2,
+                           orders=300)
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as f:
+            call_command('benchmark', repeat=1, output=f.name,
+                         stdout=io.StringIO())
+            results = json.load(f)['results']
+            self.assertIn('order month drilldown', results)
+            self.assertEqual(results['order changelist']['runs'], 1)
+
+            out = io.StringIO()
+            call_command('benchmark', repeat=1, only='product', stdout=out,
+                         compare=f.name)
+            self.assertIn('ratio', out.getvalue())
+
+        self.assertEqual(M.Order.objects.count(), 300)
+
+
+@override_settings(PERFORMANCE_INSTRUMENTATION=True, **ADMIN_TEST_SETTINGS)
+class PerformanceMiddlewareTest(TestCase):
+
+    def setUp(self):
+        middleware.reset()
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+
+    def test_server_timing(self):
+        make_catalog(2)
+        response = self.client.get('/labhamster/order/')
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^total;dur=[\d.]+, db;dur=[\d.]+;'
+                                 r'desc="\d+ queries", render;dur=[\d.]+$')
+        self.assertNotEqual(timing.split('render;dur=')[1], '0.0')
+
+        self.client.get('/labhamster/order/')
+        views = {v['view']: v for v in middleware.aggregates()}
+        a = views['admin:labhamster_order_changelist']
+        self.assertEqual(a['requests'], 2)
+        self.assertGreater(a['queries'], 0)
+
+        data = self.client.get('/performance/').json()
+        self.assertIn('admin:labhamster_order_changelist',
+                      [v['view'] for v in data['views']])
+
+    def test_slow_request_log(self):
+        with patch.object(middleware, 'SLOW_REQUEST_MS', 0), \
+                self.assertLogs('labhamster.performance') as logs:
+            self.client.get('/labhamster/product/')
+        self.assertIn('slow request GET /labhamster/product/',
+                      logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(PERFORMANCE_INSTRUMENTATION=False)
+    def test_disabled(self):
+        response = self.client.get('/labhamster/product/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(middleware.aggregates(), [])
+
+
+@override_settings(PERFORMANCE_INSTRUMENTATION=True, METRICS_TOKEN='t0ken',
+                   **ADMIN_TEST_SETTINGS)
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(METRICS_DIR=tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.store.clear()
+        self.addCleanup(metrics.store.clear)
+        self.dir = tmp.name
+
+    def scrape(self, **headers):
+        headers.setdefault('HTTP_AUTHORIZATION', 'Bearer t0ken')
+        response = self.client.get('/metrics', **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def sample(self, text, line):
+        """@return: float, value of the sample starting with line"""
+        for l in text.splitlines():
+            if l.startswith(line + ' '):
+                return float(l.rsplit(' ', 1)[1])
+        self.fail('%s not in metrics' % line)
+
+    def test_requests(self):
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        make_orders(2)
+        self.client.get('/labhamster/order/')
+        self.client.get('/labhamster/order/')
+
+        text = self.scrape()
+        self.assertIn('# TYPE labhamster_http_request_duration_seconds '
+                      'histogram', text)
+        labels = 'view="admin:labhamster_order_changelist",method="GET"'
+        name = 'labhamster_http_request_duration_seconds'
+        self.assertEqual(self.sample(text, '%s_count{%s}' % (name, labels)), 2)
+        self.assertEqual(self.sample(
+            text, '%s_bucket{%s,le="+Inf"}' % (name, labels)), 2)
+        self.assertGreater(self.sample(
+            text, 'labhamster_db_queries_total'
+            '{view="admin:labhamster_order_changelist"}'), 2)
+
+        # buckets are cumulative and sorted by bound
+        buckets = [float(l.rsplit(' ', 1)[1]) for l in text.splitlines()
+                   if l.startswith('%s_bucket{%s' % (name, labels))]
+        self.assertEqual(len(buckets), len(metrics.BUCKETS) + 1)
+        self.assertEqual(buckets, sorted(buckets))
+
+    def test_processes(self):
+        """files of other processes are added up"""
+        metrics.TRANSITIONS.inc(3, status='received')
+        with open(os.path.join(self.dir, '1-other.json'), 'w') as f:
+            json.dump([['labhamster_order_transitions_total',
+                        [['status', 'received']], 4]], f)
+        text = self.scrape()
+        self.assertEqual(self.sample(
+            text, 'labhamster_order_transitions_total{status="received"}'), 7)
+        self.assertEqual(len(os.listdir(self.dir)), 2)
+
+    def test_transitions_and_exports(self):
+        orders = make_orders(3)
+        transitions.transition(M.Order.objects.all(), 'ordered')
+        request = RequestFactory().get('/')
+        response = export_csv(request, M.Order.objects.all(),
+                              OrderAdmin.csv_fields)
+        b''.join(response.streaming_content)
+
+        text = self.scrape()
+        self.assertEqual(self.sample(
+            text, 'labhamster_order_transitions_total{status="ordered"}'),
+            len(orders))
+        self.assertEqual(self.sample(
+            text, 'labhamster_exported_rows_total{model="order",format="csv"}'),
+            3)
+
+    def test_authentication(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer x')
+        self.assertEqual(response.status_code, 401)
+        User.objects.create_user('staff', '', 'secret', is_staff=True)
+        self.scrape(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(
+            b'staff:secret').decode())
+
+    @override_settings(PERFORMANCE_INSTRUMENTATION=False)
+    def test_disabled(self):
+        metrics.TRANSITIONS.inc(1, status='ordered')
+        self.assertNotIn('labhamster_order_transitions_total{',
+                         self.scrape())
+
+
+@override_settings(DATABASE_ROUTERS=['labhamster.routers.ReplicaRouter'],
+                   **ADMIN_TEST_SETTINGS)
+class ReplicaTest(TransactionTestCase):
+    """replica: SQLite file with a snapshot of the primary test database"""
+
+    def setUp(self):
+        self.orders = make_orders(2)
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+
+        tmp = tempfile.NamedTemporaryFile(suffix='.sqlite3')
+        self.addCleanup(tmp.close)
+        connection.ensure_connection()
+        target = sqlite3.connect(tmp.name)
+        connection.connection.backup(target)
+        target.close()
+
+        # replaces a test mirror configured by $REPLICA_DATABASE_URL
+        self.configured = connections.databases.get(routers.REPLICA)
+        if self.configured is not None:
+            connections[routers.REPLICA].close()
+            del connections[routers.REPLICA]
+        connections.databases[routers.REPLICA] = {
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': tmp.name}
+        self.addCleanup(self.remove_replica)
+
+        # only on the primary, i.e. not yet replicated
+        make_orders(1)
+
+    def remove_replica(self):
+        connections[routers.REPLICA].close()
+        del connections[routers.REPLICA]
+        del connections.databases[routers.REPLICA]
+        if self.configured is not None:
+            connections.databases[routers.REPLICA] = self.configured
+        routers.reset()
+
+    def count(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.context_data['cl'].result_count
+
+    def test_changelist(self):
+        self.assertEqual(self.count('/labhamster/order/'), 2)
+        self.assertEqual(self.count('/labhamster/orderevent/'), 2)
+
+        # change forms (atomic) read from the primary
+        order = M.Order.objects.latest('pk')
+        response = self.client.get(
+            '/labhamster/order/%i/change/' % order.pk)
+        self.assertEqual(response.status_code, 200)
+
+    def test_read_your_writes(self):
+        data = {'action': 'make_cancelled', 'index': 0,
+                '_selected_action': [o.pk for o in self.orders]}
+        response = self.client.post('/labhamster/order/', data)
+        self.assertIn(routers.STICKY_COOKIE, response.cookies)
+        self.assertEqual(M.Order.objects.filter(status='cancelled').count(),
+                         2)
+
+        self.assertEqual(self.count('/labhamster/order/'), 3)
+        self.assertEqual(self.count('/labhamster/order/',
+                                    status__exact='cancelled'), 2)
+
+        del self.client.cookies[routers.STICKY_COOKIE]
+        self.assertEqual(self.count('/labhamster/order/',
+                                    status__exact='cancelled'), 0)
+
+    def test_export(self):
+        response = self.client.post('/labhamster/order/', {
+            'action': 'make_csv', 'select_across': 1, 'index': 0,
+            '_selected_action': [self.orders[0].pk]})
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 1 + 2)
+
+    def test_routing(self):
+        User.objects.create(username='new')
+        routers.use_replica()
+        self.assertEqual(M.Order.objects.count(), 2)
+        self.assertEqual(User.objects.count(), 3)  # other apps: primary
+        with transaction.atomic():
+            self.assertEqual(M.Order.objects.count(), 3)
+
+        order = M.Order.objects.first()
+        order.comment = 'saved on the primary'
+        order.save()
+        routers.reset()
+        self.assertEqual(M.Order.objects.get(pk=order.pk).comment,
+                         'saved on the primary')
+
+
+@override_settings(JOB_QUEUE_THRESHOLD=2, **ADMIN_TEST_SETTINGS)
+class JobTest(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', '', 'secret')
+        self.client.force_login(self.admin)
+        self.orders = make_orders(3)
+
+    def action(self, action, orders):
+        return self.client.post('/labhamster/order/', {
+            'action': action, 'index': 0,
+            '_selected_action': [o.pk for o in orders]})
+
+    def work(self):
+        from django.core.management import call_command
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+
+    def test_small_actions_run_right_away(self):
+        self.action('make_cancelled', self.orders[:2])
+        self.assertFalse(M.Job.objects.exists())
+        self.assertEqual(
+            M.Order.objects.filter(status='cancelled').count(), 2)
+
+    def test_transition(self):
+        response = self.action('make_ordered', self.orders)
+        self.assertEqual(response.status_code, 302)
+        job = M.Job.objects.get()
+        self.assertEqual((job.status, job.total, job.user), ('queued', 3,
+                                                             self.admin))
+        self.assertFalse(M.Order.objects.filter(status='ordered').exists())
+
+        with patch.object(jobs, 'BATCH_SIZE', 2):
+            self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), ('done', 3))
+        self.assertEqual(
+            M.Order.objects.filter(status='ordered',
+                                   ordered_by=self.admin).count(), 3)
+        self.assertEqual(M.OrderEvent.objects.filter(
+            to_status='ordered').count(), 3)
+
+    def test_export(self):
+        self.client.post('/labhamster/order/', {
+            'action': 'make_csv', 'select_across': 1, 'index': 0,
+            '_selected_action': [self.orders[0].pk], 'q': 'agarose'})
+        self.action('make_xlsx', self.orders)
+        self.work()
+
+        csv_job, xlsx_job = M.Job.objects.order_by('pk')
+        self.assertEqual(csv_job.status, 'done', csv_job.message)
+        response = self.client.get(
+            '/labhamster/job/%i/download/' % csv_job.pk)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        content = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(len(rows), 1 + 3)
+
+        self.assertEqual(xlsx_job.filename, 'orders.xlsx')
+        self.assertTrue(b''.join(jobs.chunks(xlsx_job)).startswith(b'PK'))
+
+        response = self.client.get('/labhamster/job/')
+        self.assertContains(response, 'orders.xlsx')
+        self.assertContains(response, '100%')
+
+        # other staff users can't see the files
+        User.objects.create_user('staff', '', 'x', is_staff=True)
+        self.client.login(username='staff', password='x')
+        response = self.client.get(
+            '/labhamster/job/%i/download/' % csv_job.pk)
+        self.assertEqual(response.status_code, 404)
+
+    def test_chunks(self):
+        self.action('make_csv', self.orders)
+        with patch.object(jobs, 'CHUNK_SIZE', 100):
+            self.work()
+        job = M.Job.objects.get()
+        self.assertEqual(job.chunks.count(), (job.size + 99) // 100)
+        content = b''.join(jobs.chunks(job)).decode()
+        self.assertEqual(len(content.splitlines()), 1 + 3)
+
+        jobs.purge(days=-1)
+        self.assertFalse(M.JobChunk.objects.exists())
+
+    def test_claim(self):
+        qs = M.Order.objects.all()
+        first = jobs.enqueue('transition', qs, None, 'first',
+                             {'status': 'cancelled'})
+        jobs.enqueue('transition', qs, None, 'second', {'status': 'ordered'})
+
+        self.assertEqual(jobs.claim('a'), first)
+        second = jobs.claim('b')
+        self.assertEqual((second.description, second.worker), ('second', 'b'))
+        self.assertIsNone(jobs.claim('c'))
+
+    def test_failures(self):
+        job = jobs.enqueue('export', M.Order.objects.all(), None, 'broken',
+                           {'format': 'csv', 'filename': 'x.csv',
+                            'fields': [['Nonsense', 'no.such.field']]})
+        with self.assertLogs('labhamster.jobs'):
+            jobs.run(jobs.claim('a'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(job.message)
+
+        stale = jobs.enqueue('transition', M.Order.objects.all(), None,
+                             'stale', {'status': 'ordered'})
+        jobs.claim('killed')
+        self.assertEqual(jobs.fail_stale(seconds=3600), 0)
+        self.assertEqual(jobs.fail_stale(seconds=-1), 1)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'failed')
+
+        # a job given up on while still running stays failed
+        jobs.enqueue('export', M.Order.objects.all(), None, 'late',
+                            {'format': 'csv', 'filename': 'x.csv',
+                             'fields': [['Status', 'status']]})
+        late = jobs.claim('slow')
+        jobs.fail_stale(seconds=-1)
+        with self.assertLogs('labhamster.jobs'):
+            late = jobs.run(late)
+        self.assertEqual(late.status, 'failed')
+        self.assertFalse(late.chunks.exists())
+
+        self.assertEqual(jobs.purge(days=1), 0)
+        M.Job.objects.update(date_finished=timezone.now() - timedelta(2))
+        self.assertEqual(jobs.purge(days=1), 3)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                   SITE_URL='https://lab.example.com',
+                   DIGEST_SETTLE_SECONDS=0)
+class NotificationTest(TestCase):
+
+    def setUp(self):
+        from django.core import mail
+        self.outbox = mail.outbox
+        self.requester = User.objects.create(username='req', first_name='Ann',
+                                             email='ann@example.com')
+        self.manager = User.objects.create(username='manager')
+        self.orders = make_orders(3, user=self.requester)
+        self.assertIsNotNone(notifications.send())  # starting point
+        self.assertEqual(len(self.outbox), 0)
+
+    def test_digest(self):
+        orders = M.Order.objects.filter(pk__in=[o.pk for o in self.orders])
+        transitions.transition(orders, 'ordered', user=self.manager)
+        transitions.transition(orders.filter(pk=self.orders[0].pk),
+                               'received', user=self.manager)
+        other = make_orders(1, user=User.objects.create(
+            username='bob', email='bob@example.com'))[0]
+        transitions.transition(M.Order.objects.filter(pk=other.pk),
+                               'cancelled', user=self.manager)
+        # own changes and users without e-mail are skipped
+        transitions.transition(M.Order.objects.filter(pk=other.pk),
+                               'pending', user=self.manager)
+        make_orders(1)[0].save()
+
+        # one query for all events, independent of their number
+        with self.assertNumQueries(7):
+            digest = notifications.send()
+        self.assertEqual(digest.messages, 2)
+        self.assertEqual(len(self.outbox), 2)
+
+        ann = [m for m in self.outbox if m.to == ['ann@example.com']][0]
+        self.assertEqual(ann.subject, 'LabHamster: 3 of your orders changed')
+        self.assertIn('Hello Ann', ann.body)
+        self.assertEqual(ann.body.count('Received'), 1)
+        self.assertEqual(ann.body.count('Ordered'), 2)
+        self.assertIn('https://lab.example.com/labhamster/order/%i/'
+                      % self.orders[0].pk, ann.body)
+
+        bob = [m for m in self.outbox if m.to == ['bob@example.com']][0]
+        self.assertEqual(bob.subject, 'LabHamster: Agarose cancelled')
+
+        self.assertIsNone(notifications.send())  # nothing new
+        self.assertEqual(len(self.outbox), 2)
+
+    def test_own_changes(self):
+        transitions.transition(M.Order.objects.all(), 'ordered',
+                               user=self.requester)
+        self.assertEqual(notifications.send().messages, 0)
+        self.assertEqual(len(self.outbox), 0)
+
+    def test_settle(self):
+        M.Digest.objects.update(date_sent=timezone.now() - timedelta(hours=1))
+        transitions.transition(M.Order.objects.filter(pk=self.orders[0].pk),
+                               'ordered', user=self.manager)
+        M.OrderEvent.objects.update(
+            timestamp=timezone.now() - timedelta(minutes=5))
+        # events of transactions that may still be running are left alone
+        transitions.transition(M.Order.objects.filter(pk=self.orders[1].pk),
+                               'ordered', user=self.manager)
+
+        digest = notifications.send(settle=60)
+        self.assertEqual(digest.messages, 1)
+        self.assertEqual(self.outbox[0].subject,
+                         'LabHamster: Agarose ordered')
+        self.assertIsNone(notifications.send(settle=60))
+
+        later = timezone.now() + timedelta(minutes=2)
+        with patch('django.utils.timezone.now', return_value=later):
+            digest = notifications.send(settle=60)
+        self.assertEqual(digest.messages, 1)
+        self.assertEqual(len(self.outbox), 2)
+
+    def test_import(self):
+        content = 'Product,Requested by,Requested,Ordered,Received,Status\n' \
+            'Agarose,req,2019-01-01,2019-02-01,2019-03-01,received\n'
+        report = importer.import_csv(io.StringIO(content), 'order')
+        self.assertEqual(report.created, 1)
+        # the seeded history of imported orders is not news
+        self.assertEqual(notifications.send().messages, 0)
+        self.assertEqual(len(self.outbox), 0)
+
+        transitions.transition(M.Order.objects.filter(pk=self.orders[0].pk),
+                               'ordered', user=self.manager)
+        self.assertEqual(notifications.send().messages, 1)
+
+    def test_interval_and_errors(self):
+        transitions.transition(M.Order.objects.all(), 'ordered',
+                               user=self.manager)
+        self.assertIsNone(notifications.send_due(minutes=60))
+
+        M.Digest.objects.update(date_sent=timezone.now() - timedelta(hours=2))
+        with patch('django.core.mail.backends.locmem.EmailBackend.'
+                   'send_messages', side_effect=OSError('no server')), \
+                self.assertLogs('labhamster.notifications'):
+            self.assertIsNone(notifications.send_due(minutes=60))
+        self.assertEqual(M.Digest.objects.count(), 1)  # will be retried
+
+        self.assertEqual(notifications.send_due(minutes=60).messages, 1)
+        self.assertEqual(len(self.outbox), 1)
+
+
+class ForecastTest(TestCase):
+
+    def setUp(self):
+        today = date.today()
+        self.start = today - timedelta(days=200)
+        vendor = M.Vendor.objects.create(name='Sigma')
+        category = M.Category.objects.create(name='chemicals')
+        self.products = [M.Product.objects.create(
+            name=name, vendor=vendor, category=category, catalog=name,
+            shelflife=shelflife, status=status)
+            for name, shelflife, status in (('tips', None, 'ok'),
+                                            ('serum', 60, 'ok'),
+                                            ('old', None, 'deprecated'))]
+        tips, serum, old = self.products
+
+        def receive(product, day, quantity=1):
+            received = self.start + timedelta(days=day)
+            make_orders(1, product=product, quantity=quantity,
+                        status='received', date_received=received,
+                        date_ordered=received - timedelta(days=4))
+
+        # tips: 30 and 60 days per unit, then 2 units
+        receive(tips, 0)
+        receive(tips, 30)
+        receive(tips, 90, quantity=2)
+        receive(serum, 150)
+        receive(old, 0)
+        receive(old, 10)
+        make_orders(1, product=serum, status='cancelled')
+        # receiving sets products in stock
+        M.Product.objects.filter(pk=old.pk).update(status='deprecated')
+
+    def test_refresh(self):
+        tips, serum, old = self.products
+        self.assertEqual(forecast.refresh(), 2)
+
+        f = M.ProductForecast.objects.get(product=tips)
+        self.assertEqual((f.receipts, f.quantity, f.days_per_unit,
+                          f.lead_time), (3, 2, 45., 4.))
+        self.assertEqual(f.date_runout, self.start + timedelta(days=180))
+        self.assertIsNone(f.date_expiry)
+        self.assertEqual(f.date_due, self.start + timedelta(days=176))
+
+        f = M.ProductForecast.objects.get(product=serum)
+        self.assertIsNone(f.days_per_unit)
+        self.assertIsNone(f.date_runout)
+        self.assertEqual(f.date_expiry, self.start + timedelta(days=210))
+        self.assertEqual(f.date_due, self.start + timedelta(days=206))
+
+        self.assertFalse(M.ProductForecast.objects.filter(
+            product=old).exists())
+
+    @override_settings(**ADMIN_TEST_SETTINGS)
+    def test_changelist_filter(self):
+        forecast.refresh()
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        response = self.client.get('/labhamster/product/',
+                                   {'reorder': 'overdue'})
+        self.assertEqual(list(response.context_data['cl'].result_list),
+                         [self.products[0]])
+        response = self.client.get('/labhamster/product/', {'reorder': '14'})
+        self.assertEqual(response.context_data['cl'].result_count, 2)
+        self.assertContains(response, 'Reorder by')
+
+    def test_drafts(self):
+        from django.core.management import call_command
+        User.objects.create(username='manager')
+        out = io.StringIO()
+        call_command('forecast_reorders', drafts='manager', stdout=out)
+        self.assertIn('2 product forecasts, 2 due', out.getvalue())
+        self.assertIn('2 draft orders created', out.getvalue())
+
+        draft = M.Order.objects.get(status='draft', product=self.products[0])
+        self.assertEqual((draft.quantity, draft.created_by.username),
+                         (2, 'manager'))
+        self.assertEqual([e.to_status for e in draft.events.all()],
+                         ['draft'])
+
+        # products with open orders are not suggested twice
+        self.assertEqual(forecast.create_drafts(draft.created_by), [])
+
+
+class InventoryTest(TestCase):
+
+    def setUp(self):
+        self.order = make_orders(1, quantity=3)[0]
+        self.product = self.order.product
+        M.Product.objects.filter(pk=self.product.pk).update(
+            quantity_on_hand=0, low_stock_threshold=2)
+
+    def stock(self):
+        return M.Product.objects.values_list(
+            'quantity_on_hand', 'status').get(pk=self.product.pk)
+
+    def test_receive(self):
+        other = make_catalog(1)[0]
+        transitions.transition(
+            M.Order.objects.filter(pk__in=[self.order.pk, other.pk]),
+            'received')
+        self.assertEqual(self.stock(), (3, 'ok'))
+        # stock of the other product isn't counted, status is set by hand
+        self.assertEqual(M.Product.objects.values_list(
+            'quantity_on_hand', 'status').get(pk=other.product_id),
+            (None, 'ok'))
+
+        # receiving an already received order adds nothing
+        transitions.transition(M.Order.objects.all(), 'received')
+        self.assertEqual(self.stock(), (3, 'ok'))
+
+        order = make_orders(1, product=self.product, quantity=2)[0]
+        order.status = 'received'
+        order.save()
+        self.assertEqual(self.stock(), (5, 'ok'))
+
+    def test_consume(self):
+        inventory.receive({self.product.pk: 4})
+        self.assertEqual(inventory.consume(self.product.pk), (3, 'ok'))
+        self.assertEqual(inventory.consume(self.product.pk, 2), (1, 'low'))
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.consume(self.product.pk, 2)
+        self.assertEqual(inventory.consume(self.product.pk), (0, 'out'))
+        with self.assertRaises(ValueError):
+            inventory.consume(self.product.pk, 0)
+
+    def test_refresh_status(self):
+        products = [o.product for o in make_catalog(4)]
+        for p, n, status in zip(products, (0, 1, 5, 5),
+                                ('ok', 'ok', 'low', 'deprecated')):
+            M.Product.objects.filter(pk=p.pk).update(
+                quantity_on_hand=n, status=status)
+        with self.assertNumQueries(1):
+            self.assertEqual(inventory.refresh_status(), 3)
+        self.assertEqual(
+            [M.Product.objects.get(pk=p.pk).status for p in products],
+            ['out', 'low', 'ok', 'deprecated'])
+        # nothing left to change
+        self.assertEqual(inventory.refresh_status(), 0)
+
+    def test_save_keeps_concurrent_count(self):
+        product = M.Product.objects.get(pk=self.product.pk)
+        inventory.receive({product.pk: 5})  # e.g. by another request
+        product.location = 'fridge'
+        product.save()
+        self.assertEqual(self.stock(), (5, 'ok'))
+
+        product.quantity_on_hand = 1  # counted by hand
+        product.save()
+        self.assertEqual(self.stock(), (1, 'low'))
+
+    @override_settings(**ADMIN_TEST_SETTINGS)
+    def test_status_actions(self):
+        other = make_catalog(1)[0].product
+        self.client.force_login(
+            User.objects.create_superuser('admin', '', 'secret'))
+        response = self.client.post('/labhamster/product/', {
+            'action': 'make_ok',
+            '_selected_action': [self.product.pk, other.pk]}, follow=True)
+        self.assertContains(response, '1 products were updated')
+        self.assertContains(response, '1 products with a count on hand')
+        self.assertEqual(self.stock(), (0, 'out'))
+        self.assertEqual(M.Product.objects.get(pk=other.pk).status, 'ok')
+
+    @override_settings(**ADMIN_TEST_SETTINGS)
+    def test_import(self):
+        inventory.receive({self.product.pk: 2})
+        response = export_csv(RequestFactory().get('/'),
+                              M.Product.objects.all(), ProductAdmin.csv_fields)
+        content = b''.join(response.streaming_content).decode()
+        M.Product.objects.all().delete()
+
+        report = importer.import_csv(io.StringIO(content), 'product')
+        self.assertEqual(report.created, 1)
+        self.assertEqual(M.Product.objects.values_list(
+            'quantity_on_hand', 'status').get(), (2, 'low'))
+
+    @override_settings(**ADMIN_TEST_SETTINGS)
+    def test_api(self):
+        inventory.receive({self.product.pk: 2})
+        url = '/api/v1/products/%i/consume/' % self.product.pk
+        User.objects.create_user('bot', '', 'secret', is_staff=True)
+        auth = 'Basic ' + base64.b64encode(b'bot:secret').decode()
+
+        self.assertEqual(self.client.post(url).status_code, 401)
+        response = self.client.post(url, {'units': 1},
+                                    HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.json(), {
+            'id': self.product.pk, 'quantity_on_hand': 1, 'status': 'low'})
+        response = self.client.post(url, json.dumps({'units': 2}),
+                                    content_type='application/json',
+                                    HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(url, {'units': 'x'},
+                                    HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/v1/products/0/consume/',
+                                    HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 404)
+
+        # session users need a CSRF token
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(User.objects.get(username='bot'))
+        self.assertEqual(client.post(url).status_code, 403)
+        self.assertEqual(self.stock(), (1, 'low'))
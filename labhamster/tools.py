@@ -3,6 +3,7 @@
 # This file is part of the LabHamster project (https://github.com/graik/labhamster).
 # LabHamster is released under the MIT open source license, which you can find
 # along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+import re
 
 
 def truncate(s, size):
@@ -10,3 +11,43 @@ def truncate(s, size):
     if len(s) <= size:
         return s
     return s[:size-3] + '...'
+
+
+def normalize_catalog(s):
+    """
+    reduce catalog number to upper-case letters and digits, e.g.
+    'a-1234-05', ' A1234 05' -> 'A123405'
+    """
+    return re.sub(r'[\W_]+', '', s or '', flags=re.UNICODE).upper()
+
+
+def normalize_name(s):
+    """
+    reduce product name to lower case with single spaces, e.g.
+    ' Taq  Polymerase' -> 'taq polymerase'
+    """
+    return ' '.join((s or '').lower().split())
+
+
+def update_catalog_keys(model, batch=500):
+    """
+    Recompute normalized catalog keys of all products.
+    model - Product model class (or its historical version in migrations)
+    @return: int, number of updated products
+    """
+    n = 0
+    last = 0
+    qs = model.objects.order_by('pk').values_list(
+        'pk', 'catalog', 'manufacturer_catalog',
+        'catalog_key', 'manufacturer_catalog_key')
+    while True:
+        rows = list(qs.filter(pk__gt=last)[:batch])
+        for pk, catalog, m_catalog, key, m_key in rows:
+            new = (normalize_catalog(catalog), normalize_catalog(m_catalog))
+            if new != (key, m_key):
+                model.objects.filter(pk=pk).update(
+                    catalog_key=new[0], manufacturer_catalog_key=new[1])
+                n += 1
+        if len(rows) < batch:
+            return n
+        last = rows[-1][0]
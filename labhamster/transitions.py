@@ -0,0 +1,184 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+Order status transitions.
+
+The rules of each status change (which dates are filled in or cleared,
+which product status follows) are defined once in TRANSITIONS and applied
+either to a single Order instance (Order.save) or, set-based, to a whole
+queryset of orders (bulk admin actions) with a fixed number of SQL
+statements inside one transaction. Receiving orders adds their quantity to
+the stock of counted products (see inventory.py). Every status change is
+recorded in the append-only OrderEvent history (one bulk insert per bulk
+transition).
+"""
+from collections import namedtuple
+from datetime import date
+
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.db.models import F, Value, DateField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import caching
+from . import inventory
+from . import metrics
+from . import reports
+from . import stats
+
+#: Outcome of a bulk transition.
+#: changed  - [int], ids of orders whose status was changed
+#: products - [int], ids of the products of these orders
+Result = namedtuple('Result', 'status changed products')
+
+
+class Transition(object):
+    """Side effects of moving an order into one status"""
+
+    def __init__(self, status, fill=(), reset=(), user_field=None,
+                 product_status=None, stock=False):
+        """
+        status         - str, target status of the order
+        fill           - (str,), date fields set to today unless already set
+        reset          - (str,), fields cleared when entering this status
+        user_field     - str, user field set to the user performing the change
+        product_status - str, new status of the ordered product (unless
+                         its stock is counted)
+        stock          - bool, add the quantity ordered to the stock
+        """
+        self.status = status
+        self.fill = fill
+        self.reset = reset
+        self.user_field = user_field
+        self.product_status = product_status
+        self.stock = stock
+
+    def update_kwargs(self, user=None, today=None):
+        """@return: dict, arguments for QuerySet.update()"""
+        today = Value(today or date.today(), output_field=DateField())
+        r = {'status': self.status}
+        r.update({f: Coalesce(F(f), today) for f in self.fill})
+        r.update({f: None for f in self.reset})
+        if self.user_field and user is not None:
+            r[self.user_field] = user
+        return r
+
+    def apply(self, order, changed, today=None):
+        """
+        Set fields of an Order instance (not saved).
+        changed - bool, status is new (not just re-saved)
+        """
+        for f in self.fill:
+            if getattr(order, f) is None:
+                setattr(order, f, today or date.today())
+        if changed:
+            for f in self.reset:
+                setattr(order, f, None)
+
+
+TRANSITIONS = {t.status: t for t in (
+    Transition('draft'),
+    Transition('pending'),
+    Transition('quote'),
+    Transition('ordered', fill=('date_ordered',), user_field='ordered_by'),
+    Transition('received', fill=('date_received',), product_status='ok',
+               stock=True),
+    Transition('cancelled', reset=('date_ordered', 'date_received')),
+)}
+
+
+def transition(queryset, status, user=None):
+    """
+    Move all orders of queryset into given status. Orders already in this
+    status are left untouched.
+    user - User performing the change (recorded as 'ordered by')
+    @return: Result
+    """
+    Order = django_apps.get_model('labhamster', 'Order')
+    Product = django_apps.get_model('labhamster', 'Product')
+    OrderEvent = django_apps.get_model('labhamster', 'OrderEvent')
+    t = TRANSITIONS[status]
+
+    with transaction.atomic():
+        # plain queryset without admin ordering / joins, re-used below
+        pending = Order.objects.filter(pk__in=queryset.values('pk'))\
+            .exclude(status=status).order_by()
+
+        rows = list(pending.select_for_update()
+                    .values_list('pk', 'product', 'status',
+                                 'date_ordered', 'date_created', 'quantity'))
+        if not rows:
+            return Result(status, [], [])
+
+        if t.product_status:
+            Product.objects.filter(pk__in=pending.values('product'),
+                                   quantity_on_hand__isnull=True)\
+                .update(status=t.product_status)
+
+        if t.stock:
+            units = {}
+            for r in rows:
+                units[r[1]] = units.get(r[1], 0) + r[5]
+            inventory.receive(units)
+
+        pending.update(**t.update_kwargs(user=user))
+
+        now = timezone.now()
+        OrderEvent.objects.bulk_create(
+            [OrderEvent(order_id=pk, from_status=previous, to_status=status,
+                        user=user, timestamp=now)
+             for pk, product, previous, ordered, created, quantity in rows])
+
+        products = sorted({r[1] for r in rows})
+        stats.refresh(products)
+
+        months = {reports.order_month(r[3], r[4]) for r in rows}
+        reports.refresh_spend(months | {date.today()})
+
+    # bulk updates bypass the signals invalidating cached counts
+    caching.invalidate('order', 'product')
+    metrics.TRANSITIONS.inc(len(rows), status=status)
+
+    return Result(status, [r[0] for r in rows], products)
+
+
+def before_save(order):
+    """
+    Apply transition rules to an Order instance about to be saved.
+    @return: bool, True if the order is new or changes its status
+    """
+    changed = order.pk is None or order.loaded('status') != order.status
+
+    TRANSITIONS[order.status].apply(order, changed)
+    return changed
+
+
+def after_save(order, changed, user=None):
+    """
+    Apply side effects of a saved status change and record it in the
+    order's status history.
+    changed - bool, result of before_save()
+    user    - User, who saved the order
+    """
+    t = TRANSITIONS[order.status]
+    if changed:
+        OrderEvent = django_apps.get_model('labhamster', 'OrderEvent')
+        OrderEvent.objects.create(
+            order=order, to_status=order.status, user=user,
+            from_status=order.loaded('status') or '')
+
+    if changed and t.product_status:
+        Product = django_apps.get_model('labhamster', 'Product')
+        Product.objects.filter(pk=order.product_id,
+                               quantity_on_hand__isnull=True)\
+            .update(status=t.product_status)
+
+    if changed and t.stock:
+        inventory.receive({order.product_id: order.quantity})
+
+    # the saved state is the new reference for detecting changes
+    order.remember()
@@ -0,0 +1,18 @@
+# Copyright 2016 - 2018 Raik Gruenberg
+
+# This file is part of the LabHamster project (https://github.com/graik/labhamster).
+# LabHamster is released under the MIT open source license, which you can find
+# along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+from django.conf.urls import url
+
+from . import views
+
+RESOURCES = r'(?P<name>orders|products|vendors|grants)'
+
+urlpatterns = [
+    url(r'^v1/%s/$' % RESOURCES, views.api_list, name='api_list'),
+    url(r'^v1/%s/(?P<pk>\d+)/$' % RESOURCES, views.api_detail,
+        name='api_detail'),
+    url(r'^v1/products/(?P<pk>\d+)/consume/$', views.api_consume,
+        name='api_consume'),
+]
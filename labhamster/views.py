@@ -3,3 +3,249 @@
 # This file is part of the LabHamster project (https://github.com/graik/labhamster).
 # LabHamster is released under the MIT open source license, which you can find
 # along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
+"""
+JSON views: the read-only API (see api.py and urls.py), consumption of
+product stock (see inventory.py) and request statistics of the
+performance middleware; Prometheus metrics.
+
+Staff users are authenticated by their admin session or by HTTP basic
+authentication. Checking a password is deliberately slow, so accepted
+credentials are remembered (as a hash, together with the stored password
+hash) in Django's cache for a few minutes.
+"""
+import base64
+import hashlib
+import hmac
+import json
+
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404, HttpResponse, JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_safe
+
+from . import api
+from . import inventory
+from . import metrics as M
+from . import middleware
+
+#: seconds accepted basic authentication credentials are remembered
+AUTH_TIMEOUT = getattr(settings, 'API_AUTH_CACHE_TIMEOUT', 300)
+
+
+def _basic_auth(request):
+    """@return: User from a HTTP basic authorization header or None"""
+    method, _, credentials = \
+        request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if method.lower() != 'basic' or not credentials:
+        return None
+
+    key = 'labhamster-api-auth:' + \
+        hashlib.sha256(credentials.encode('utf-8')).hexdigest()
+    cached = cache.get(key)
+    if cached is not None:
+        pk, password = cached
+        user = get_user_model()._default_manager.filter(pk=pk).first()
+        # a changed password invalidates the cached credentials
+        if user is not None and user.password == password:
+            return user
+
+    try:
+        username, _, password = base64.b64decode(credentials)\
+            .decode('utf-8').partition(':')
+    except (ValueError, UnicodeDecodeError):
+        return None
+    user = authenticate(request, username=username, password=password)
+    if user is not None:
+        cache.set(key, (user.pk, user.password), AUTH_TIMEOUT)
+    return user
+
+
+def api_view(view):
+    """
+    Decorator for API views: GET / HEAD only, staff users only, JSON
+    error responses for ValueError and Http404, conditional GET via ETags.
+    The view returns (etag, content) where content is a callable
+    producing the response data.
+    """
+    @require_safe
+    def wrapper(request, *args, **kwargs):
+        user = request.user if request.user.is_authenticated \
+            else _basic_auth(request)
+        if user is None or not (user.is_active and user.is_staff):
+            response = JsonResponse({'error': 'authentication required'},
+                                    status=401)
+            response['WWW-Authenticate'] = 'Basic realm="labhamster"'
+            return response
+
+        try:
+            etag, content = view(request, *args, **kwargs)
+            etag = quote_etag(etag)
+            if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH',
+                                                    '')):
+                response = HttpResponse(status=304)
+            else:
+                response = JsonResponse(content())
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        except Http404:
+            return JsonResponse({'error': 'not found'}, status=404)
+
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie', 'Authorization'))
+        return response
+
+    return wrapper
+
+
+def _units(request):
+    """@return: int, 'units' of a form or JSON request body [1]"""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body.decode('utf-8') or '{}')
+        except ValueError:
+            raise ValueError('invalid JSON')
+        units = data.get('units', 1) if isinstance(data, dict) else None
+    else:
+        units = request.POST.get('units', 1)
+    try:
+        return int(units)
+    except (TypeError, ValueError):
+        raise ValueError('invalid units')
+
+
+@csrf_exempt
+@require_POST
+def api_consume(request, pk):
+    """
+    Take units (form field or JSON, default 1) of a product from the stock.
+    Session users need a CSRF token, scripts use basic authentication.
+    Responds with the remaining quantity and status, or 409 if fewer
+    units are on hand.
+    """
+    if request.user.is_authenticated:
+        user = request.user
+        csrf = CsrfViewMiddleware()
+        csrf.process_request(request)
+        rejected = csrf.process_view(request, None, (), {})
+        if rejected is not None:
+            return rejected
+    else:
+        user = _basic_auth(request)
+    if user is None or not (user.is_active and user.is_staff):
+        response = JsonResponse({'error': 'authentication required'},
+                                status=401)
+        response['WWW-Authenticate'] = 'Basic realm="labhamster"'
+        return response
+
+    try:
+        quantity, status = inventory.consume(int(pk), _units(request))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    except inventory.OutOfStock as error:
+        return JsonResponse({'error': str(error)}, status=409)
+    except ObjectDoesNotExist:
+        return JsonResponse({'error': 'not found'}, status=404)
+
+    return JsonResponse({'id': int(pk), 'quantity_on_hand': quantity,
+                         'status': status})
+
+
+@api_view
+def api_list(request, name):
+    """
+    Page of a collection. Query parameters: fields (comma-separated),
+    ordering ('id' or 'modified'), limit, cursor (from 'next' of the
+    previous page), modified_since (ISO date or date and time) and the
+    resource's filters.
+    """
+    resource = api.RESOURCES[name]
+    params = request.GET
+    names = resource.select(params.get('fields'))
+
+    ordering = params.get('ordering', 'id')
+    if ordering not in api.ORDERINGS:
+        raise ValueError('ordering must be one of: %s' %
+                         ', '.join(api.ORDERINGS))
+    try:
+        limit = int(params.get('limit', api.LIMIT))
+    except ValueError:
+        raise ValueError('invalid limit')
+    limit = max(1, min(limit, api.MAX_LIMIT))
+
+    queryset = resource.queryset(params)
+    cursor = params.get('cursor')
+    if cursor:
+        key = api.decode_cursor(ordering, cursor)
+        queryset = api.after(resource, queryset, ordering, key)
+
+    # fingerprint of this page only (one row more: is there a next page?)
+    etag = resource.etag(api.ordered(resource, queryset, ordering)[:limit + 1],
+                         names, ordering, limit, sorted(params.lists()))
+
+    def content():
+        rows, next_cursor = api.page(resource, queryset, names, ordering,
+                                     limit)
+        next_url = None
+        if next_cursor:
+            query = params.copy()
+            query['cursor'] = next_cursor
+            next_url = request.build_absolute_uri(
+                '?' + query.urlencode())
+        return {'results': rows, 'next': next_url}
+
+    return etag, content
+
+
+@api_view
+def api_detail(request, name, pk):
+    """Single object. Query parameters: fields (comma-separated)"""
+    resource = api.RESOURCES[name]
+    names = resource.select(request.GET.get('fields'))
+    queryset = resource.model._default_manager.filter(pk=pk).order_by()
+
+    def content():
+        rows = resource.rows(queryset, names)
+        if not rows:
+            raise Http404
+        return rows[0]
+
+    return resource.etag(queryset, names), content
+
+
+def performance(request):
+    """
+    Per view request statistics of this server process (see
+    middleware.PerformanceMiddleware); ?reset=1 starts over.
+    """
+    r = JsonResponse({'views': middleware.aggregates()})
+    if request.GET.get('reset'):
+        middleware.reset()
+    return r
+
+
+def metrics(request):
+    """
+    Prometheus metrics of all server processes (see metrics.py) for staff
+    users or requests with settings.METRICS_TOKEN as bearer token.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    method, _, credentials = \
+        request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if not (token and method.lower() == 'bearer' and
+            hmac.compare_digest(credentials.encode(), token.encode())):
+        user = request.user if request.user.is_authenticated \
+            else _basic_auth(request)
+        if user is None or not (user.is_active and user.is_staff):
+            response = HttpResponse('authentication required\n', status=401,
+                                    content_type='text/plain')
+            response['WWW-Authenticate'] = 'Basic realm="labhamster"'
+            return response
+
+    return HttpResponse(M.exposition(), content_type=M.CONTENT_TYPE)
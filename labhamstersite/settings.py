@@ -48,6 +48,16 @@ DATABASES = {
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
 
+# optional read-only replica for changelists, exports and reports, see
+# labhamster/routers.py; reads stick to the primary for
+# REPLICA_STICKY_SECONDS after a POST
+if os.environ.get('REPLICA_DATABASE_URL'):
+    DATABASES['replica'] = dj_database_url.parse(
+        os.environ['REPLICA_DATABASE_URL'], conn_max_age=500)
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_ROUTERS = ['labhamster.routers.ReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
@@ -79,6 +89,8 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'labhamster.middleware.PerformanceMiddleware',
+    'labhamster.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -149,3 +161,64 @@ DATE_FORMAT = 'Y-m-d'
 
 # restrict available currencies (djmoney aka django-money package)
 CURRENCIES = ('USD', 'SAR', 'GBP', 'EUR')
+
+# currency of converted totals (spend report, product statistics); see
+# ExchangeRate and ./manage.py load_exchange_rates
+BASE_CURRENCY = os.environ.get('BASE_CURRENCY', 'USD')
+
+# cached lookup data (filter and form choices). The default local memory
+# cache is per process; set CACHE_LOCATION (memcached host:port, needs the
+# pylibmc package) to share one cache between server processes
+CACHES = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+if os.environ.get('CACHE_LOCATION'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.PyLibMCCache',
+        'LOCATION': os.environ['CACHE_LOCATION']}
+
+# changelist filters with more choices are shown as a search box
+FILTER_CHOICES_LIMIT = 50
+
+# per-request timing (Server-Timing header, log of slow requests, per view
+# aggregates at /performance/), see labhamster/middleware.py
+PERFORMANCE_INSTRUMENTATION = bool(
+    os.environ.get('PERFORMANCE_INSTRUMENTATION'))
+PERFORMANCE_SLOW_REQUEST_MS = int(
+    os.environ.get('PERFORMANCE_SLOW_REQUEST_MS', 1000))
+
+# Prometheus metrics at /metrics, summed over all server processes through
+# files in METRICS_DIR (empty it on restart); scrapers authenticate with
+# "Authorization: Bearer <METRICS_TOKEN>", see labhamster/metrics.py
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# admin actions (exports, order status changes) over more rows run as
+# background jobs, executed by ./manage.py run_jobs (0: never); finished
+# jobs and their files are kept JOB_KEEP_DAYS
+JOB_QUEUE_THRESHOLD = int(os.environ.get('JOB_QUEUE_THRESHOLD', 5000))
+JOB_KEEP_DAYS = int(os.environ.get('JOB_KEEP_DAYS', 7))
+
+# e-mail digests of order status changes to requesters, sent by the job
+# worker every DIGEST_INTERVAL_MINUTES (see labhamster/notifications.py);
+# SITE_URL (e.g. https://lab.example.com) is used for links in e-mails;
+# events younger than DIGEST_SETTLE_SECONDS wait for the next digest so
+# that transactions still running can commit theirs first
+EMAIL_BACKEND = os.environ.get(
+    'EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = bool(os.environ.get('EMAIL_USE_TLS'))
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL',
+                                    'labhamster@localhost')
+DIGEST_INTERVAL_MINUTES = int(os.environ.get('DIGEST_INTERVAL_MINUTES', 60))
+DIGEST_SETTLE_SECONDS = int(os.environ.get('DIGEST_SETTLE_SECONDS', 60))
+SITE_URL = os.environ.get('SITE_URL', '')
+
+# page the order and product changelists by sort key instead of OFFSET and
+# estimate counts of results with more than ADMIN_COUNT_ESTIMATE_THRESHOLD
+# rows (set ADMIN_KEYSET_PAGINATION=1 for large tables)
+ADMIN_KEYSET_PAGINATION = bool(os.environ.get('ADMIN_KEYSET_PAGINATION'))
+ADMIN_COUNT_ESTIMATE_THRESHOLD = int(
+    os.environ.get('ADMIN_COUNT_ESTIMATE_THRESHOLD', 10000))
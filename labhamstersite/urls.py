@@ -3,9 +3,15 @@
 # This file is part of the LabHamster project (https://github.com/graik/labhamster).
 # LabHamster is released under the MIT open source license, which you can find
 # along with this project (LICENSE) or at <https://opensource.org/licenses/MIT>.
-from django.conf.urls import url
+from django.conf.urls import include, url
 from django.contrib import admin
 
+from labhamster import views
+
 urlpatterns = [
+    url(r'^api/', include('labhamster.urls')),
+    url(r'^performance/$', admin.site.admin_view(views.performance),
+        name='performance'),
+    url(r'^metrics$', views.metrics, name='metrics'),
     url(r'^', admin.site.urls),
 ]